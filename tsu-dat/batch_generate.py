@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+"""Generate Tsu-DAT scenarios from a job file, without the GUI.
+
+Usage: python batch_generate.py [-w <workers>] [-j <jobs>] <job_file>
+
+where <workers>  is the number of scenario jobs to run at once (default 1)
+      <jobs>     is the number of events each job builds at once (default
+                 is the number of cores shared over the workers)
+      <job_file> is the job file
+
+The job file has one section per job:
+
+    [perth_1]
+    scenario = perth_1
+    hp_id = 1234
+    wave_height = 0.5
+    wave_height_delta = 0.05
+    aoi = perth_aoi.csv
+    zone = Sunda
+    events = all
+
+'wave_height_delta' defaults to 0.05 and 'scenario' to the section name.
+'aoi' is a polygon file as imported by the GUI, relative to the job file.
+'events' is 'all' for all events in the zone that match the HP and wave
+height, or a list of event IDs separated by spaces or commas.
+
+Each job runs the same stages as the GUI 'Generate' button.  Jobs for the
+same scenario are run one after the other.  Exits with status 1 if any job
+failed.  The log is ~/tsu-dat_batch.log, so a batch run doesn't empty the
+GUI's log.
+"""
+
+
+import os
+import re
+import sys
+import time
+import getopt
+import threading
+import subprocess
+import traceback
+import ConfigParser
+import Queue
+
+# start our own log first, the log is shared so importing config (through
+# the modules below) then leaves the GUI's log alone
+import log
+log = log.Log(os.path.join(os.path.expanduser('~'), 'tsu-dat_batch.log'))
+
+import dataobj
+import get_hp_events as ghe
+import run_build as rb
+import generate as gen
+
+
+# default wave height delta of a job
+DefaultWaveHeightDelta = 0.05
+
+# pattern to split a list of event IDs
+EventsDelimPattern = re.compile('[, ]+')
+
+
+def read_jobs(job_file):
+    """Read a job file.
+
+    job_file  path to the job file
+
+    Returns a list of DataObj, one per job, in file order.  Raises
+    RuntimeError if a job is badly formed.
+    """
+
+    parser = ConfigParser.RawConfigParser()
+    try:
+        if not parser.read(job_file):
+            raise RuntimeError("Can't read job file '%s'" % job_file)
+    except ConfigParser.Error, e:
+        raise RuntimeError("Error in job file '%s': %s" % (job_file, str(e)))
+    job_dir = os.path.dirname(os.path.abspath(job_file))
+
+    jobs = []
+    for name in parser.sections():
+        def get(option, default=None):
+            if parser.has_option(name, option):
+                return parser.get(name, option).strip()
+            if default is None:
+                raise RuntimeError("Job '%s' has no '%s' value"
+                                   % (name, option))
+            return default
+
+        try:
+            hp_id = int(get('hp_id'))
+            wave_height = float(get('wave_height'))
+            wave_height_delta = float(get('wave_height_delta',
+                                          str(DefaultWaveHeightDelta)))
+            events = get('events')
+            if events.lower() == 'all':
+                events = None
+            else:
+                events = [int(x) for x in EventsDelimPattern.split(events)
+                          if x]
+        except ValueError, e:
+            raise RuntimeError("Job '%s' has a bad value: %s"
+                               % (name, str(e)))
+
+        jobs.append(dataobj.DataObj(name=name,
+                                    scenario=get('scenario', name),
+                                    hp_id=hp_id,
+                                    wave_height=wave_height,
+                                    wave_height_delta=wave_height_delta,
+                                    aoi=os.path.join(job_dir, get('aoi')),
+                                    zone=get('zone'),
+                                    events=events))
+
+    return jobs
+
+
+def job_events(job):
+    """Get the event IDs of a job, querying them if the job says 'all'."""
+
+    if job.events is not None:
+        return job.events
+
+    events = ghe.query_hp_events(job.hp_id,
+                                 job.wave_height - job.wave_height_delta,
+                                 job.wave_height + job.wave_height_delta,
+                                 job.zone)
+    return [int(x) for x in events.event_id]
+
+
+def run_job(job, hp_points, prepare_lock, build_jobs=None):
+    """Run one scenario job.
+
+    job           DataObj from read_jobs()
+    hp_points     list of (lon, lat, id) of all HPs
+    prepare_lock  lock held while preparing and finishing the job
+    build_jobs    number of events to build at once (None for default)
+
+    Returns True if the scenario was generated.  Raises RuntimeError on
+    a job error.
+    """
+
+    aoi_polygon = gen.read_aoi_polygon(job.aoi)
+    hp_inside_bb = gen.hps_inside_aoi(hp_points, aoi_polygon)
+    if not hp_inside_bb:
+        raise RuntimeError('No hazard points inside the area of interest')
+
+    (min_wh, max_wh) = gen.wave_height_band(job.wave_height,
+                                            job.wave_height_delta)
+    paths = gen.scenario_paths(job.scenario, job.hp_id, min_wh, max_wh)
+
+    # the stages before and after the build share the multimux index and
+    # the fault tables, do them one job at a time
+    prepare_lock.acquire()
+    try:
+        selected_events = job_events(job)
+        if not selected_events:
+            raise RuntimeError('No events selected')
+        gen.prepare(paths, job.hp_id, min_wh, max_wh, selected_events,
+                    hp_inside_bb)
+        cmd = gen.build_command(paths, selected_events, sys.executable,
+                                build_jobs)
+    finally:
+        prepare_lock.release()
+
+    log("Job '%s': building %d events in %s"
+        % (job.name, len(selected_events), paths.gen_dir))
+    returncode = subprocess.call(cmd, cwd=paths.gen_dir)
+
+    prepare_lock.acquire()
+    try:
+        gen.finish(paths, selected_events)
+    finally:
+        prepare_lock.release()
+
+    return returncode == 0
+
+
+def job_runner(queue, hp_points, prepare_lock, scenario_locks, build_jobs,
+               failed):
+    """Thread body: run jobs from a queue until a None arrives.
+
+    queue           queue of jobs
+    hp_points       list of (lon, lat, id) of all HPs
+    prepare_lock    lock held while preparing and finishing a job
+    scenario_locks  dictionary of scenario name to lock
+    build_jobs      number of events to build at once (None for default)
+    failed          list to append the names of failed jobs to
+    """
+
+    while True:
+        job = queue.get()
+        if job is None:
+            break
+
+        start = time.time()
+        lock = scenario_locks[job.scenario]
+        lock.acquire()
+        try:
+            try:
+                ok = run_job(job, hp_points, prepare_lock, build_jobs)
+            except RuntimeError, msg:
+                log("Job '%s' failed: %s" % (job.name, str(msg)))
+                ok = False
+            except Exception:
+                log("Job '%s' failed:\n%s"
+                    % (job.name, traceback.format_exc()))
+                ok = False
+        finally:
+            lock.release()
+
+        if ok:
+            print("Job '%s' finished in %.0f seconds"
+                  % (job.name, time.time() - start))
+        else:
+            print("Job '%s' FAILED, see the log" % job.name)
+            failed.append(job.name)
+
+
+def run_jobs(jobs, workers=1, build_jobs=None):
+    """Run scenario jobs, up to 'workers' at once.
+
+    jobs        list of DataObj from read_jobs()
+    workers     number of jobs to run at once
+    build_jobs  number of events each job builds at once (None for the
+                number of cores shared over the workers)
+
+    Returns a list of the names of failed jobs.
+    """
+
+    workers = max(1, min(workers, len(jobs)))
+    if build_jobs is None:
+        build_jobs = max(1, rb.default_jobs() // workers)
+
+    hp_points = gen.read_hazard_points()
+    prepare_lock = threading.Lock()
+    scenario_locks = {}
+    for job in jobs:
+        scenario_locks[job.scenario] = threading.Lock()
+
+    queue = Queue.Queue()
+    for job in jobs:
+        queue.put(job)
+    failed = []
+    threads = []
+    for _ in range(workers):
+        queue.put(None)
+        t = threading.Thread(target=job_runner,
+                             args=(queue, hp_points, prepare_lock,
+                                   scenario_locks, build_jobs, failed))
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    return failed
+
+
+if __name__ == '__main__':
+    try:
+        (opts, args) = getopt.getopt(sys.argv[1:], 'w:j:')
+        opts = dict(opts)
+        workers = int(opts.get('-w', 1))
+        build_jobs = None
+        if '-j' in opts:
+            build_jobs = int(opts['-j'])
+    except (getopt.GetoptError, ValueError), e:
+        print(str(e))
+        print(__doc__)
+        sys.exit(10)
+
+    if len(args) != 1:
+        print(__doc__)
+        sys.exit(10)
+
+    try:
+        jobs = read_jobs(args[0])
+    except RuntimeError, msg:
+        print(str(msg))
+        sys.exit(10)
+
+    failed = run_jobs(jobs, workers, build_jobs)
+    if failed:
+        print('Failed jobs: %s' % ', '.join(failed))
+        sys.exit(1)
@@ -0,0 +1,580 @@
+#!/usr/bin/env python
+
+"""A long-lived local process that runs builds with the build code loaded.
+
+Running 'python run_build.py' for each generate means a new interpreter
+importing ANUGA, Scientific and NumPy every time, which takes seconds.  The
+daemon imports them once, then runs each build in a forked child process
+that starts with everything loaded.
+
+The daemon runs a thread per client, and forking a threaded process can
+leave the child waiting forever on a lock another thread held at the fork
+(in a log, a Queue or the C library).  So the build children are forked by
+a forker process, forked from the daemon before it starts any threads and
+never starting any itself.  The daemon passes it each build's output pipe,
+and the child writes its exit status to the pipe last.
+
+Usage: python build_daemon.py <address> <key_file>
+
+where <address>   is the daemon endpoint, a Unix socket path (or a Windows
+                  named pipe)
+      <key_file>  is the file holding the daemon authentication key, made if
+                  it doesn't exist
+
+A client sends requests over a multiprocessing.connection Connection:
+
+    ('ping',)                   reply ('pong', DaemonVersion, code stamp)
+    ('shutdown',)               reply ('bye',), exit when builds finish
+    ('build', cwd, argv)        run run_build.main(argv) in directory cwd,
+                                reply each stdout line as a string, then
+                                ('exit', status)
+
+The daemon exits after IdleTimeout seconds with no builds.
+
+Clients use submit() to get a DaemonProcess, which looks enough like a
+subprocess.Popen object for ExecuteAndTailLogfile.  This module must not
+import config, the GUI log would be reset.
+
+The daemon only works where build children are forked with the loaded
+code and pipes can be passed between processes (not Windows, and not
+Python 2.5 without multiprocessing), else submit() returns None and the
+caller runs a subprocess.
+"""
+
+
+import os
+import sys
+import time
+import signal
+import socket
+import threading
+import traceback
+import subprocess
+try:
+    import multiprocessing
+    import multiprocessing.connection as mpc
+    import multiprocessing.reduction as mpr
+except ImportError:
+    # Python 2.5
+    mpc = None
+
+import manifest as mf
+import run_build as rb
+
+
+# bump this if the request protocol changes
+DaemonVersion = 1
+
+# modules whose source must match the daemon's loaded code
+CodeModules = ['run_build.py', 'build_urs_boundary.py', 'sts_cache.py',
+               'manifest.py', 'cost_model.py', 'progress.py', 'log.py',
+               'build_daemon.py']
+
+# seconds with no builds before the daemon exits
+IdleTimeout = 60 * 60
+
+# seconds to wait for a started daemon to answer
+StartTimeout = 30
+
+# True if build children can be forked by the forker process
+Supported = (mpc is not None and hasattr(os, 'fork')
+             and hasattr(mpr, 'send_handle'))
+
+# a build child writes this and its exit status as the last output line
+ExitMarker = '\0exit '
+
+# directory this code is in
+CodeDir = os.path.dirname(os.path.abspath(__file__))
+
+def code_stamp():
+    """Get a fingerprint of the build code on disk."""
+
+    stamps = []
+    for name in CodeModules:
+        try:
+            stamps.append(mf.stat_fingerprint(os.path.join(CodeDir, name)))
+        except OSError:
+            stamps.append(None)
+
+    return mf.fingerprint(*stamps)
+
+
+def address_family(address):
+    """Get the multiprocessing.connection family for an address."""
+
+    if address.startswith('\\\\'):
+        return 'AF_PIPE'
+    return 'AF_UNIX'
+
+
+def endpoint_id(address):
+    """Get (device, inode) of a Unix socket endpoint, None if there isn't one.
+
+    Tells a daemon's own socket from one a newer daemon made at the address.
+    """
+
+    if address_family(address) != 'AF_UNIX':
+        return None
+    try:
+        st = os.stat(address)
+    except OSError:
+        return None
+
+    return (st.st_dev, st.st_ino)
+
+
+def read_key(key_file, make=False):
+    """Read the daemon authentication key.
+
+    key_file  path to the key file
+    make      if True, make a new key file if there isn't one
+
+    Returns the key string, or None if there is no key file.
+    """
+
+    if make and not os.path.exists(key_file):
+        fd = os.open(key_file, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0600)
+        os.write(fd, os.urandom(16).encode('hex'))
+        os.close(fd)
+
+    try:
+        f = open(key_file, 'r')
+        key = f.read().strip()
+        f.close()
+    except IOError:
+        return None
+
+    return key
+
+
+######
+# The daemon
+######
+
+class Daemon(object):
+    """The daemon state."""
+
+    def __init__(self, address, authkey, forker=None):
+        """Listen on an address.
+
+        address  the daemon endpoint
+        authkey  the authentication key
+        forker   the Forker starting build children
+        """
+
+        self.address = address
+        self.forker = forker
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_active = time.time()
+        self.stopping = False
+        self.stamp = code_stamp()
+
+        family = address_family(address)
+        if family == 'AF_UNIX' and os.path.exists(address):
+            # left by a daemon that died, or one running old code that is
+            # finishing its builds (it keeps its connections)
+            os.remove(address)
+        self.listener = mpc.Listener(address, family, authkey=authkey)
+        self.endpoint = endpoint_id(address)
+
+    def serve(self):
+        """Accept clients until stopped."""
+
+        t = threading.Thread(target=self.watchdog)
+        t.setDaemon(True)
+        t.start()
+
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (IOError, EOFError, mpc.AuthenticationError):
+                continue
+            t = threading.Thread(target=self.serve_client, args=(conn,))
+            t.setDaemon(True)
+            t.start()
+
+    def watchdog(self):
+        """Thread body: exit when stopping or idle, and no builds running."""
+
+        while True:
+            time.sleep(1.0)
+            self.lock.acquire()
+            try:
+                idle = time.time() - self.last_active > IdleTimeout
+                if not self.active and (self.stopping or idle):
+                    self.exit()
+            finally:
+                self.lock.release()
+
+    def exit(self):
+        """Remove the endpoint and exit now."""
+
+        # a newer daemon may have the address now, only remove our own
+        # (closing the listener removes the address)
+        if endpoint_id(self.address) == self.endpoint:
+            try:
+                self.listener.close()
+            except (IOError, OSError):
+                pass
+            if os.path.exists(self.address):
+                os.remove(self.address)
+        os._exit(0)
+
+    def serve_client(self, conn):
+        """Thread body: handle one client request."""
+
+        try:
+            request = conn.recv()
+            if request[0] == 'ping':
+                conn.send(('pong', DaemonVersion, self.stamp))
+            elif request[0] == 'shutdown':
+                self.stopping = True
+                conn.send(('bye',))
+            elif request[0] == 'build':
+                (_, cwd, argv) = request
+                self.build(conn, cwd, argv)
+        except (IOError, EOFError, ValueError, IndexError):
+            pass
+        conn.close()
+
+    def build(self, conn, cwd, argv):
+        """Run a build in a child process, sending its output to a client."""
+
+        self.lock.acquire()
+        try:
+            if self.stopping:
+                conn.send(('exit', None))
+                return
+            self.active += 1
+        finally:
+            self.lock.release()
+
+        try:
+            (read_fd, write_fd) = os.pipe()
+            try:
+                try:
+                    self.forker.start(cwd, argv, write_fd)
+                except:
+                    os.close(read_fd)
+                    raise
+            finally:
+                os.close(write_fd)
+
+            # keep reading if the client goes away, so the build can finish
+            connected = True
+            status = None
+            f = os.fdopen(read_fd, 'r')
+            for line in iter(f.readline, ''):
+                i = line.find(ExitMarker)
+                if i >= 0:
+                    status = exit_status(line[i+len(ExitMarker):])
+                    line = line[:i]
+                if line and connected:
+                    try:
+                        conn.send(line)
+                    except IOError:
+                        connected = False
+            f.close()
+            if connected:
+                conn.send(('exit', status))
+        finally:
+            self.lock.acquire()
+            self.active -= 1
+            self.last_active = time.time()
+            self.lock.release()
+
+
+def exit_status(text):
+    """Get the exit status from the text after an ExitMarker."""
+
+    try:
+        return int(text.strip())
+    except ValueError:
+        return None
+
+
+class Forker(object):
+    """A single-threaded process forking the build children."""
+
+    def __init__(self):
+        """Fork the forker process.
+
+        Call this before starting any threads, so the forker has none.
+        """
+
+        (self.conn, child_conn) = multiprocessing.Pipe()
+        self.lock = threading.Lock()
+        self.pid = os.fork()
+        if self.pid == 0:
+            self.conn.close()
+            forker(child_conn)
+        child_conn.close()
+
+    def start(self, cwd, argv, write_fd):
+        """Start a build child.
+
+        cwd       directory to run the build in
+        argv      run_build.py command line arguments
+        write_fd  file descriptor for the build's stdout, the caller still
+                  closes its copy
+        """
+
+        self.lock.acquire()
+        try:
+            self.conn.send((cwd, argv))
+            mpr.send_handle(self.conn, write_fd, self.pid)
+        finally:
+            self.lock.release()
+
+
+def forker(conn):
+    """Forker process body: fork a build child for each request.
+
+    conn  Connection to the daemon, the forker exits when it closes
+    """
+
+    # finished children are reaped by the system
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    while True:
+        try:
+            (cwd, argv) = conn.recv()
+            fd = mpr.recv_handle(conn)
+        except (IOError, EOFError, OSError):
+            os._exit(0)
+        if os.fork() == 0:
+            conn.close()
+            build_child(cwd, argv, fd)
+        os.close(fd)
+
+
+def build_child(cwd, argv, fd):
+    """Process body: run one build with stdout going to a pipe.
+
+    With -p run_build.main() keeps the pipe for progress messages and sends
+    its other output to stderr.  The exit status is written to the pipe
+    last, after an ExitMarker.
+    """
+
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    os.dup2(fd, 1)
+    os.chdir(cwd)
+
+    status = 1
+    try:
+        status = rb.main(argv)
+    except SystemExit, e:
+        status = e.code
+    except:
+        traceback.print_exc()
+    if status is None:
+        status = 0
+    elif not isinstance(status, int):
+        status = 1
+
+    # exit now, this process is a fork of the forker
+    sys.stdout.flush()
+    rb.stop_flusher()
+    os.write(fd, '%s%d\n' % (ExitMarker, status))
+    os._exit(status)
+
+
+def preload():
+    """Import the slow build modules, so each build child has them."""
+
+    try:
+        rb.builder()
+    except ImportError:
+        # a build will report this
+        pass
+
+
+######
+# Client side
+######
+
+def connect(address, key_file):
+    """Connect to the daemon.
+
+    Returns a Connection, or None if there is no daemon.
+    """
+
+    key = read_key(key_file)
+    if key is None or mpc is None:
+        return None
+    try:
+        return mpc.Client(address, address_family(address), authkey=key)
+    except (socket.error, IOError, OSError, EOFError,
+            mpc.AuthenticationError):
+        return None
+
+
+def request(address, key_file, *req):
+    """Send a request to the daemon and get the reply, None if no daemon."""
+
+    conn = connect(address, key_file)
+    if conn is None:
+        return None
+    try:
+        conn.send(req)
+        return conn.recv()
+    except (IOError, EOFError):
+        return None
+    finally:
+        conn.close()
+
+
+def start(address, key_file, python=None):
+    """Start a daemon and wait until it answers.
+
+    Returns True if the daemon is running.
+    """
+
+    if python is None:
+        python = sys.executable
+    read_key(key_file, make=True)
+
+    devnull = open(os.devnull, 'w')
+    subprocess.Popen([python, os.path.join(CodeDir, 'build_daemon.py'),
+                      address, key_file], cwd=CodeDir, close_fds=True,
+                     stdin=open(os.devnull, 'r'), stdout=devnull,
+                     stderr=devnull)
+    devnull.close()
+
+    stop = time.time() + StartTimeout
+    while time.time() < stop:
+        if request(address, key_file, 'ping') is not None:
+            return True
+        time.sleep(0.1)
+
+    return False
+
+
+def ensure(address, key_file, python=None):
+    """Get a daemon running the current code, starting one if required.
+
+    Returns True if the daemon is running.
+    """
+
+    reply = request(address, key_file, 'ping')
+    if reply == ('pong', DaemonVersion, code_stamp()):
+        return True
+
+    if reply is not None:
+        # running old code, replace it when its builds finish
+        request(address, key_file, 'shutdown')
+        stop = time.time() + StartTimeout
+        while time.time() < stop and os.path.exists(address):
+            time.sleep(0.1)
+
+    return start(address, key_file, python)
+
+
+class DaemonOutput(object):
+    """The stdout of a daemon build, as a file-like object."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.status = None
+        self.closed = False
+
+    def readline(self):
+        """Get the next output line, '' at the end."""
+
+        if self.closed:
+            return ''
+        try:
+            msg = self.conn.recv()
+        except (IOError, EOFError):
+            msg = ('exit', None)
+        if isinstance(msg, tuple):
+            (_, self.status) = msg
+            self.close()
+            return ''
+
+        return msg
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.conn.close()
+
+
+class DaemonProcess(object):
+    """A build running in the daemon, looking like a subprocess.Popen."""
+
+    def __init__(self, conn, cwd, argv):
+        """Start the build.
+
+        conn  a Connection to the daemon
+        cwd   directory to run the build in
+        argv  run_build.py command line arguments
+        """
+
+        conn.send(('build', cwd, argv))
+        self.stdout = DaemonOutput(conn)
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        """Wait for the build to finish, returns the exit status.
+
+        The exit status is 1 if the daemon went away.
+        """
+
+        while self.stdout.readline():
+            pass
+        self.returncode = self.stdout.status
+        if self.returncode is None:
+            self.returncode = 1
+
+        return self.returncode
+
+
+def submit(address, key_file, cwd, argv, python=None):
+    """Run a build in the daemon, starting the daemon if required.
+
+    address   the daemon endpoint
+    key_file  the daemon key file
+    cwd       directory to run the build in
+    argv      run_build.py command line arguments
+    python    interpreter to start the daemon with
+
+    Returns a DaemonProcess, or None if the daemon can't be used.
+    """
+
+    if not Supported:
+        return None
+
+    try:
+        if not ensure(address, key_file, python):
+            return None
+    except (IOError, OSError):
+        return None
+
+    conn = connect(address, key_file)
+    if conn is None:
+        return None
+    try:
+        return DaemonProcess(conn, cwd, argv)
+    except IOError:
+        return None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print(__doc__)
+        sys.exit(10)
+
+    (address, key_file) = sys.argv[1:]
+
+    # only one daemon on an address
+    if request(address, key_file, 'ping') is not None:
+        sys.exit(0)
+
+    preload()
+    forker_process = Forker()
+    Daemon(address, read_key(key_file, make=True), forker_process).serve()
@@ -3,84 +3,231 @@ Replacement function that wraps the legacy function urs2sts()
 and passes in the data from the Tsu-DAT generated <event>.list file.
 """
 
+from __future__ import with_statement
+
 import os
 import os.path
-from time import localtime, strftime, gmtime
+import glob
 from Scientific.IO.NetCDF import NetCDFFile
 import numpy as num
 
+import sts_cache
+import cost_model
+from log import Timings
 from anuga.shallow_water.data_manager import urs2sts
 
 
 log = None
 
+# basename of the per-event gauge files
+GaugeBasename = 'sts_gauge'
+
+# quantities saved for each gauge, gauge-major in <GaugeBasename>_<name>.npy
+GaugeQuantities = ['stage', 'xmomentum', 'ymomentum']
+
+# number of STS time steps read at a time, bounds memory use
+STSTimeBlock = 256
+
+# name of the STS file in an STS cache entry
+CachedSTSName = 'boundary.sts'
+
+
+#-------------------------------------------------------------------------------
+# Write a max/min stage summary file for all gauges
+#-------------------------------------------------------------------------------
+def write_stage_summary(filename, index, x, y, stage):
+    """Write a stage summary CSV file in one block.
+
+    filename  path to the file to write
+    index     array of gauge index (permutation) numbers
+    x, y      arrays of gauge positions
+    stage     array of summary stage values, one per gauge
+    """
+
+    lines = ['%d, %.6f, %.6f, %.6f\n' % row
+             for row in zip(index.tolist(), x.tolist(), y.tolist(),
+                            stage.tolist())]
+
+    fd = open(filename, 'w')
+    fd.write('index, x, y, max_stage \n')
+    fd.write(''.join(lines))
+    fd.close()
+
+
+#-------------------------------------------------------------------------------
+# Gauge timeseries files
+#-------------------------------------------------------------------------------
+def gauge_path(event_folder, name):
+    """Get path to a gauge file in an event folder.
+
+    event_folder  path to the event folder
+    name          'index', 'time' or a name in GaugeQuantities
+    """
+
+    return os.path.join(event_folder, '%s_%s.npy' % (GaugeBasename, name))
+
+
+def load_gauge(event_folder, gauge_index):
+    """Get the timeseries for one gauge from the .npy gauge files.
+
+    event_folder  path to the event folder
+    gauge_index   index (permutation) number of the gauge
+
+    Returns a dictionary of arrays keyed by 'time' and GaugeQuantities names.
+    Only the gauge's row of each quantity file is read.
+    """
+
+    index = num.load(gauge_path(event_folder, 'index'))
+    rows = num.flatnonzero(index == gauge_index)
+    if len(rows) == 0:
+        msg = 'Gauge %d not found in %s' % (gauge_index, event_folder)
+        raise Exception, msg
+    row = rows[0]
+
+    result = {'time': num.load(gauge_path(event_folder, 'time'))}
+    for name in GaugeQuantities:
+        data = num.load(gauge_path(event_folder, name), mmap_mode='r')
+        result[name] = num.array(data[row])
+
+    return result
+
+
+def write_gauge_csvs(event_folder):
+    """Write the timeseries of each gauge to its own CSV file.
+
+    event_folder  path to the event folder holding the .npy gauge files
+
+    The gauge data is memory-mapped and read one gauge at a time.
+    """
+
+    index = num.load(gauge_path(event_folder, 'index'))
+    times = num.load(gauge_path(event_folder, 'time'))[:-1].tolist()
+    data = [num.load(gauge_path(event_folder, name), mmap_mode='r')
+            for name in ('stage', 'xmomentum', 'ymomentum')]
+
+    for j in range(len(index)):
+        out_file = os.path.join(event_folder,
+                                GaugeBasename+'_'+str(index[j])+'.csv')
+        rows = [d[j,:-1].tolist() for d in data]
+        lines = ['%.6f, %.6f, %.6f, %.6f\n' % row
+                 for row in zip(times, *rows)]
+
+        fid_sts = open(out_file, 'w')
+        fid_sts.write('time, stage, xmomentum, ymomentum \n')
+        fid_sts.write(''.join(lines))
+        fid_sts.close()
+
 
 #-------------------------------------------------------------------------------
 # Get gauges (timeseries of index points)
 #-------------------------------------------------------------------------------
-def get_sts_gauge_data(filename, event_folder, verbose=False):
+def get_sts_gauge_data(filename, event_folder, verbose=False,
+                       gauge_csv=False, time_block=STSTimeBlock):
+    """Get gauge data from an STS file and write gauge files.
+
+    filename      path to the STS file, without the '.sts' extension
+    event_folder  path to the event folder to write to
+    verbose       UNUSED
+    gauge_csv     if True also write a sts_gauge_<index>.csv file per gauge
+    time_block    number of time steps to read from the STS file at a time
+
+    Writes the max/min stage summary files and the gauge timeseries .npy
+    files, one gauge per row.  The STS quantities are streamed 'time_block'
+    steps at a time, so memory use doesn't grow with the STS file size.
+
+    Returns (quantities, elevation, time) where quantities is a dictionary
+    of memory-mapped (num_gauges, num_times) arrays.
+    """
+
     log('get_sts_gauge_data: filename=%s' % filename)
     fid = NetCDFFile(filename+'.sts', 'r')      #Open existing file for read
     permutation = fid.variables['permutation'][:]
     x = fid.variables['x'][:] + fid.xllcorner   #x-coordinates of vertices
     y = fid.variables['y'][:] + fid.yllcorner   #y-coordinates of vertices
-    points = num.transpose(num.asarray([x.tolist(), y.tolist()]))
     time = fid.variables['time'][:] + fid.starttime
     elevation = fid.variables['elevation'][:]
-       
-    basename = 'sts_gauge'
-    quantity_names = ['stage', 'xmomentum', 'ymomentum']
-    quantities = {}
-    for i, name in enumerate(quantity_names):
-        quantities[name] = fid.variables[name][:]
+
+    num_times = len(time)
+    num_gauges = len(x)
+    if num_times == 0:
+        msg = 'STS file %s.sts has no time steps' % filename
+        raise Exception, msg
+
+    num.save(gauge_path(event_folder, 'index'), num.asarray(permutation))
+    num.save(gauge_path(event_folder, 'time'), num.asarray(time))
 
     #---------------------------------------------------------------------------
-    # Get maximum wave height throughout timeseries at each index point
+    # Walk the quantities a block of time steps at a time, copying into the
+    # gauge-major .npy files and keeping the running max/min stage
     #---------------------------------------------------------------------------
-     
-    maxname = 'max_sts_stage.csv'
-    log('get_sts_gauge_data: maxname=%s' % maxname)
-    fid_max = open(os.path.join(event_folder, maxname), 'w')
-    fid_max.write('index, x, y, max_stage \n')    
-    for j in range(len(x)):
-        index = permutation[j]
-        stage = quantities['stage'][:,j]
-        xmomentum = quantities['xmomentum'][:,j]
-        ymomentum = quantities['ymomentum'][:,j]
-
-        fid_max.write('%d, %.6f, %.6f, %.6f\n' % (index, x[j], y[j], max(stage)))
-      
+
+    outputs = {}
+    max_stage = None
+    min_stage = None
+    for start in range(0, num_times, time_block):
+        stop = min(start+time_block, num_times)
+        for name in GaugeQuantities:
+            block = fid.variables[name][start:stop]
+            if name not in outputs:
+                outputs[name] = \
+                    num.lib.format.open_memmap(gauge_path(event_folder, name),
+                                               mode='w+', dtype=block.dtype,
+                                               shape=(num_gauges, num_times))
+            outputs[name][:,start:stop] = num.transpose(block)
+
+            if name == 'stage':
+                if max_stage is None:
+                    max_stage = block.max(axis=0)
+                    min_stage = block.min(axis=0)
+                else:
+                    max_stage = num.maximum(max_stage, block.max(axis=0))
+                    min_stage = num.minimum(min_stage, block.min(axis=0))
+            del block
+
+    for name in GaugeQuantities:
+        outputs[name].flush()
+    del outputs
+
+    fid.close()
+
     #---------------------------------------------------------------------------
-    # Get minimum wave height throughout timeseries at each index point
+    # Write maximum and minimum wave height throughout timeseries at each
+    # index point
     #---------------------------------------------------------------------------
 
+    maxname = 'max_sts_stage.csv'
+    log('get_sts_gauge_data: maxname=%s' % maxname)
+    write_stage_summary(os.path.join(event_folder, maxname),
+                        permutation, x, y, max_stage)
+
     minname = 'min_sts_stage.csv'
-    fid_min = open(os.path.join(event_folder, minname), 'w')
-    fid_min.write('index, x, y, max_stage \n')    
-    for j in range(len(x)):
-        index = permutation[j]
-        stage = quantities['stage'][:,j]
-        xmomentum = quantities['xmomentum'][:,j]
-        ymomentum = quantities['ymomentum'][:,j]
+    write_stage_summary(os.path.join(event_folder, minname),
+                        permutation, x, y, min_stage)
 
-        fid_min.write('%d, %.6f, %.6f, %.6f\n' %(index, x[j], y[j], min(stage)))
+    if gauge_csv:
+        write_gauge_csvs(event_folder)
 
-        out_file = os.path.join(event_folder, basename+'_'+str(index)+'.csv')
-        fid_sts = open(out_file, 'w')
-        fid_sts.write('time, stage, xmomentum, ymomentum \n')
+    quantities = {}
+    for name in GaugeQuantities:
+        quantities[name] = num.load(gauge_path(event_folder, name),
+                                    mmap_mode='r')
 
-        #-----------------------------------------------------------------------
-        # End of the get gauges
-        #-----------------------------------------------------------------------
-        for k in range(len(time)-1):
-            fid_sts.write('%.6f, %.6f, %.6f, %.6f\n'
-                          % (time[k], stage[k], xmomentum[k], ymomentum[k]))
+    return quantities,elevation,time
 
-        fid_sts.close()      
 
-    fid.close()
+def output_files(event_folder, output_dir):
+    """Get paths of all existing build outputs for an event.
 
-    return quantities,elevation,time
+    event_folder  path to the event folder
+    output_dir    basename of the STS file
+    """
+
+    result = glob.glob(output_dir+'.sts')
+    for name in ('max_sts_stage.csv', 'min_sts_stage.csv'):
+        result.extend(glob.glob(os.path.join(event_folder, name)))
+    result.extend(glob.glob(os.path.join(event_folder, GaugeBasename+'_*')))
+
+    return result
 
 
 ##
@@ -89,8 +236,23 @@ def get_sts_gauge_data(filename, event_folder, verbose=False):
 # @param output_dir Directory to write STS data to.
 # @note 'event_file' is produced by EventSelection.
 def build_urs_boundary(event_file, output_dir, multi_mux, event_folder,
-                       mux_data_folder, urs_order, scenario_name):
-    '''Build a boundary STS file from a set of MUX files.'''
+                       mux_data_folder, urs_order, scenario_name,
+                       gauge_csv=False, cache_dir=None,
+                       cache_size=None):
+    '''Build a boundary STS file from a set of MUX files.
+
+    If gauge_csv is True also write a CSV file for each gauge.
+    If cache_dir is given, reuse the outputs of an earlier build with the
+    same MUX files, weights and urs_order file from the STS cache there, and
+    cache new outputs, limiting the cache to cache_size bytes.
+
+    Returns a dictionary of build statistics for the cost model:
+        'sources'    number of MUX sources
+        'gauges'     number of boundary gauges
+        'mux_bytes'  total size of the MUX files
+        'cached'     True if the outputs came from the STS cache
+        'spans'      dictionary of operation name to (wall, cpu) seconds
+    '''
 
     # if we are using an EventSelection multi-mux file
     if multi_mux:
@@ -118,27 +280,10 @@ def build_urs_boundary(event_file, output_dir, multi_mux, event_folder,
                    % (event_file, len(mux_data), num_lines))
             raise Exception, msg
 
-        # Create filename and weights lists.
-        # Must chop GRD filename just after '.grd'.
-        mux_filenames = []
-        for line in mux_data:
-            muxname = line.strip().split()[0]
-            split_index = muxname.index('.grd')
-            muxname = muxname[:split_index+len('.grd')]
-            muxname = os.path.join(mux_data_folder, muxname)
-            mux_filenames.append(muxname)
-        
-        mux_weights = [float(line.strip().split()[1]) for line in mux_data]
-
-        # Call legacy function to create STS file.
-        log('creating sts file:')
-        log('urs2sts(%s, %s, %s, ...)'
-                  % (mux_filenames, output_dir, urs_order))
-        urs2sts(mux_filenames,
-                basename_out=output_dir,
-                ordering_filename=urs_order,
-                weights=mux_weights,
-                verbose=True)
+        # Create filename and weights lists, the same way the STS cache
+        # does.  Must chop GRD filename just after '.grd'.
+        (mux_filenames, mux_weights) = sts_cache.mux_sources(mux_data,
+                                                             mux_data_folder)
     else:                           # a single mux stem file, assume 1.0 weight
         mux_file = os.path.join(event_folder, event_file)
         mux_filenames = [mux_file]
@@ -146,25 +291,70 @@ def build_urs_boundary(event_file, output_dir, multi_mux, event_folder,
 
         weight_factor = 1.0
         mux_weights = weight_factor*num.ones(len(mux_filenames), num.Float)
-            
-        order_filename = urs_order
 
-        log('reading %s' % order_filename)
-        # Create ordered sts file
+    stats = {'sources': len(mux_filenames),
+             'gauges': 0,
+             'mux_bytes': cost_model.mux_bytes(mux_filenames),
+             'cached': False,
+             'spans': {}}
+    timings = Timings()
+
+    # see if we have built this before
+    sts_file = os.path.join(event_folder, scenario_name)
+    if cache_dir:
+        key = sts_cache.cache_key(mux_filenames, mux_weights, urs_order,
+                                  gauge_csv)
+        if sts_cache.fetch(cache_dir, key, event_folder,
+                           {CachedSTSName: scenario_name+'.sts'}):
+            log('using cached STS data %s' % key)
+            log('build_urs_boundary: finished')
+            log('*' * 80)
+            log('')
+            stats['cached'] = True
+            return stats
+
+    # remove any old outputs, older versions linked them into the cache
+    for path in output_files(event_folder, output_dir):
+        os.remove(path)
+
+    # Call legacy function to create STS file.
+    log('creating sts file:')
+    log('urs2sts(%s, %s, %s, ...)'
+              % (mux_filenames, output_dir, urs_order))
+    with timings.span('urs2sts'):
         urs2sts(mux_filenames,
                 basename_out=output_dir,
-                ordering_filename=order_filename,
+                ordering_filename=urs_order,
                 weights=mux_weights,
                 verbose=True)
 
     # report on progress so far
-    sts_file = os.path.join(event_folder, scenario_name)
-    quantities, elevation, time = get_sts_gauge_data(sts_file,
-                                                     event_folder,
-                                                     verbose=False)
+    with timings.span('get_sts_gauge_data'):
+        quantities, elevation, time = get_sts_gauge_data(sts_file,
+                                                         event_folder,
+                                                         verbose=False,
+                                                         gauge_csv=gauge_csv)
     log("%d eleveation values,  %d 'stage' quantities"
-        % (len(elevation), len(quantities['stage'][0,:])))
+        % (len(elevation), len(quantities['stage'])))
+    stats['gauges'] = len(quantities['stage'])
+    del quantities
+
+    if cache_dir:
+        files = []
+        for path in output_files(event_folder, output_dir):
+            name = os.path.basename(path)
+            if path == output_dir+'.sts':
+                name = CachedSTSName
+            files.append((path, name))
+        sts_cache.store(cache_dir, key, files, cache_size)
+        log('cached STS data %s' % key)
+
+    # operation times, for the run summary
+    for (name, _, wall, cpu, _, _, _) in timings.summary():
+        stats['spans'][name] = (wall, cpu)
 
     log('build_urs_boundary: finished')
     log('*' * 80)
     log('')
+
+    return stats
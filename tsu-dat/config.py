@@ -21,6 +21,9 @@ AppVersion = '1.0'
 # log details
 LogFilename = '%s.log' % AppNameLower
 DefaultLogLevel = log.Log.DEBUG
+LogCaller = True            # False to not log the calling module and line
+LogBackground = True        # True to write log lines in a background thread
+LogLatency = 0.5            # most seconds before a line is in the log file
 
 # set data base directory for each particular platform
 if sys.platform == 'win32':
@@ -75,8 +78,12 @@ quake_base = os.path.join(DataBase, 'earthquake_data')
 MultimuxDirectory = os.path.join(quake_base, 'multimux')
 MuxDirectory = os.path.join(quake_base, 'mux')
 TFilesDirectory = os.path.join(quake_base, 'Tfiles')
+TFileCacheDirectory = os.path.join(quake_base, 'Tfiles_cache')
 DeagPointsDirectory = os.path.join(DataBase, 'deag_points')
 TilesDirectory = os.path.join(DataBase, 'tiles.PUBLISH')
+TileCacheSize = 128           # map tile cache budget in MB
+TilePrefetchWorkers = 2       # map tile prefetch threads, 0 for none
+TilePrefetchRing = 1          # tiles prefetched around the map view
 HazardPointsFile = os.path.join(DataBase, 'hazard.points')
 ReturnPeriodsFile = os.path.join(DataBase, 'return_periods.txt')
 WaveAmplitudeFile = os.path.join(quake_base, 'hazmap_files', 'hazard_maps',
@@ -104,13 +111,34 @@ InvallFilename = 'i_invall'
 FaultXYFilename = 'fault.xy'
 QuakeProbFilename = 'quake_prob.txt'
 
+# name of the generated STS boundary cache directory in GenSaveDir,
+# and the cache size limit in MB
+STSCacheDirname = 'sts_cache'
+STSCacheSize = 2048
+
+# True to also write each gauge's timeseries as a CSV file
+# (sts_gauge_<index>.csv) beside the .npy gauge files
+GaugeCSV = False
+
 # path to the user guide
 UserGuideFile = os.path.join(AppBase, 'Tsu-DAT_User_Guide.pdf')
 
 # set up log file
 HomeDir = os.path.expanduser('~')
 LogPath = os.path.join(HomeDir, LogFilename)
-log = log.Log(LogPath, DefaultLogLevel, append=False)
+
+# history of event build times on this machine, for the build cost model
+BuildHistoryFile = os.path.join(HomeDir, '.%s_build_times' % AppNameLower)
+
+# the build daemon endpoint and key file, the daemon keeps the build code
+# loaded between generates (set UseBuildDaemon False to run each build in
+# a new process).  The daemon needs fork(), so not on Windows.
+UseBuildDaemon = (sys.platform != 'win32')
+BuildDaemonAddress = os.path.join(HomeDir, '.%s_build_daemon' % AppNameLower)
+BuildDaemonKeyFile = os.path.join(HomeDir,
+                                  '.%s_build_daemon.key' % AppNameLower)
+log = log.Log(LogPath, DefaultLogLevel, append=False, caller=LogCaller,
+              background=LogBackground, latency=LogLatency)
 
 # log some values here - debug
 log('')
@@ -122,6 +150,7 @@ log('PATH=%s' % os.getenv('PATH'))
 log('MultimuxDirectory=%s' % MultimuxDirectory)
 log('MuxDirectory=%s' % MuxDirectory)
 log('TFilesDirectory=%s' % TFilesDirectory)
+log('TFileCacheDirectory=%s' % TFileCacheDirectory)
 log('DeagPointsDirectory=%s' % DeagPointsDirectory)
 log('TilesDirectory=%s' % TilesDirectory)
 log('HazardPointsFile=%s' % HazardPointsFile)
@@ -130,5 +159,7 @@ log('WaveAmplitudeFile=%s' % WaveAmplitudeFile)
 log('SubfaultIdZoneFile=%s' % SubfaultIdZoneFile)
 log('EventID2ZoneFile=%s' % EventID2ZoneFile)
 log('EventTFile=%s' % EventTFile)
+log('BuildHistoryFile=%s' % BuildHistoryFile)
+log('BuildDaemonAddress=%s' % BuildDaemonAddress)
 log('')
 
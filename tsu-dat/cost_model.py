@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""A measured model of event build times on this machine.
+
+run_build.py appends one line per built event to a history file:
+
+    <sources>,<gauges>,<mux_bytes>,<seconds>
+
+and refits the model after each run.  The model is a least squares fit of
+
+    seconds = c0 + c1 * mux_MB + c2 * sources * gauges
+
+saved beside the history file.  The GUI uses it to estimate generation time.
+
+This module is copied into the generate directory with run_build.py,
+so it must not import config.
+"""
+
+
+import os
+import glob
+
+import numpy as num
+
+
+# extension of the model file, beside the history file
+ModelExtension = '.model'
+
+# use at most this many of the latest history records in a fit
+HistorySize = 500
+
+# need at least this many history records to fit a model
+MinHistory = 6
+
+
+def mux_bytes(mux_filenames):
+    """Get the total size of the MUX files for a set of MUX stems.
+
+    mux_filenames  list of MUX stem paths, the files are <stem>*
+    """
+
+    size = 0
+    for stem in mux_filenames:
+        for path in glob.glob(stem+'*'):
+            size += os.path.getsize(path)
+
+    return size
+
+
+def event_features(event_file, mux_dir, num_gauges):
+    """Get the model features for an event from its event file.
+
+    event_file  path to the event's event.lst file
+    mux_dir     path to the MUX directory
+    num_gauges  number of boundary gauges (HPs in the urs_order file)
+
+    Returns a tuple (sources, gauges, mux_bytes).
+    """
+
+    fd = open(event_file, 'r')
+    lines = fd.readlines()
+    fd.close()
+
+    sources = int(lines[0].strip())
+    stems = []
+    for line in lines[1:sources+1]:
+        muxname = line.strip().split()[0]
+        if '.grd' in muxname:
+            muxname = muxname[:muxname.index('.grd')+len('.grd')]
+        stems.append(os.path.join(mux_dir, muxname))
+
+    return (sources, num_gauges, mux_bytes(stems))
+
+
+def features(sources, gauges, mux_bytes):
+    """Get the model feature row for one event."""
+
+    return [1.0, mux_bytes / (1024.0*1024.0), float(sources) * gauges]
+
+
+def record(history_file, sources, gauges, mux_bytes, seconds):
+    """Append one event build time to the history file."""
+
+    fd = open(history_file, 'a')
+    fd.write('%d,%d,%d,%.3f\n' % (sources, gauges, mux_bytes, seconds))
+    fd.close()
+
+
+def read_history(history_file):
+    """Get the latest history records as a list of (s, g, b, seconds)."""
+
+    result = []
+    try:
+        fd = open(history_file, 'r')
+        lines = fd.readlines()
+        fd.close()
+    except IOError:
+        return result
+
+    for line in lines[-HistorySize:]:
+        try:
+            (s, g, b, t) = line.strip().split(',')
+            result.append((int(s), int(g), int(b), float(t)))
+        except ValueError:
+            continue
+
+    return result
+
+
+def fit(history_file):
+    """Fit the model to the history and save it beside the history file.
+
+    Returns the model coefficients, or None if there is too little history
+    to fit (any old model file is left alone).
+    """
+
+    history = read_history(history_file)
+    if len(history) < MinHistory:
+        return None
+
+    a = num.array([features(s, g, b) for (s, g, b, _) in history])
+    t = num.array([t for (_, _, _, t) in history])
+    try:
+        (coeffs, _, rank, _) = num.linalg.lstsq(a, t)
+    except num.linalg.LinAlgError:
+        return None
+    if rank < a.shape[1]:
+        # the history doesn't vary enough, use the mean time
+        coeffs = num.array([t.mean()] + [0.0]*(a.shape[1]-1))
+
+    fd = open(history_file+ModelExtension, 'w')
+    fd.write(' '.join(['%r' % c for c in coeffs.tolist()]) + '\n')
+    fd.close()
+
+    return coeffs.tolist()
+
+
+def load_model(history_file):
+    """Get the saved model coefficients, None if there is no model."""
+
+    try:
+        fd = open(history_file+ModelExtension, 'r')
+        coeffs = [float(x) for x in fd.read().split()]
+        fd.close()
+    except (IOError, ValueError):
+        return None
+
+    if len(coeffs) != len(features(0, 0, 0)):
+        return None
+
+    return coeffs
+
+
+def predict(coeffs, sources, gauges, mux_bytes):
+    """Predict the build time in seconds for one event."""
+
+    row = features(sources, gauges, mux_bytes)
+    return max(0.0, sum([c*x for (c, x) in zip(coeffs, row)]))
+
+
+def estimate(coeffs, events, jobs=1):
+    """Estimate the wall time to build a set of events.
+
+    coeffs  model coefficients
+    events  list of (sources, gauges, mux_bytes), one per event
+    jobs    number of events built at once
+
+    Events are assumed to be shared evenly over the jobs, but we can't
+    finish before the longest event.
+    """
+
+    times = [predict(coeffs, *e) for e in events]
+    if not times:
+        return 0.0
+
+    return max(max(times), sum(times) / max(1, min(jobs, len(times))))
@@ -1,36 +1,63 @@
 #!/usr/bin/env python
 
-"""A class to execute a standalone process and 'tail' a logfile for viewing."""
+"""A class to execute a standalone process and show its progress.
 
+The process may write progress messages (see progress.py) to stdout.  These
+are read by a background thread and posted to the dialog as wx events, so
+the GUI stays responsive without polling.  Other stdout lines are shown as
+log text.
+"""
 
-import os
+
+import threading
+import traceback
 import subprocess
-import time
 import wx
+import wx.lib.newevent
+
+import progress as pg
+
+
+# events posted by the reader thread
+(ProgressEvent, EVT_PROGRESS) = wx.lib.newevent.NewEvent()
+(FinishedEvent, EVT_FINISHED) = wx.lib.newevent.NewEvent()
 
 
 class ExecuteAndTailLogfile(wx.Dialog):
-    """A dialog to execute a command and tail a produced logfile."""
+    """A dialog to execute a command and show its progress and log."""
 
     def __init__(self, parent, cmd, logfile, title, *args, **kwargs):
-        """Execute a command as a subprocess and tail a file.
+        """Execute a command as a subprocess and show its progress.
 
         parent   reference to parent widget
         cmd      a string or list of strings defining the command to execute
                  (see subprocess.Popen() documentation)
-        logfile  path to the logfile to monitor
+        logfile  path to the logfile the command writes, shown when the
+                 command finishes if it sent no log text to stdout
         title    title string for dialog window
         env      if supplied, the environment to pass to the subprocess
-
-        Waits until the subprocess finishes, then enables the 'OK' button.
+        process  if supplied, an already started process to show instead
+                 of running 'cmd' (needs .stdout.readline(), .wait() and
+                 .returncode, like a subprocess.Popen object)
+        start    if supplied, a function called on the reader thread that
+                 starts and returns such a process, or returns None to run
+                 'cmd' (for slow starts that would freeze the GUI)
+
+        Returns at once.  The 'OK' button is enabled when the subprocess
+        finishes, then .returncode is its return code.
         """
 
+        env = kwargs.pop('env', None)
+        process = kwargs.pop('process', None)
+        self.start = kwargs.pop('start', None)
         if kwargs.has_key('style'):
             del kwargs['style']
         kwargs['style'] = wx.CAPTION |  wx.CLIP_CHILDREN
         wx.Dialog.__init__(self, parent, title=title, *args, **kwargs)
 
         # draw the gui
+        self.txt_status = wx.StaticText(self, label='Starting ...')
+        self.gauge = wx.Gauge(self, range=100, size=(800, -1))
         self.txt_log = wx.TextCtrl(self, size=(800,400), style=wx.TE_MULTILINE)
         self.btn_ok = wx.Button(self, label='OK')
         self.btn_ok.Bind(wx.EVT_BUTTON, self.onOk)
@@ -38,58 +65,146 @@ class ExecuteAndTailLogfile(wx.Dialog):
 
         sb = wx.StaticBox(self,  wx.ID_ANY, label='')
         hbox = wx.StaticBoxSizer(sb, orient=wx.VERTICAL)
+        hbox.Add(self.txt_status, flag=wx.EXPAND|wx.ALL, border=5)
+        hbox.Add(self.gauge, flag=wx.EXPAND|wx.ALL, border=5)
         hbox.Add(self.txt_log, proportion=1, flag=wx.EXPAND|wx.ALL, border=5)
         hbox.Add(self.btn_ok, flag=wx.ALIGN_RIGHT|wx.ALL, border=5)
 
         self.SetSizerAndFit(hbox)
-        self.Show()
-        wx.Yield()
+
+        self.Bind(EVT_PROGRESS, self.onProgress)
+        self.Bind(EVT_FINISHED, self.onFinished)
 
         self.cmd = cmd
         self.logfile = logfile
+        self.returncode = None
+        self.total = None
+        self.done = 0
+        self.got_log = False
+
+        # start subprocess, reading its stdout in a background thread
+        self.env = env
+        self.process = process
+        if self.process is None and self.start is None:
+            self.process = subprocess.Popen(self.cmd, stdout=subprocess.PIPE,
+                                            env=env)
+        self.reader = threading.Thread(target=self.readOutput)
+        self.reader.setDaemon(True)
+        self.reader.start()
+
+    def readOutput(self):
+        """Thread body: post each stdout line to the dialog, then the end.
+
+        The end is always posted, so the dialog can be closed.  If the
+        process can't be started or read, the error is shown as log text
+        and the return code is -1.
+        """
 
-        # start subprocess - the stdout/stderr redirection ignores any prints
-        p = subprocess.Popen(self.cmd)
-#        p = subprocess.Popen(self.cmd, stdout=subprocess.PIPE,
-#                             stderr=subprocess.PIPE)
-
-        # wait until logfile is produced
-        file_size = 0
-        while True:
+        returncode = -1
+        try:
+            try:
+                if self.process is None:
+                    if self.start is not None:
+                        self.process = self.start()
+                    if self.process is None:
+                        self.process = subprocess.Popen(self.cmd,
+                                                        stdout=subprocess.PIPE,
+                                                        env=self.env)
+
+                for line in iter(self.process.stdout.readline, ''):
+                    msg = pg.parse(line)
+                    if msg is None:
+                        msg = {'stage': pg.Log, 'text': line}
+                    wx.PostEvent(self, ProgressEvent(msg=msg))
+                self.process.stdout.close()
+                self.process.wait()
+                returncode = self.process.returncode
+            except Exception:
+                msg = {'stage': pg.Log,
+                       'text': 'Error running the command:\n%s'
+                               % traceback.format_exc()}
+                wx.PostEvent(self, ProgressEvent(msg=msg))
+        finally:
+            wx.PostEvent(self, FinishedEvent(returncode=returncode))
+
+    def onProgress(self, event):
+        """Show a message from the subprocess."""
+
+        msg = event.msg
+        stage = msg['stage']
+
+        if stage == pg.Log:
+            self.got_log = True
+            self.appendLogText(msg.get('text', ''))
+            return
+
+        if 'percent' in msg:
+            self.gauge.SetValue(int(msg['percent']))
+        if stage == pg.Start:
+            self.total = msg.get('total', None)
+            status = 'Building %s events' % self.total
+        elif stage == pg.Build:
+            status = 'Building event %d' % msg['event']
+        elif stage in (pg.Done, pg.Failed):
+            self.done += 1
+            status = 'Event %d %s' % (msg['event'],
+                                      'FAILED' if stage == pg.Failed
+                                      else 'done')
+        elif stage == pg.Finished:
+            status = 'Finished'
+            if msg.get('failed', None):
+                status = ('Finished, FAILED events: %s'
+                          % ', '.join([str(x) for x in msg['failed']]))
+        else:
+            return
+
+        if self.total is not None and stage != pg.Finished:
+            status += ' (%d of %d finished)' % (self.done, self.total)
+        if msg.get('eta', None) and stage != pg.Finished:
+            status += ', about %s left' % pg.format_eta(msg['eta'])
+        self.txt_status.SetLabel(status)
+
+    def onFinished(self, event):
+        """The subprocess has finished, enable the 'OK' button."""
+
+        self.returncode = event.returncode
+
+        # show the logfile if the process didn't send its log to us
+        if not self.got_log:
             try:
                 fd = open(self.logfile)
+                self.appendLogText(fd.read())
+                fd.close()
             except IOError:
-                time.sleep(0.1)
-            else:
-                break
-
-        wx.Yield()
-
-        # read logfile, copy to TextCtrl
-        while p.poll() is None:
-            time.sleep(0.01)
-            size = os.stat(self.logfile).st_size
-            if size > file_size:
-                lines = fd.read(size - file_size).strip()
-                lines = lines.split('\n')
-                for line in lines:
-                    if '|' in line:
-                        (_, line) = line.split('|', 1)
-                    self.txt_log.AppendText(line+'\n')
-                file_size = size
-            wx.Yield()
-
-        self.returncode = p.returncode
+                pass
+
+        if self.returncode != 0:
+            self.txt_status.SetLabel('%s (return code %s)'
+                                     % (self.txt_status.GetLabel(),
+                                        self.returncode))
 
         self.btn_ok.Enable(True)
         self.btn_ok.Refresh()
 
+    def appendLogText(self, text):
+        """Append lines of logfile text to the TextCtrl."""
+
+        text = text.strip()
+        if not text:
+            return
+
+        for line in text.split('\n'):
+            if '|' in line:
+                (_, line) = line.split('|', 1)
+            self.txt_log.AppendText(line+'\n')
+
     def onOk(self, event=None):
         self.Hide()
 
 ################################################################################
 
 if __name__ == '__main__':
+    import os
     import sys
 
     class MyFrame(wx.Frame):
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+
+"""The scenario generation pipeline, without any GUI.
+
+A scenario is generated in stages:
+    list_quakes   write fault.xy and quake_prob.txt for the HP and WH band
+    multimux      write boundaries/<event>/event.lst for each event
+    urs_order     write boundaries/urs_order.csv of HPs inside the AOI
+    run_build     build the STS boundary for each event (a subprocess)
+    split         split fault.xy into boundaries/<event>/event_<event>.xy
+
+Each stage is recorded in the scenario manifest, so a re-run skips work
+already done.  Used by the GUI and by batch_generate.py.
+"""
+
+
+import os
+import re
+import shutil
+
+import config as cfg
+import util
+import dataobj
+import polygon
+import list_quakes as lq
+import multimux as mmx
+import manifest as mf
+import sts_cache
+import run_build as rb
+import log
+log = log.Log()
+
+
+# files copied to the results directory to run the build there
+BuildFiles = ['run_build.py', 'config.py', 'build_urs_boundary.py',
+              'sts_cache.py', 'manifest.py', 'cost_model.py', 'progress.py',
+              'log.py']
+
+# name of the build log file in the results directory
+BuildLogFilename = 'build_urs_boundary.log'
+
+# wave height band limits
+MinWaveHeight = 0.0
+MaxWaveHeight = 10.0
+
+# pattern to split AOI file fields on one ',' or multiple spaces
+AOIDelimPattern = re.compile(',| +')
+
+
+def wave_height_band(wh, wh_delta):
+    """Get the (min, max) wave height band for a wave height and delta.
+
+    The band is limited to [MinWaveHeight, MaxWaveHeight].
+    """
+
+    return (max(wh-wh_delta, MinWaveHeight), min(wh+wh_delta, MaxWaveHeight))
+
+
+def read_aoi_polygon(filename):
+    """Read an area of interest polygon file.
+
+    filename  path to file of 'lon,lat' or 'lon lat' lines
+
+    Returns a closed list of (lon, lat).  Raises RuntimeError if the file
+    can't be read, is badly formatted or has eastings and northings.
+    """
+
+    basename = os.path.basename(filename)
+    try:
+        fd = open(filename, 'r')
+        lines = fd.readlines()
+        fd.close()
+    except IOError, e:
+        msg = "Can't open file '%s': %s" % (filename, str(e))
+        raise RuntimeError(msg)
+
+    result = []
+    for (i, oline) in enumerate(lines):
+        line = oline.strip()
+        if not line or line[0] == '#':
+            continue
+        fields = AOIDelimPattern.split(line)
+        try:
+            lon = float(fields[0])
+            lat = float(fields[1])
+        except (IndexError, ValueError):
+            msg = ("File '%s' has a bad format on line %d: %s"
+                   % (basename, i+1, oline))
+            raise RuntimeError(msg)
+        if lon > 360.0 or lat > 90.0:
+            msg = ('Looks like %s has eastings and northings.  You can only '
+                   'use files containing longitude and latitude.' % basename)
+            raise RuntimeError(msg)
+        result.append((lon, lat))
+
+    if not result:
+        msg = "File '%s' has no polygon points" % basename
+        raise RuntimeError(msg)
+
+    # ensure polygon is closed
+    if result[0] != result[-1]:
+        result.append(result[0])
+
+    return result
+
+
+def read_hazard_points(filename=None):
+    """Read the hazard points file.
+
+    filename  path to the hazard points file (cfg.HazardPointsFile if None)
+
+    Returns a list of (lon, lat, id).
+    """
+
+    if filename is None:
+        filename = cfg.HazardPointsFile
+
+    return [(x[0], x[1], int(x[2])) for x in util.readPointsFile(filename)]
+
+
+def hps_inside_aoi(hp_points, aoi_polygon):
+    """Get the hazard points inside an area of interest.
+
+    hp_points    list of (lon, lat, id) of all HPs
+    aoi_polygon  closed list of (lon, lat)
+
+    Returns a list of (id, lon, lat) in hp_points order.
+    """
+
+    result = []
+    for (x, y, id) in hp_points:
+        if polygon.point_in_poly(x, y, aoi_polygon):
+            result.append((id, x, y))
+
+    return result
+
+
+def scenario_paths(scenario_name, hp_id, min_wh, max_wh):
+    """Get the paths used to generate a scenario.
+
+    Returns a DataObj with attributes:
+        scenario_name   the scenario name
+        results_dir     name of the results directory
+        base_dir        the scenario directory
+        gen_dir         the results directory
+        boundaries_dir  the scenario boundaries directory
+        faultxy         the fault.xy file
+        quakeprob       the quake_prob.txt file
+        urs_order       the urs_order.csv file
+        manifest        the scenario manifest file
+        build_log       the run_build log file
+    """
+
+    results_dir = cfg.ResultsDirMask % (hp_id, min_wh, max_wh)
+    base_dir = os.path.join(cfg.GenSaveDir, scenario_name)
+    gen_dir = os.path.join(base_dir, results_dir)
+    boundaries_dir = os.path.join(base_dir, 'boundaries')
+
+    return dataobj.DataObj(scenario_name=scenario_name,
+                           results_dir=results_dir,
+                           base_dir=base_dir,
+                           gen_dir=gen_dir,
+                           boundaries_dir=boundaries_dir,
+                           faultxy=os.path.join(gen_dir, cfg.FaultXYFilename),
+                           quakeprob=os.path.join(gen_dir,
+                                                  cfg.QuakeProbFilename),
+                           urs_order=os.path.join(boundaries_dir,
+                                                  'urs_order.csv'),
+                           manifest=os.path.join(base_dir,
+                                                 mf.ManifestFilename),
+                           build_log=os.path.join(gen_dir, BuildLogFilename))
+
+
+def prepare(paths, hp_id, min_wh, max_wh, selected_events, hp_inside_bb):
+    """Do the stages before the build: list_quakes, multimux and urs_order.
+
+    paths            DataObj from scenario_paths()
+    hp_id            the hazard point ID
+    min_wh, max_wh   the wave height band
+    selected_events  list of event IDs
+    hp_inside_bb     list of (id, lon, lat) of HPs inside the AOI
+
+    Stages already done with the same inputs are skipped.  Also copies the
+    build files to the results directory.  Raises RuntimeError on error.
+    """
+
+    # keep any earlier results, the manifest says what can be reused
+    try:
+        if not os.path.isdir(paths.gen_dir):
+            os.makedirs(paths.gen_dir)
+    except OSError, e:
+        msg = ('Error making directory:\n%s\n%s' % (paths.gen_dir, str(e)))
+        raise RuntimeError(msg)
+
+    # get path to and check existence of data files
+    msg = ''
+    hazard_file = os.path.join(cfg.TFilesDirectory, 'T-%05d' % hp_id)
+    if not os.path.isfile(hazard_file):
+        msg += "Hazard file %s doesn't exist!?" % hazard_file
+    invall_file = os.path.join(cfg.MultimuxDirectory, cfg.InvallFilename)
+    if not os.path.isfile(invall_file):
+        msg += "Invall file %s doesn't exist!?" % invall_file
+    if msg:
+        raise RuntimeError(msg)
+
+    # the record of stages already done for this scenario
+    manifest = mf.Manifest(paths.manifest)
+
+    # now actually get quake data
+    lq_stage = 'list_quakes:%s' % paths.results_dir
+    lq_fp = mf.fingerprint(hp_id, min_wh, max_wh,
+                           mf.stat_fingerprint(invall_file),
+                           mf.stat_fingerprint(hazard_file))
+    if manifest.is_done(lq_stage, lq_fp):
+        log('prepare: list_quakes() already done')
+    else:
+        try:
+            lq.list_quakes(hp_id, min_wh, max_wh, invall_file,
+                           hazard_file, paths.faultxy, paths.quakeprob)
+        except RuntimeError, msg:
+            raise RuntimeError('Error in list_quakes(): %s' % msg)
+        manifest.done(lq_stage, lq_fp, [paths.faultxy, paths.quakeprob])
+
+    try:
+        fault_names = mmx.read_fault_names()
+        mmx_fp = mf.fingerprint(mmx.index_stamp(fault_names))
+        mmx_events = [event_id for event_id in selected_events
+                      if not manifest.is_done('multimux:%d' % event_id,
+                                              mmx_fp)]
+        mmx.multimux_events(mmx_events, paths.base_dir)
+    except RuntimeError, msg:
+        raise RuntimeError('Error in multimux(): %s' % msg)
+    for e in mmx_events:
+        event_file = os.path.join(paths.boundaries_dir, str(e), cfg.EventFile)
+        manifest.done('multimux:%d' % e, mmx_fp, [event_file], save=False)
+    manifest.save()
+    log('prepare: multimux() done for %d of %d events'
+        % (len(mmx_events), len(selected_events)))
+
+    # create urs_order.csv containing HPs inside bounding box
+    urs_order_fp = mf.fingerprint(hp_inside_bb)
+    if not manifest.is_done('urs_order', urs_order_fp):
+        if not os.path.isdir(paths.boundaries_dir):
+            os.makedirs(paths.boundaries_dir)
+        fd = open(paths.urs_order, 'w')
+        fd.write('index,longitude,latitude\n')
+        for bbhp in hp_inside_bb:
+            fd.write('%d,%f,%f\n' % bbhp)
+        fd.close()
+        manifest.done('urs_order', urs_order_fp, [paths.urs_order])
+
+    # copy required files to 'gen_dir'
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for filename in BuildFiles:
+        shutil.copy(os.path.join(code_dir, filename), paths.gen_dir)
+
+
+def sts_cache_dir():
+    """Get the STS cache directory, cached across scenarios in GenSaveDir."""
+
+    return os.path.abspath(os.path.join(cfg.GenSaveDir, cfg.STSCacheDirname))
+
+
+def events_to_build(paths, selected_events):
+    """Get the events the build will actually have to build.
+
+    paths            DataObj from scenario_paths()
+    selected_events  list of event IDs
+
+    Leaves out events the manifest records as built from the same inputs
+    and events whose outputs are in the STS cache, which take next to no
+    time.  Used to estimate the generation time.
+    """
+
+    manifest = mf.Manifest(paths.manifest)
+    mux_dir = os.path.abspath(cfg.MuxDirectory)
+    cache_dir = sts_cache_dir()
+
+    result = []
+    for event_id in selected_events:
+        (stage, fp) = rb.build_fingerprint(paths.scenario_name, cfg.GenSaveDir,
+                                           mux_dir, cfg.EventFile, event_id,
+                                           cfg.GaugeCSV)
+        if fp and manifest.is_done(stage, fp):
+            continue
+        event_file = os.path.join(paths.boundaries_dir, str(event_id),
+                                  cfg.EventFile)
+        key = sts_cache.event_cache_key(event_file, mux_dir, paths.urs_order,
+                                        cfg.GaugeCSV)
+        if key and sts_cache.contains(cache_dir, key):
+            continue
+        result.append(event_id)
+
+    return result
+
+
+def build_command(paths, selected_events, python='python', jobs=None,
+                  progress=False):
+    """Get the command to run the build, to be run in paths.gen_dir.
+
+    paths            DataObj from scenario_paths()
+    selected_events  list of event IDs
+    python           the python interpreter to use
+    jobs             number of events to build at once (None for default)
+    progress         if True, the build writes progress messages to stdout
+
+    Also removes any old build log.  Returns a list of command strings.
+    """
+
+    try:
+        os.remove(paths.build_log)
+    except OSError:
+        pass
+
+    # figure out full mux directory path (required for Windows)
+    mux_dir = os.path.abspath(cfg.MuxDirectory)
+
+    cmd = [python, 'run_build.py',
+           '-c', sts_cache_dir(), '-s', str(cfg.STSCacheSize),
+           '-m', paths.manifest, '-t', cfg.BuildHistoryFile]
+    if jobs:
+        cmd.extend(['-j', str(jobs)])
+    if progress:
+        cmd.append('-p')
+    if cfg.GaugeCSV:
+        cmd.append('-g')
+    cmd.extend([paths.build_log, paths.scenario_name,
+                cfg.GenSaveDir, cfg.AppName, mux_dir, cfg.EventFile])
+    cmd.extend([str(x) for x in selected_events])
+
+    return cmd
+
+
+def split_fault_xy(fault_xy_file, boundaries_dir, event_list):
+    """Split generated fault.xy file into boundaries/<ID>/event_<ID>.xy.
+
+    fault_xy_file   path to generated fault.xy file
+    boundaries_dir  path to 'boundaries' directory
+    event_list      list of event IDs used to generate fault.xy
+    """
+
+    # read the fault.xy file into memory
+    f = open(fault_xy_file, 'r')
+    fxy_lines = f.readlines()
+    f.close()
+
+    fxy_header = fxy_lines[0]
+    split_lines = []
+    for l in fxy_lines[1:]:
+        l = l.strip()
+        split_lines.append(l.split(','))
+
+    # for each eventID, get subfaults and strip lines into split file
+    for id in event_list:
+        # make the split file
+        split_file = os.path.join(boundaries_dir, str(id),
+                                  'event_%05d.xy' % id)
+        sf = open(split_file, 'w')
+        sf.write(fxy_header)
+
+        for sl in split_lines:
+            (lon, lat, quake_id, subfault_id) = sl
+            quake_id = int(quake_id)
+            if quake_id == id:
+                sf.write('%s,%s,%d,%s\n'
+                         % (lon, lat, quake_id, subfault_id))
+        sf.close()
+
+
+def finish(paths, selected_events):
+    """Do the stage after the build: split fault.xy for each event.
+
+    paths            DataObj from scenario_paths()
+    selected_events  list of event IDs
+
+    Events already split from the same fault.xy file are skipped.
+    """
+
+    # reload the manifest, run_build will have updated it
+    manifest = mf.Manifest(paths.manifest)
+    split_fp = mf.file_fingerprint(paths.faultxy)
+    split_events = [e for e in selected_events
+                    if not manifest.is_done('split:%d' % e, split_fp)]
+    split_fault_xy(paths.faultxy, paths.boundaries_dir, split_events)
+    for e in split_events:
+        split_file = os.path.join(paths.boundaries_dir, str(e),
+                                  'event_%05d.xy' % e)
+        manifest.done('split:%d' % e, split_fp, [split_file], save=False)
+    manifest.save()
@@ -18,20 +18,22 @@ Defaults for the above parameters are:
 """
 
 
-import os
-import re
+import numpy as num
 
 import config as cfg
+import dataobj
+import tfile_cache as tfc
 import log
 log = log.Log()
 
 
-# pattern that will split fields in a string delimited by one or more spaces
-DelimPattern = re.compile(' +')
-
 # small tolerance for float compares (wave heights)
 Epsilon = 1.0e-6
 
+# zone name -> (first, last) fault IDs, and stamp of the file it came from
+ZoneLimits = None
+ZoneLimitsStamp = None
+
 
 def get_zone_fault_limits(zone_name):
     """Get the fault ID limits for a zone.
@@ -39,77 +41,108 @@ def get_zone_fault_limits(zone_name):
     zone_name  the name of the zone
 
     Return a tuple (min, max) of fault IDs, inclusive in zone.
+
+    The zone file is read once and remembered until it changes on disk.
     """
 
-    fd = open(cfg.EventID2ZoneFile, 'r')
-    lines = fd.readlines()
-    fd.close()
+    global ZoneLimits, ZoneLimitsStamp
 
-    for l in lines:
-        l = l.strip()
-        (name, start, stop) = l.split()
-        if name == zone_name:
-            return (int(start), int(stop))
+    stamp = (cfg.EventID2ZoneFile, tfc.source_stamp(cfg.EventID2ZoneFile))
+    if ZoneLimits is None or stamp != ZoneLimitsStamp:
+        fd = open(cfg.EventID2ZoneFile, 'r')
+        lines = fd.readlines()
+        fd.close()
 
-    msg = "Didn't find zone %s in file %s!?" % (zone_name, cfg.EventID2ZoneFile)
-    raise RuntimeError(msg)
+        ZoneLimits = {}
+        for l in lines:
+            l = l.strip()
+            if not l:
+                continue
+            (name, start, stop) = l.split()
+            ZoneLimits[name] = (int(start), int(stop))
+        ZoneLimitsStamp = stamp
 
+    try:
+        return ZoneLimits[zone_name]
+    except KeyError:
+        msg = ("Didn't find zone %s in file %s!?"
+               % (zone_name, cfg.EventID2ZoneFile))
+        raise RuntimeError(msg)
 
-def get_hp_events(hp_id, min_height, max_height, zone_name):
-    """Get event information given a hazard point and wave height range.
+
+@log.timed('get_hp_events')
+def query_hp_events(hp_id, min_height, max_height, zone_name):
+    """Get typed event data given a hazard point and wave height range.
 
     hp_id               hazard point index number
     min_height          minimum wave height
     max_height          maximum wave height
     zone_name           name of the zone of interest
 
-    Returns a list of tuples (Quake_ID,Ann_Prob,z_max(m),Mag,Slip(m),subfaults).
-    The values are STRINGS!
-    The subfaults list is a list of integers (subfault IDs).
+    Returns a DataObj with numpy array attributes .event_id, .zprob,
+    .zquake, .mag and .slip, one element per matching event, in event ID
+    order.
     """
 
-    # get pathnames to files of interest
-    Tfilename = os.path.join(cfg.TFilesDirectory, 'T-%05d' % hp_id)
-
     # get fault ID limits for the zone
     (f_start, f_stop) = get_zone_fault_limits(zone_name)
 
-    # now read T-**** file
-    try:
-        fd = open(Tfilename, "r")
-        lines = fd.readlines()
-        fd.close()
-    except IOError, e:
-        msg = "Error reading file: %s" % str(e)
-        raise RuntimeError(msg)
-
-    # trash the first line of T-**** data
-    lines = lines[1:]
+    # now get T-**** data, from the binary cache if we can
+    data = tfc.load_tfile(tfc.tfile_path(hp_id))
 
-    # get the data from the fault lines
-    result = []
+    # find events in the wave band with the zquake index, limit to zone
     min_wave = min_height - Epsilon
     max_wave = max_height + Epsilon
-    
-    for (i, line) in enumerate(lines[f_start:f_stop+1]):
-        event_id = i + f_start
-        l = line.strip()
-        (zquake, zprob, mag, slip, _, _) = DelimPattern.split(l, maxsplit=5)
-        zquake = float(zquake)
-        zprob = float(zprob)
-        mag = float(mag)
-        slip = float(slip)
-
-        if zprob > 0.0 and (min_wave <= zquake <= max_wave):
-            id = '%05d' % event_id
-            zprob = '%.2g' % zprob
-            zquake = '%.2f' % zquake
-            mag = '%.1f' % mag
-            slip = '%.3f' % slip
-
-            result.append((id, zprob, zquake, mag, slip))
-
-    return result
+    index = tfc.band_events(data, min_wave, max_wave, f_start, f_stop)
+
+    return dataobj.DataObj(event_id=index,
+                           zprob=num.asarray(data.zprob[index]),
+                           zquake=num.asarray(data.zquake[index]),
+                           mag=num.asarray(data.mag[index]),
+                           slip=num.asarray(data.slip[index]))
+
+
+def event_rows(events):
+    """Convert typed event data to a list of row tuples.
+
+    events  a DataObj from query_hp_events()
+
+    Returns a list of (Quake_ID,Ann_Prob,z_max(m),Mag,Slip(m)) tuples of
+    python int and float values.
+    """
+
+    return zip(events.event_id.tolist(), events.zprob.tolist(),
+               events.zquake.tolist(), events.mag.tolist(),
+               events.slip.tolist())
+
+
+def format_event(row):
+    """Format one event row tuple for display.
+
+    row  a (Quake_ID,Ann_Prob,z_max(m),Mag,Slip(m)) tuple of numbers
+
+    Returns a tuple of STRINGS.
+    """
+
+    (id, zprob, zquake, mag, slip) = row
+    return ('%05d' % id, '%.2g' % zprob, '%.2f' % zquake,
+            '%.1f' % mag, '%.3f' % slip)
+
+
+def get_hp_events(hp_id, min_height, max_height, zone_name):
+    """Get event information given a hazard point and wave height range.
+
+    hp_id               hazard point index number
+    min_height          minimum wave height
+    max_height          maximum wave height
+    zone_name           name of the zone of interest
+
+    Returns a list of tuples (Quake_ID,Ann_Prob,z_max(m),Mag,Slip(m)).
+    The values are STRINGS!
+    """
+
+    events = query_hp_events(hp_id, min_height, max_height, zone_name)
+    return [format_event(row) for row in event_rows(events)]
 
 ################################################################################
 
@@ -126,7 +159,7 @@ if __name__ == '__main__':
     def main():
         try:
             opts, args = getopt.getopt(sys.argv[1:], 'h', ['help'])
-        except getopt.error, msg:
+        except getopt.error:
             usage()
             return 1
 
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+
+"""A memory-mapped hazard point x event matrix of zquake values.
+
+The matrix is built from all the T-XXXXX files and kept under
+cfg.TFileCacheDirectory in two orientations, so both of the queries we need
+read contiguous memory:
+
+    zquake_by_hp.npy     float32 (num_hp, num_events), one row per HP
+    zquake_by_event.npy  float32 (num_events, num_hp), one row per event
+    zquake_hp_ids.npy    int32 HP ID for each HP row/column, sorted
+    zquake.stamp         cache version and stamp of all source T-files
+
+The row view gives "all events at this HP", the column view gives "this
+event's wave height at every HP" (an event footprint).
+
+Usage: hazard_matrix
+
+Build (or rebuild) the matrix from all T-files in the T-files directory.
+"""
+
+
+import os
+import glob
+
+import numpy as num
+
+import config as cfg
+import tfile_cache as tfc
+import manifest as mf
+import log
+log = log.Log()
+
+
+# names of the matrix files in the cache directory
+ByHPFilename = 'zquake_by_hp.npy'
+ByEventFilename = 'zquake_by_event.npy'
+HPIDsFilename = 'zquake_hp_ids.npy'
+StampFilename = 'zquake.stamp'
+
+# type of the matrix values
+MatrixType = num.float32
+
+# number of events to transpose at a time
+TransposeBlock = 1024
+
+
+def tfile_list():
+    """Get a sorted list of (hp_id, path) for all T-files."""
+
+    result = []
+    for path in glob.glob(os.path.join(cfg.TFilesDirectory, 'T-[0-9]*')):
+        try:
+            hp_id = int(os.path.basename(path)[2:])
+        except ValueError:
+            continue
+        result.append((hp_id, path))
+    result.sort()
+
+    return result
+
+
+def tfiles_stamp(tfiles):
+    """Get a stamp string for a list of (hp_id, path) T-files.
+
+    Any added, removed or changed T-file changes the stamp.  Each file is
+    fingerprinted by its own size and mtime, so a same-size rewrite of one
+    file with an older mtime is still seen.
+    """
+
+    return mf.fingerprint(tfc.CacheVersion,
+                          [(hp_id, mf.stat_fingerprint(path))
+                           for (hp_id, path) in tfiles])
+
+
+def replace_file(src, dst):
+    """Rename a file over another.
+
+    Windows can't rename over an existing file, so it is removed first
+    there.  That fails (OSError) if the old file is still mapped.
+    """
+
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not os.path.exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+def build_matrix(cache_dir=None):
+    """Build the HP x event matrix files from all T-files.
+
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+    """
+
+    if cache_dir is None:
+        cache_dir = cfg.TFileCacheDirectory
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    tfiles = tfile_list()
+    if not tfiles:
+        msg = 'No T-files found in %s' % cfg.TFilesDirectory
+        raise RuntimeError(msg)
+    stamp = tfiles_stamp(tfiles)
+
+    # remove any stamp first, so a partial build is seen as stale
+    stamp_file = os.path.join(cache_dir, StampFilename)
+    if os.path.exists(stamp_file):
+        os.remove(stamp_file)
+
+    # build into new files, a process may still map the old ones
+    tmp = dict([(name, os.path.join(cache_dir,
+                                    'tmp-%d-%s' % (os.getpid(), name)))
+                for name in (ByHPFilename, ByEventFilename, HPIDsFilename)])
+    try:
+        # fill the HP-major matrix one T-file at a time
+        num_events = len(tfc.load_heights(tfiles[0][1]).zquake)
+        by_hp = num.lib.format.open_memmap(tmp[ByHPFilename], mode='w+',
+                                           dtype=MatrixType,
+                                           shape=(len(tfiles), num_events))
+        for (row, (hp_id, path)) in enumerate(tfiles):
+            zquake = tfc.load_heights(path).zquake
+            if len(zquake) != num_events:
+                msg = ('T-file %s has %d events, expected %d'
+                       % (path, len(zquake), num_events))
+                raise RuntimeError(msg)
+            by_hp[row,:] = zquake
+        by_hp.flush()
+
+        # transpose into the event-major matrix in blocks of events
+        by_event = num.lib.format.open_memmap(tmp[ByEventFilename],
+                                              mode='w+', dtype=MatrixType,
+                                              shape=(num_events, len(tfiles)))
+        for start in range(0, num_events, TransposeBlock):
+            stop = min(start+TransposeBlock, num_events)
+            by_event[start:stop,:] = by_hp[:,start:stop].T
+        by_event.flush()
+        del by_hp, by_event
+
+        hp_ids = num.array([hp_id for (hp_id, _) in tfiles], num.int32)
+        num.save(tmp[HPIDsFilename], hp_ids)
+
+        # a mapped old file keeps its data, the new one takes its name
+        for (name, path) in tmp.items():
+            replace_file(path, os.path.join(cache_dir, name))
+    finally:
+        for path in tmp.values():
+            if os.path.exists(path):
+                os.remove(path)
+
+    fd = open(stamp_file, 'w')
+    fd.write(stamp)
+    fd.close()
+
+    log('build_matrix: %d HPs x %d events -> %s'
+        % (len(tfiles), num_events, cache_dir))
+
+
+class HazardMatrix(object):
+    """Memory-mapped access to the HP x event zquake matrix.
+
+    Used:
+        hm = HazardMatrix()
+        heights = hm.row(hp_id)         # all events at HP
+        heights = hm.column(event_id)   # event at all HPs, in hm.hp_ids order
+    """
+
+    def __init__(self, cache_dir=None):
+        """Map the matrix files.
+
+        cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+        """
+
+        if cache_dir is None:
+            cache_dir = cfg.TFileCacheDirectory
+
+        self.by_hp = num.load(os.path.join(cache_dir, ByHPFilename),
+                              mmap_mode='r')
+        self.by_event = num.load(os.path.join(cache_dir, ByEventFilename),
+                                 mmap_mode='r')
+        self.hp_ids = num.load(os.path.join(cache_dir, HPIDsFilename))
+
+        (self.num_hp, self.num_events) = self.by_hp.shape
+
+    def hp_rows(self, hp_ids):
+        """Get the matrix rows for a sequence of HP IDs.
+
+        hp_ids  sequence of HP IDs
+
+        Returns an int array of row indices, -1 where an HP ID is unknown.
+        """
+
+        hp_ids = num.asarray(hp_ids)
+        rows = num.searchsorted(self.hp_ids, hp_ids)
+        rows = num.minimum(rows, self.num_hp-1)
+        return num.where(self.hp_ids[rows] == hp_ids, rows, -1)
+
+    def row(self, hp_id):
+        """Get zquake for all events at one HP."""
+
+        row = self.hp_rows([hp_id])[0]
+        if row < 0:
+            msg = 'HP %d is not in the hazard matrix' % hp_id
+            raise RuntimeError(msg)
+
+        return self.by_hp[row]
+
+    def column(self, event_id):
+        """Get zquake for one event at all HPs, in self.hp_ids order."""
+
+        return self.by_event[event_id]
+
+
+def load_matrix(cache_dir=None):
+    """Get a HazardMatrix, rebuilding the matrix files if they are stale.
+
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+
+    Returns None if the matrix has never been built.  Checking the stamp
+    stats every T-file and a rebuild reads them all, so GUI code should
+    call this from a worker thread.
+    """
+
+    if cache_dir is None:
+        cache_dir = cfg.TFileCacheDirectory
+
+    try:
+        fd = open(os.path.join(cache_dir, StampFilename), 'r')
+        stamp = fd.read().strip()
+        fd.close()
+    except IOError:
+        return None
+
+    if stamp != tfiles_stamp(tfile_list()):
+        log('load_matrix: hazard matrix is stale, rebuilding')
+        build_matrix(cache_dir)
+
+    return HazardMatrix(cache_dir)
+
+################################################################################
+
+if __name__ == '__main__':
+    import sys
+
+    print('Building hazard matrix from %s' % cfg.TFilesDirectory)
+    build_matrix()
+    sys.exit(0)
@@ -8,6 +8,8 @@ Except the two output files are now in CSV format.
 
 import re
 
+import tfile_cache as tfc
+
 
 # pattern string used to split multimax data
 SpacesPatternString = ' +'
@@ -37,15 +39,13 @@ def list_quakes(event_num, min_height, max_height, InvallFilename,
     ##
     # @brief Class to hold T-**** data
     class TStar(object):
-        def __init__(self, ipt, zquake, zprob, mag, slip, ng, ng_data):
+        def __init__(self, ipt, zquake, zprob, mag, slip, ng_data):
             self.ipt = ipt
             self.zquake = zquake
             self.zprob = zprob
             self.mag = mag
             self.slip = slip
-            self.ng_data = [int(i) for i in SpacesPattern.split(ng_data)]
-            if len(self.ng_data) != ng:
-                raise RuntimeError(1, "Error parsing T-***** data: %s" % msg)
+            self.ng_data = ng_data
 
         def __str__(self):
             return ('.ipt=%d, .zquake=%g, .zprob=%g, .mag=%g, '
@@ -75,37 +75,21 @@ def list_quakes(event_num, min_height, max_height, InvallFilename,
 
     del invall_lines
 
-    # now read T-**** file, creating filename from event #
-    try:
-        fd = open(TStarFilename, "r")
-        tstar_lines = fd.readlines()
-        fd.close()
-    except IOError, msg:
-        raise RuntimeError(1, "Error reading file: %s" % msg)
-
-    # trash the first line of T-**** data
-    tstar_lines = tstar_lines[1:]
+    # now get T-**** data, from the binary cache if we can
+    tstar = tfc.load_tfile(TStarFilename)
 
-    # get the data from tstar_lines
-    tstar_data = []
+    # get the data from the T-**** columns
+    # only remember the data if zquake in wave height range and zprob > 0.0
     min_wave = min_height - Epsilon
     max_wave = max_height + Epsilon
-    for (ipt, line) in enumerate(tstar_lines):
-        l = line.strip()
-        (zquake, zprob, mag,
-         slip, ng, ng_data) = SpacesPattern.split(l, maxsplit=5)
-        zquake = float(zquake)
-        zprob = float(zprob)
-        mag = float(mag)
-        slip = float(slip)
-        ng = int(ng)
-        ng_data = ng_data.strip()
-        # only remember the data if zquake in wave height range and zprob > 0.0
-        if zprob > 0.0 and (min_wave <= zquake <= max_wave):
-#            tstar_data.append(TStar(ipt+1, zquake, zprob, mag,
-#                                    slip, ng, ng_data))
-            tstar_data.append(TStar(ipt, zquake, zprob, mag, slip, ng, ng_data))
-    del tstar_lines
+    tstar_data = []
+    for ipt in tfc.band_events(tstar, min_wave, max_wave).tolist():
+        tstar_data.append(TStar(ipt, float(tstar.zquake[ipt]),
+                                float(tstar.zprob[ipt]),
+                                float(tstar.mag[ipt]),
+                                float(tstar.slip[ipt]),
+                                tfc.event_subfaults(tstar, ipt).tolist()))
+    del tstar
 
     # write out lines joining centroids
     try:
@@ -6,6 +6,8 @@ A simple logger.
 TODO: Use python logging, maybe.
 """
 
+from __future__ import with_statement
+
 BSD_2Clause_Licence = """
 Copyright 2010 Ross Wilson (r-w@manontroppo.org). All rights reserved.
 
@@ -37,9 +39,118 @@ policies, either expressed or implied, of the copyright holder.
 
 
 import os
+import sys
+import time
+import atexit
 import datetime
-import traceback
+import threading
+import Queue
+
+
+
+################################################################################
+# Aggregate timings of named operations.
+################################################################################
+
+def cpu_time():
+    """Get the CPU time (user + system) used by this process so far."""
+
+    t = os.times()
+    return t[0] + t[1]
+
+
+class Span(object):
+    """A context manager timing one operation into a Timings object."""
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.cpu = cpu_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.time() - self.wall,
+                         cpu_time() - self.cpu)
+        return False
+
+
+class Timings(object):
+    """Per-name count, total, percentiles and maximum of operation times.
+
+    CPU times are for the whole process, so they include other threads.
+    """
+
+    # keep this many of the latest wall times per name, for percentiles
+    MaxSamples = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}         # name -> [count, wall, cpu, max, samples]
+
+    def add(self, name, wall, cpu):
+        """Add one operation time in seconds."""
+
+        self.lock.acquire()
+        try:
+            stat = self.stats.get(name, None)
+            if stat is None:
+                stat = [0, 0.0, 0.0, 0.0, []]
+                self.stats[name] = stat
+            stat[0] += 1
+            stat[1] += wall
+            stat[2] += cpu
+            stat[3] = max(stat[3], wall)
+
+            # samples is a ring of the latest MaxSamples wall times
+            samples = stat[4]
+            if len(samples) < Timings.MaxSamples:
+                samples.append(wall)
+            else:
+                samples[(stat[0]-1) % Timings.MaxSamples] = wall
+        finally:
+            self.lock.release()
+
+    def span(self, name):
+        """Get a context manager that times an operation."""
+
+        return Span(self, name)
+
+    def summary(self):
+        """Get a list of rows (name, count, total, cpu, p50, p95, max).
 
+        Times are in seconds, rows are sorted by total wall time, largest
+        first.
+        """
+
+        self.lock.acquire()
+        try:
+            rows = []
+            for (name, (count, wall, cpu, tmax, samples)) in self.stats.items():
+                samples = sorted(samples)
+                p50 = samples[int(0.50 * (len(samples)-1))]
+                p95 = samples[int(0.95 * (len(samples)-1))]
+                rows.append((name, count, wall, cpu, p50, p95, tmax))
+        finally:
+            self.lock.release()
+
+        rows.sort(key=lambda r: r[2], reverse=True)
+        return rows
+
+    def table(self):
+        """Get the summary as a list of text table lines."""
+
+        lines = ['%-24s %7s %10s %10s %9s %9s %9s'
+                 % ('operation', 'count', 'total(s)', 'cpu(s)',
+                    'p50(ms)', 'p95(ms)', 'max(ms)')]
+        for (name, count, wall, cpu, p50, p95, tmax) in self.summary():
+            lines.append('%-24s %7d %10.3f %10.3f %9.1f %9.1f %9.1f'
+                         % (name[:24], count, wall, cpu,
+                            p50*1000, p95*1000, tmax*1000))
+
+        return lines
 
 
 ################################################################################
@@ -52,6 +163,16 @@ import traceback
 #     log('A log line at WARN level', Log.WARN)
 #     log.debug('log line issued at DEBUG level')
 # 
+# Time named operations, summary written to the log at exit:
+#     with log.span('load data'):
+#         ...
+#     @log.timed()
+#     def function(...):
+# 
+# With background=True lines are queued and written in batches by a writer
+# thread.  A line is in the file within 'latency' seconds, and the queue is
+# drained when the program exits.
+# 
 # Based on the 'borg' recipe from [http://code.activestate.com/recipes/66531/].
 # 
 # Log levels styled on the Python 'logging' module.
@@ -79,12 +200,27 @@ class Log(object):
     # maximum length of filename (enforced)
     MaxNameLength = 12
 
-    def __init__(self, logfile=None, level=NOTSET, append=True):
+    # caller module name for each code object seen, None for this module
+    _code_names = {}
+
+    # background writer: most lines queued before a log call waits, the
+    # default seconds before a line is in the file, and bytes of lines
+    # that are written at once
+    QueueSize = 10000
+    DefaultLatency = 0.5
+    FlushSize = 64 * 1024
+
+    def __init__(self, logfile=None, level=NOTSET, append=True,
+                 caller=True, background=False, latency=None):
         """Initialise the logging object.
         
-        logfile the path to the log file
-        level   logging level - don't log below this level
-        append  True if log file is appended to, otherwise overwritten
+        logfile     the path to the log file
+        level       logging level - don't log below this level
+        append      True if log file is appended to, otherwise overwritten
+        caller      True if the caller's module and line are logged
+        background  True if lines are written by a background thread
+        latency     most seconds before a background line is in the file
+                    (DefaultLatency if None)
         """
 
         # make sure we have same state as all other log objects
@@ -96,10 +232,17 @@ class Log(object):
                 logfile = '%s.log' % __name__
             self.level = level
             self.logfile = logfile
+            self.caller = caller
+            self.queue = None
+            self.queue_lock = threading.Lock()
+            self.timings = Timings()
+            self.timings_at_exit = False
             if append:
                 self.logfd = open(logfile, 'a')
             else:
                 self.logfd = open(logfile, 'w')
+            if background:
+                self.start_writer(latency)
 
             self.critical('='*55)
             self.critical('Log started on %s, log level=%s'
@@ -131,25 +274,66 @@ class Log(object):
         sec = to.second
         msec = to.microsecond
 
-        # caller information - look back for first module != <this module name>
-        frames = traceback.extract_stack()
-        frames.reverse()
+        # caller information - look back for first module != this module
+        if self.caller:
+            (fname, lnum) = self.find_caller()
+            fname = '%*s:%-4d' % (Log.MaxNameLength, fname, lnum)
+        else:
+            fname = ' ' * (Log.MaxNameLength+5)
+
+        # get string for log level
+        loglevel = Log._level_num_to_name[level]
+
+        line = ('%02d:%02d:%02d.%06d|%8s|%s|%s\n'
+                % (hr, min, sec, msec, loglevel, fname, msg))
+        if not (self.writer_alive() and self.enqueue(line)):
+            # no background writer, a forked process without one, or the
+            # writer has died
+            self.logfd.write(line)
+
+    def find_caller(self):
+        """Get (module name, line number) of the code that called the log.
+
+        Walks the stack frames directly, the module name of each code object
+        is worked out once and cached.
+        """
+
+        names = Log._code_names
+        f = sys._getframe(1)
+        while f is not None:
+            code = f.f_code
+            try:
+                name = names[code]
+            except KeyError:
+                name = self.code_name(code)
+                names[code] = name
+            if name is not None:
+                return (name, f.f_lineno)
+            f = f.f_back
+
+        return ('?', 0)
+
+    def code_name(self, code):
+        """Get the module name for a code object, None if this module."""
+
         try:
             (_, mod_name) = __name__.rsplit('.', 1)
         except ValueError:
             mod_name = __name__
-        for (fpath, lnum, mname, _) in frames:
-            (fname, _) = os.path.basename(fpath).rsplit('.', 1)
-            if fname != mod_name:
-                break
 
-        # get string for log level
-        loglevel = Log._level_num_to_name[level]
+        fname = os.path.splitext(os.path.basename(code.co_filename))[0]
+        if fname == mod_name:
+            return None
 
-        fname = fname[:Log.MaxNameLength]
-        self.logfd.write('%02d:%02d:%02d.%06d|%8s|%*s:%-4d|%s\n'
-                         % (hr, min, sec, msec, loglevel, Log.MaxNameLength,
-                            fname, lnum, msg))
+        return fname[:Log.MaxNameLength]
+
+    def set_caller(self, caller):
+        """Turn logging of the caller's module and line on or off.
+
+        With it off a log call doesn't look at the stack at all.
+        """
+
+        self.caller = caller
 
     def critical(self, msg):
         """Log a message at CRITICAL level."""
@@ -176,6 +360,217 @@ class Log(object):
 
         self(msg, Log.DEBUG)
 
+    def span(self, name):
+        """Get a context manager that times an operation.
+
+        name  name of the operation
+
+        Used as 'with log.span(name): ...'.  The times are summarised in
+        the log at exit.
+        """
+
+        if not self.timings_at_exit:
+            # registered after any writer, so runs before it stops
+            self.timings_at_exit = True
+            atexit.register(self.log_timings)
+
+        return self.timings.span(name)
+
+    def timed(self, name=None):
+        """Get a decorator that times each call of a function.
+
+        name  name of the operation (the function name if None)
+        """
+
+        def decorator(func):
+            span_name = name or func.__name__
+
+            def wrapper(*args, **kwargs):
+                with self.span(span_name):
+                    return func(*args, **kwargs)
+
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+
+        return decorator
+
+    def log_timings(self):
+        """Write the timing summary table to the log."""
+
+        lines = self.timings.table()
+        if len(lines) < 2:
+            return
+
+        self.critical('Timing summary:')
+        for line in lines:
+            self.critical(line)
+
+    def start_writer(self, latency=None):
+        """Write lines in a background thread from now on.
+
+        latency  most seconds before a line is in the file (DefaultLatency
+                 if None)
+        """
+
+        if self.queue is not None:
+            return
+
+        if latency is None:
+            latency = Log.DefaultLatency
+        self.latency = latency
+        self.queue = Queue.Queue(Log.QueueSize)
+        self.writer_pid = os.getpid()
+        self.writer_thread = threading.Thread(target=self.writer,
+                                              args=(self.queue,))
+        self.writer_thread.setDaemon(True)
+        self.writer_thread.start()
+
+        # drain the queue at exit, including exit by an uncaught exception
+        atexit.register(self.stop_writer)
+
+    def writer(self, queue):
+        """Thread body: write queued lines in batches until None arrives.
+
+        queue  the line queue
+
+        The queue holds lines, None to stop, or an event to set when all
+        lines before it are in the file.
+        """
+
+        buf = []
+        size = 0
+        oldest = None       # time the oldest line in 'buf' was taken
+        while True:
+            # wait for a line, or until the oldest line is due
+            try:
+                if oldest is None:
+                    items = [queue.get()]
+                else:
+                    timeout = max(0.0, oldest + self.latency - time.time())
+                    items = [queue.get(True, timeout)]
+            except Queue.Empty:
+                items = []
+
+            # take all waiting lines too
+            while True:
+                try:
+                    items.append(queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            stop = False
+            events = []
+            for item in items:
+                if item is None:
+                    stop = True
+                elif hasattr(item, 'set'):
+                    events.append(item)
+                else:
+                    buf.append(item)
+                    size += len(item)
+            if buf and oldest is None:
+                oldest = time.time()
+
+            if buf and (stop or events or size >= Log.FlushSize
+                        or time.time() - oldest >= self.latency):
+                self.write_lines(buf)
+                buf = []
+                size = 0
+                oldest = None
+
+            for event in events:
+                event.set()
+            if stop:
+                break
+
+    def write_lines(self, lines):
+        """Write a batch of lines, never raising an exception.
+
+        If the batch can't be written at once (say a mix of str and unicode
+        lines that can't be joined) each line is tried on its own, so one bad
+        line doesn't lose the others or kill the writer thread.
+        """
+
+        try:
+            self.logfd.write(''.join(lines))
+        except Exception:
+            for line in lines:
+                try:
+                    if isinstance(line, unicode):
+                        line = line.encode('utf-8', 'replace')
+                    self.logfd.write(line)
+                except Exception:
+                    pass
+        try:
+            self.logfd.flush()
+        except Exception:
+            pass
+
+    def writer_alive(self):
+        """See if lines should go to a running background writer."""
+
+        queue = self.queue
+        return (queue is not None and self.writer_pid == os.getpid()
+                and self.writer_thread.isAlive())
+
+    def enqueue(self, item):
+        """Queue an item for the background writer.
+
+        Returns False if the writer has gone (or is stopping), rather than
+        waiting forever on a full queue.  Items are put under queue_lock, so
+        none can follow the stop sentinel and be lost.
+        """
+
+        self.queue_lock.acquire()
+        try:
+            queue = self.queue
+            while queue is not None:
+                try:
+                    queue.put(item, True, Log.DefaultLatency)
+                    return True
+                except Queue.Full:
+                    if not self.writer_alive():
+                        break
+        finally:
+            self.queue_lock.release()
+
+        return False
+
+    def flush(self):
+        """Get all lines logged so far into the file."""
+
+        if self.writer_alive():
+            event = threading.Event()
+            self.enqueue(event)
+            # don't wait forever if the writer dies
+            while not event.isSet() and self.writer_alive():
+                event.wait(Log.DefaultLatency)
+        else:
+            self.logfd.flush()
+
+    def stop_writer(self):
+        """Write all queued lines and stop the background writer."""
+
+        if self.queue is None or self.writer_pid != os.getpid():
+            return
+
+        # later lines are written directly, the stop sentinel is the last
+        # item queued
+        self.queue_lock.acquire()
+        try:
+            queue = self.queue
+            self.queue = None
+            while self.writer_thread.isAlive():
+                try:
+                    queue.put(None, True, Log.DefaultLatency)
+                    break
+                except Queue.Full:
+                    pass
+        finally:
+            self.queue_lock.release()
+        self.writer_thread.join()
+
     def __del__(self):
         self.logfd.close()
 
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""A least recently used cache with a byte budget.
+
+Used by pySlip to hold decoded map tiles.  Each value is put with its size
+in bytes, and the least recently used values are evicted to keep the total
+within the budget.  Pinned keys (the tiles in the current view) are never
+evicted, so the total may go over budget if the pinned values alone do.
+
+Used:
+    cache = LRUCache(64*1024*1024)
+    value = cache.get(key)
+    if value is None:
+        value = make_value(key)
+        cache.put(key, value, size)
+    cache.pin([key1, key2, ...])
+"""
+
+
+import threading
+
+
+class LRUCache(object):
+    """A byte-limited LRU cache, safe to use from more than one thread."""
+
+    def __init__(self, max_bytes):
+        """Make an empty cache.
+
+        max_bytes  the cache byte budget
+        """
+
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.entries = {}           # key -> (value, size)
+        self.used = {}              # key -> tick of last use
+        self.tick = 0
+        self.pinned = frozenset()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Get the value for a key, None if it isn't cached.
+
+        A found key becomes the most recently used.
+        """
+
+        self.lock.acquire()
+        try:
+            try:
+                (value, _) = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.touch(key)
+            self.hits += 1
+            return value
+        finally:
+            self.lock.release()
+
+    def __contains__(self, key):
+        """See if a key is cached, without counting a hit or miss."""
+
+        return key in self.entries
+
+    def put(self, key, value, size):
+        """Cache a value as the most recently used, then keep to budget.
+
+        key    the key
+        value  the value
+        size   size of the value in bytes
+        """
+
+        self.lock.acquire()
+        try:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size)
+            self.touch(key)
+            self.bytes += size
+            self.evict()
+        finally:
+            self.lock.release()
+
+    def pin(self, keys):
+        """Pin a set of keys, replacing any previous pins.
+
+        keys  iterable of the keys to keep, cached or not
+        """
+
+        self.lock.acquire()
+        try:
+            self.pinned = frozenset(keys)
+            self.evict()
+        finally:
+            self.lock.release()
+
+    def evict(self):
+        """Evict least recently used, unpinned values until within budget."""
+
+        if self.bytes <= self.max_bytes:
+            return
+
+        # least recently used first
+        lru = [(tick, key) for (key, tick) in self.used.iteritems()
+               if key not in self.pinned]
+        lru.sort()
+        for (_, key) in lru:
+            if self.bytes <= self.max_bytes:
+                break
+            (_, size) = self.entries.pop(key)
+            del self.used[key]
+            self.bytes -= size
+            self.evictions += 1
+
+    def touch(self, key):
+        """Make a cached key the most recently used."""
+
+        self.tick += 1
+        self.used[key] = self.tick
+
+    def set_budget(self, max_bytes):
+        """Change the byte budget, evicting if required."""
+
+        self.lock.acquire()
+        try:
+            self.max_bytes = max_bytes
+            self.evict()
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """Empty the cache, keeping the counters."""
+
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.used.clear()
+            self.bytes = 0
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """Get a dictionary of the cache counters and sizes."""
+
+        self.lock.acquire()
+        try:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self.entries),
+                    'bytes': self.bytes,
+                    'max_bytes': self.max_bytes,
+                    'pinned': len(self.pinned)}
+        finally:
+            self.lock.release()
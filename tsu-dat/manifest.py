@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""A per-scenario record of completed generation stages.
+
+Each stage (list_quakes, multimux for an event, urs_order, build for an
+event, ...) is recorded with a fingerprint of its inputs and the paths of
+its outputs.  A stage is done if it was recorded with the same fingerprint
+and all its outputs still exist, so a re-run can skip it.
+
+Used:
+    m = Manifest(path)
+    fp = fingerprint(hp_id, stat_fingerprint(tfile))
+    if not m.is_done('list_quakes', fp):
+        ...
+        m.done('list_quakes', fp, [output1, output2])
+
+This module is copied into the generate directory with run_build.py,
+so it must not import config.
+"""
+
+
+import os
+try:
+    import hashlib
+    new_hash = hashlib.sha1
+except ImportError:
+    import sha
+    new_hash = sha.new
+# get pickler, try for 'C' pickler
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# name of the manifest file in the scenario directory
+ManifestFilename = 'manifest.pkl'
+
+# bump this if the manifest layout changes
+ManifestVersion = 1
+
+# size of blocks to read when fingerprinting a file
+ReadBlockSize = 1024 * 1024
+
+
+def fingerprint(*values):
+    """Get a fingerprint string for a sequence of values."""
+
+    return new_hash(repr(values)).hexdigest()
+
+
+def file_fingerprint(path):
+    """Get a fingerprint string for the contents of a file."""
+
+    h = new_hash()
+    fd = open(path, 'rb')
+    while True:
+        data = fd.read(ReadBlockSize)
+        if not data:
+            break
+        h.update(data)
+    fd.close()
+
+    return h.hexdigest()
+
+
+def stat_fingerprint(path):
+    """Get a cheap fingerprint string for a (large) file from its size/mtime."""
+
+    st = os.stat(path)
+    return '%d %r' % (st.st_size, st.st_mtime)
+
+
+class Manifest(object):
+    """The completed stages of a scenario generation."""
+
+    def __init__(self, filename):
+        """Load the manifest, if it exists.
+
+        filename  path to the manifest file
+        """
+
+        self.filename = filename
+        self.stages = {}
+        self.load()
+
+    def load(self):
+        """(Re)load the manifest file, an unreadable file is empty."""
+
+        self.stages = {}
+        try:
+            fd = open(self.filename, 'rb')
+            (version, stages) = pickle.load(fd)
+            fd.close()
+        except (IOError, EOFError, ValueError, TypeError,
+                pickle.UnpicklingError):
+            return
+
+        if version == ManifestVersion:
+            self.stages = stages
+
+    def save(self):
+        """Save the manifest, replacing the file in one step."""
+
+        tmp_filename = '%s.tmp-%d' % (self.filename, os.getpid())
+        fd = open(tmp_filename, 'wb')
+        pickle.dump((ManifestVersion, self.stages), fd,
+                    pickle.HIGHEST_PROTOCOL)
+        fd.close()
+
+        # windows can't rename over an existing file
+        if os.name == 'nt' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmp_filename, self.filename)
+
+    def is_done(self, stage, fp):
+        """See if a stage is done.
+
+        stage  name of the stage
+        fp     fingerprint of the stage inputs
+
+        Returns True if the stage was done with the same inputs and all its
+        outputs still exist.
+        """
+
+        entry = self.stages.get(stage, None)
+        if entry is None:
+            return False
+
+        (done_fp, outputs) = entry
+        if done_fp != fp:
+            return False
+        for path in outputs:
+            if not os.path.exists(path):
+                return False
+
+        return True
+
+    def done(self, stage, fp, outputs=(), save=True):
+        """Record that a stage is done.
+
+        stage    name of the stage
+        fp       fingerprint of the stage inputs
+        outputs  paths of the files the stage produced
+        save     if True, save the manifest now
+        """
+
+        self.stages[stage] = (fp, list(outputs))
+        if save:
+            self.save()
+
+    def forget(self, stage, save=True):
+        """Forget a stage, so it will be done again."""
+
+        if stage in self.stages:
+            del self.stages[stage]
+            if save:
+                self.save()
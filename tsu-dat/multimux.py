@@ -2,13 +2,27 @@
 
 """
 Do what David Burbidge's 'get_multimux' program does.
+
+Events are numbered from 1 across all the i_multimux-<fault> files, in the
+order of the faults in the fault name file.  An index of where each event is
+stored is kept beside the fault name file so we can seek straight to it.
 """
 
 import os
 import re
 import shutil
+import threading
+import Queue
+# get pickler, try for 'C' pickler
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy as num
 
 import config as cfg
+import dataobj
 import log
 log = log.Log()
 
@@ -16,22 +30,29 @@ log = log.Log()
 # generate 're' pattern for 'any number of spaces'
 SpacesPattern = re.compile(' +')
 
+# name of the event index file, kept beside the fault name file
+IndexFilename = 'fault_list.idx'
 
-def multimux(event_id, save_dir):
-    """Do what David Burbidge's 'get_multimux' program does.
+# version of the event index, bump if the layout changes
+IndexVersion = 1
 
-    event_id  ID of the event
-    save_dir  path to save directory base
-    """
+# number of threads writing event files in multimux_events()
+NumWriterThreads = 4
 
-    # get path to output file
-    event_dir = os.path.join(save_dir, 'boundaries', str(event_id))
-    if os.path.isdir(event_dir):
-        shutil.rmtree(event_dir)
-    os.makedirs(event_dir)
-    fault_file = os.path.join(event_dir, cfg.EventFile)
+# the event index, loaded on first use, and the stamp of its multimux files
+Index = None
+IndexStamp = None
+
+
+def multimux_path(fault_name):
+    """Get the path to the multimux data file for a fault."""
+
+    return os.path.join(cfg.MultimuxDirectory, 'i_multimux-%s' % fault_name)
+
+
+def read_fault_names():
+    """Get the list of fault names from the fault name file."""
 
-    # get the fault name data
     filename = os.path.join(cfg.MultimuxDirectory, cfg.FaultNameFilename)
     try:
         fd = open(filename, "r")
@@ -40,22 +61,47 @@ def multimux(event_id, save_dir):
     except IOError, msg:
         raise RuntimeError(1, "Error reading file: %s" % msg)
 
-    # open the output file
-    try:
-        outfd = open(fault_file, "w")
-    except IOError, msg:
-        raise RuntimeError(1, "Error opening output file: %s" % msg)
+    return fault_names
+
 
-    # handle each fault
-    nquake = 0
-    for fn in fault_names:
-        # create the filename for the multimux data file
-        mmx_filename = 'i_multimux-%s' % fn
-        mmx_filename = os.path.join(cfg.MultimuxDirectory, mmx_filename)
+def index_stamp(fault_names):
+    """Get a stamp for the fault name file and all multimux files.
+
+    Any change to any of the files changes the stamp.
+    """
 
-        # Read all data in file, checking as we go
+    paths = [os.path.join(cfg.MultimuxDirectory, cfg.FaultNameFilename)]
+    paths.extend([multimux_path(fn) for fn in fault_names])
+
+    stamp = [IndexVersion]
+    for path in paths:
         try:
-            infd = open(mmx_filename, "r")
+            st = os.stat(path)
+        except OSError, msg:
+            raise RuntimeError(1, "Error opening file: %s" % msg)
+        stamp.append((os.path.basename(path), st.st_mtime, st.st_size))
+
+    return tuple(stamp)
+
+
+def build_index(fault_names):
+    """Scan all multimux files and index every event.
+
+    fault_names  list of fault names, in fault name file order
+
+    Returns a DataObj with attributes (one element per event, the event
+    with global number N is element N-1):
+        fault      index into fault_names of the file holding the event
+        offset     byte offset of the event's first subfault line
+        nsubfault  number of subfault lines for the event
+    """
+
+    faults = []
+    offsets = []
+    nsubfaults = []
+    for (fault, fn) in enumerate(fault_names):
+        try:
+            infd = open(multimux_path(fn), "r")
         except IOError, msg:
             raise RuntimeError(1, "Error opening file: %s" % msg)
 
@@ -64,37 +110,237 @@ def multimux(event_id, save_dir):
         if mux_faultname != fn:
             raise RuntimeError(1, "Error reading file")
 
-        # read data
         while True:
             # get number of subfaults, EOF means finished
-            try:
-                nsubfault = infd.readline()
-            except IOError:
-                raise RuntimeError(1, "Error reading file")
-
+            nsubfault = infd.readline()
             if not nsubfault:
                 break
             nsubfault = int(nsubfault)
 
-            nquake += 1
-            if nquake == event_id:
-                outfd.write(' %d\n' % nsubfault)
-                for i in range(nsubfault):
-                    line = infd.readline()
-                    (subfaultname, slip, prob, mag, _) = \
-                                   SpacesPattern.split(line, maxsplit=4)
-                    subfaultname = subfaultname.strip()
-                    slip = float(slip)
-                    outfd.write(" %s %g\n" % (subfaultname, slip))
-            else:
-                for i in range(nsubfault):
-                    try:
-                        infd.readline()
-                    except IOError:
-                        raise RuntimeError(1,
-                                           "Something wrong at bottom of file %s" %
-                                           mux_faultname)
+            faults.append(fault)
+            offsets.append(infd.tell())
+            nsubfaults.append(nsubfault)
+
+            for i in range(nsubfault):
+                if not infd.readline():
+                    raise RuntimeError(1,
+                                       "Something wrong at bottom of file %s"
+                                       % mux_faultname)
 
         infd.close()
+
+    log('build_index: indexed %d events in %d multimux files'
+        % (len(offsets), len(fault_names)))
+
+    return dataobj.DataObj(fault_names=fault_names,
+                           fault=num.array(faults, num.int32),
+                           offset=num.array(offsets, num.int64),
+                           nsubfault=num.array(nsubfaults, num.int32))
+
+
+def load_index():
+    """Get the event index, rebuilding it if any multimux file changed.
+
+    The index is kept in memory and in IndexFilename beside the fault name
+    file.  If the index file can't be written we just keep the index in
+    memory.
+    """
+
+    global Index, IndexStamp
+
+    fault_names = read_fault_names()
+    stamp = (cfg.MultimuxDirectory, index_stamp(fault_names))
+    if Index is not None and stamp == IndexStamp:
+        return Index
+
+    index = None
+    filename = os.path.join(cfg.MultimuxDirectory, IndexFilename)
+    try:
+        fd = open(filename, 'rb')
+        (file_stamp, index) = pickle.load(fd)
+        fd.close()
+        if file_stamp != stamp[1]:
+            log('load_index: %s is stale, rebuilding' % filename)
+            index = None
+    except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+        index = None
+
+    if index is None:
+        index = build_index(fault_names)
+        try:
+            fd = open(filename, 'wb')
+            pickle.dump((stamp[1], index), fd, pickle.HIGHEST_PROTOCOL)
+            fd.close()
+        except (IOError, OSError), msg:
+            log('load_index: not saving index: %s' % msg)
+
+    Index = index
+    IndexStamp = stamp
+
+    return Index
+
+
+def unknown_events(index, event_ids):
+    """Get the event IDs that aren't in the multimux files.
+
+    index      the event index from load_index()
+    event_ids  iterable of event IDs
+
+    Returns a set of event IDs, logging each one.
+    """
+
+    result = set()
+    for event_id in event_ids:
+        if not 0 < event_id <= len(index.offset):
+            log('Event %d not found in multimux files' % event_id)
+            result.add(event_id)
+
+    return result
+
+
+def read_events(index, event_ids):
+    """Read the subfault data for a set of events.
+
+    index      the event index from load_index()
+    event_ids  iterable of event IDs
+
+    Generates (event_id, subfaults) tuples where subfaults is a list of
+    (subfault name, slip).  Each multimux file is opened once and the events
+    are read in file and offset order.
+    """
+
+    order = sorted(set(event_ids),
+                   key=lambda e: (index.fault[e-1], index.offset[e-1]))
+
+    infd = None
+    fault = None
+    try:
+        for event_id in order:
+            i = event_id - 1
+            if index.fault[i] != fault:
+                if infd:
+                    infd.close()
+                fault = index.fault[i]
+                fault_name = index.fault_names[fault]
+                try:
+                    infd = open(multimux_path(fault_name), "r")
+                except IOError, msg:
+                    raise RuntimeError(1, "Error opening file: %s" % msg)
+
+            infd.seek(int(index.offset[i]))
+            subfaults = []
+            for _ in range(index.nsubfault[i]):
+                line = infd.readline()
+                (subfaultname, slip, prob, mag, _) = \
+                               SpacesPattern.split(line, maxsplit=4)
+                subfaults.append((subfaultname.strip(), float(slip)))
+
+            yield (event_id, subfaults)
+    finally:
+        if infd:
+            infd.close()
+
+
+def write_event(event_id, save_dir, subfaults):
+    """Write the event file for one event.
+
+    event_id   ID of the event
+    save_dir   path to save directory base
+    subfaults  list of (subfault name, slip) for the event, None for an
+               event not in the multimux files (the file is left empty)
+    """
+
+    # get path to output file
+    event_dir = os.path.join(save_dir, 'boundaries', str(event_id))
+    if os.path.isdir(event_dir):
+        shutil.rmtree(event_dir)
+    os.makedirs(event_dir)
+    fault_file = os.path.join(event_dir, cfg.EventFile)
+
+    # open the output file
+    try:
+        outfd = open(fault_file, "w")
+    except IOError, msg:
+        raise RuntimeError(1, "Error opening output file: %s" % msg)
+
+    if subfaults is not None:
+        outfd.write(' %d\n' % len(subfaults))
+        for (subfaultname, slip) in subfaults:
+            outfd.write(" %s %g\n" % (subfaultname, slip))
     outfd.close()
 
+
+def event_writer(queue, save_dir, errors):
+    """Thread body: write events from a queue until a None arrives.
+
+    queue     queue of (event_id, subfaults) tuples
+    save_dir  path to save directory base
+    errors    list to append any error messages to
+    """
+
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        (event_id, subfaults) = item
+        try:
+            write_event(event_id, save_dir, subfaults)
+        except (RuntimeError, IOError, OSError), msg:
+            errors.append(str(msg))
+
+
+@log.timed('multimux')
+def multimux_events(event_ids, save_dir):
+    """Do what 'get_multimux' does for many events at once.
+
+    event_ids  list of event IDs
+    save_dir   path to save directory base
+
+    The multimux files are read once for all events, in file order, and the
+    event files are written by NumWriterThreads threads.
+    """
+
+    # an unknown event gets an empty event file, as from 'get_multimux'
+    index = load_index()
+    missing = unknown_events(index, event_ids)
+    for event_id in missing:
+        write_event(event_id, save_dir, None)
+    event_ids = [e for e in event_ids if e not in missing]
+
+    queue = Queue.Queue(maxsize=2*NumWriterThreads)
+    errors = []
+    threads = []
+    for _ in range(min(NumWriterThreads, len(event_ids))):
+        t = threading.Thread(target=event_writer,
+                             args=(queue, save_dir, errors))
+        t.setDaemon(True)
+        t.start()
+        threads.append(t)
+
+    try:
+        for item in read_events(index, event_ids):
+            queue.put(item)
+    finally:
+        for t in threads:
+            queue.put(None)
+        for t in threads:
+            t.join()
+
+    if errors:
+        raise RuntimeError(1, errors[0])
+
+
+def multimux(event_id, save_dir):
+    """Do what David Burbidge's 'get_multimux' program does.
+
+    event_id  ID of the event
+    save_dir  path to save directory base
+    """
+
+    index = load_index()
+    if unknown_events(index, [event_id]):
+        write_event(event_id, save_dir, None)
+        return
+
+    for (event_id, subfaults) in read_events(index, [event_id]):
+        write_event(event_id, save_dir, subfaults)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""The progress protocol between run_build.py and the GUI.
+
+With the -p option run_build.py writes one JSON object per line to stdout:
+
+    {"stage": "start", "percent": 0.0, "total": 12}
+    {"stage": "build", "event": 1234}
+    {"stage": "done", "event": 1234, "percent": 33.3, "eta": 540.0}
+    {"stage": "failed", "event": 1235, "percent": 41.7, "eta": 480.0}
+    {"stage": "log", "text": "Running build_urs_boundary() for event 1234"}
+    {"stage": "finished", "percent": 100.0, "eta": 0.0, "failed": [1235]}
+
+'percent' is the percentage of events finished and 'eta' the estimated
+seconds left, both optional.  The 'build' and 'log' messages may come from
+the worker processes.  Other output from run_build.py goes to stderr, so
+the message stream holds only whole message lines.  A reader should still
+show any line that isn't a progress message as log text.
+
+This module is copied into the generate directory with run_build.py,
+so it must not import config.
+"""
+
+
+import os
+import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+# the stages of a build
+Start = 'start'
+Build = 'build'
+Done = 'done'
+Failed = 'failed'
+Log = 'log'
+Finished = 'finished'
+
+
+def message(stage, **kwargs):
+    """Get a progress message line.
+
+    stage   the stage name
+    kwargs  other message values, any None values are left out
+
+    Returns the JSON line, with a trailing newline.
+    """
+
+    msg = {'stage': stage}
+    for (key, value) in kwargs.items():
+        if value is not None:
+            msg[key] = value
+
+    return json.dumps(msg) + '\n'
+
+
+def write(fd, stage, **kwargs):
+    """Write a progress message to a file descriptor.
+
+    A single write, so messages from processes sharing the pipe don't get
+    mixed.
+    """
+
+    os.write(fd, message(stage, **kwargs))
+
+
+def parse(line):
+    """Parse a progress message line.
+
+    Returns the message dictionary, or None if the line isn't a message.
+    """
+
+    line = line.strip()
+    if not line.startswith('{'):
+        return None
+    try:
+        msg = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(msg, dict) or 'stage' not in msg:
+        return None
+
+    return msg
+
+
+def format_eta(seconds):
+    """Get a short string for an estimated time left in seconds."""
+
+    minutes = int(seconds / 60.0 + 0.5)
+    if minutes < 1:
+        return 'less than a minute'
+    if minutes < 60:
+        return '%d minute%s' % (minutes, 's' if minutes > 1 else '')
+    hours = minutes // 60
+    minutes = minutes % 60
+
+    return '%d hour%s %d minutes' % (hours, 's' if hours > 1 else '', minutes)
+
+
+class Progress(object):
+    """Write progress messages for a build of a number of events."""
+
+    def __init__(self, fd, total, send=None):
+        """Start the progress of a build.
+
+        fd     file descriptor to write messages to (None for no messages)
+        total  number of events to build
+        send   if supplied, function send(stage, **kwargs) used to send
+               each message instead of writing it to 'fd'
+        """
+
+        self.fd = fd
+        self.send = send
+        self.total = total
+        self.finished = 0
+        self.start = time.time()
+
+    def write(self, stage, **kwargs):
+        """Write one message."""
+
+        if self.send is not None:
+            self.send(stage, **kwargs)
+        elif self.fd is not None:
+            write(self.fd, stage, **kwargs)
+
+    def percent(self):
+        """Get the percentage of events finished."""
+
+        if not self.total:
+            return 100.0
+        return 100.0 * self.finished / self.total
+
+    def eta(self):
+        """Estimate the seconds left from the rate events have finished.
+
+        Returns None until an event has finished.
+        """
+
+        if not self.finished:
+            return None
+        elapsed = time.time() - self.start
+        return elapsed * (self.total - self.finished) / self.finished
+
+    def started(self):
+        """Note the build has started."""
+
+        self.write(Start, percent=0.0, total=self.total)
+
+    def event_done(self, event_id, error=None):
+        """Note an event has finished, with an error string if it failed."""
+
+        self.finished += 1
+        self.write(Failed if error else Done, event=event_id,
+                   percent=self.percent(), eta=self.eta())
+
+    def all_done(self, failed):
+        """Note the build has finished, 'failed' lists the failed events."""
+
+        self.write(Finished, percent=100.0, eta=0.0, failed=failed)
@@ -65,6 +65,8 @@ import Image
 import wx
 import traceback
 
+import lru_cache
+import tile_prefetch
 import log
 log = log.Log('pyslip.log')
 
@@ -85,8 +87,8 @@ class pySlip(wx.Panel):
     class Tiles(object):
         """An object to handle a pyslip tiles directory.
 
-        Uses 'elephant' caching - it never forgets!
-        TODO: Add more sophisticated limit + 'drop LRU' caching.
+        Decoded tiles are kept in an LRU cache with a byte budget, shared by
+        all levels.  The tiles in the current view are pinned in the cache.
         """
 
         # the name of the tile info file (under the main tile dir)
@@ -98,10 +100,14 @@ class pySlip(wx.Panel):
         # name of picture file to use if tile missing (under the main tile dir)
         MissingTileFilename = 'missing_tile.png'
 
-        def __init__(self, tile_dir):
+        # default tile cache byte budget
+        DefaultCacheBytes = 128 * 1024 * 1024
+
+        def __init__(self, tile_dir, cache_bytes=None):
             """Initialise a Tiles instance.
 
-            tile_dir  root directory of tiles
+            tile_dir     root directory of tiles
+            cache_bytes  tile cache byte budget (DefaultCacheBytes if None)
             """
 
             # open top-level info file
@@ -118,15 +124,21 @@ class pySlip(wx.Panel):
 
             (self.tile_size_x, self.tile_size_y) = self.tile_size
 
-            # get list of tile levels
+            # get list of tile levels, smallest first, and their tile info
             tile_mask = os.path.join(tile_dir, self.TileFilenameTemplate)
-            self.levels = [int(os.path.basename(l))
-                               for l in glob.glob(os.path.join(tile_mask))]
-
-            # setup the tile caches
-            self.cache = {}
-            for l in self.levels:
-                self.cache[l] = {}
+            self.info = {}
+            for l in glob.glob(os.path.join(tile_mask)):
+                level = int(os.path.basename(l))
+                info = self.read_info(level)
+                if info is not None:
+                    self.info[level] = info
+            self.levels = sorted(self.info.keys())
+
+            # setup the tile cache, shared by all levels
+            if cache_bytes is None:
+                cache_bytes = self.DefaultCacheBytes
+            self.cache = lru_cache.LRUCache(cache_bytes)
+            self.level = None
 
             # set min and max tile levels
             self.min_level = min(self.levels)
@@ -141,16 +153,11 @@ class pySlip(wx.Panel):
             The width/height values are pixels.
             """
 
-            # try to get cache for this level, no cache means no level
-            try:
-                self.tile_cache = self.cache[n]
-            except KeyError:
-                return None
-
             # get tile info
             info = self.get_info(n)
             if info is None:
                 return None
+            self.level = n
 
             (self.num_tiles_x, self.num_tiles_y, self.ppd_x, self.ppd_y) = info
 
@@ -166,7 +173,19 @@ class pySlip(wx.Panel):
 
             level  the level to get tile info for
 
-            Returns (num_tiles_x, num_tiles_y, ppd_x, ppd_y).
+            Returns (num_tiles_x, num_tiles_y, ppd_x, ppd_y), or None if
+            there is no such level.
+            """
+
+            return self.info.get(level)
+
+        def read_info(self, level):
+            """Read the tile info file for a particular level.
+
+            level  the level to read tile info for
+
+            Returns (num_tiles_x, num_tiles_y, ppd_x, ppd_y), or None if
+            there is no tile info file.
             """
 
             # see if we can open the tile info file.
@@ -197,15 +216,12 @@ class pySlip(wx.Panel):
             into cache.
             """
 
-            try:
-                # if tile in cache, return it from there
-                return self.tile_cache[(x,y)]
-            except KeyError:
+            # if tile in cache, return it from there
+            key = (self.level, x, y)
+            pic = self.cache.get(key)
+            if pic is None:
                 # else not in cache: get image, cache and return it
-                # exceptions are normally slow,
-                # but we are reading a file if we get exception, so ...
-                img_name = os.path.join(self.tile_level_dir,
-                                        'tile_%d_%d.png' % (x, y))
+                img_name = self.tile_path(key)
 
 # Optimization
 # removed since we *know* tiles are there, we generated them!
@@ -217,8 +233,81 @@ class pySlip(wx.Panel):
 
                 img = wx.Image(img_name, wx.BITMAP_TYPE_ANY)
                 pic = img.ConvertToBitmap()
-                self.tile_cache[(x,y)] = pic
-                return pic
+                self.cache.put(key, pic, self.bitmap_bytes(pic))
+
+            return pic
+
+        def tile_path(self, key):
+            """Get the path to the file of tile key (level, x, y)."""
+
+            (level, x, y) = key
+            return os.path.join(self.tile_dir, '%02d' % level,
+                                'tile_%d_%d.png' % (x, y))
+
+        def load_image(self, key):
+            """Decode the tile image for key (level, x, y) with PIL.
+
+            Safe to call on a worker thread (the wx image handlers and wx
+            logging aren't).  Returns (width, height, RGB data string).
+            """
+
+            pil = Image.open(self.tile_path(key)).convert('RGB')
+            (width, height) = pil.size
+            return (width, height, pil.tostring())
+
+        def add_image(self, key, decoded):
+            """Make a bitmap from a decoded tile image and cache it.
+
+            key      the tile key (level, x, y)
+            decoded  the tile from load_image()
+
+            Must be called on the GUI thread.
+            """
+
+            if key not in self.cache:
+                (width, height, data) = decoded
+                pic = wx.ImageFromData(width, height, data).ConvertToBitmap()
+                self.cache.put(key, pic, self.bitmap_bytes(pic))
+
+        def num_tiles(self, level):
+            """Get (num_tiles_x, num_tiles_y) for a level, None if no level."""
+
+            info = self.info.get(level)
+            if info is None:
+                return None
+            return info[:2]
+
+        def bitmap_bytes(self, pic):
+            """Get the approximate memory size of a bitmap in bytes."""
+
+            return self.image_bytes(pic.GetWidth(), pic.GetHeight(),
+                                    pic.GetDepth())
+
+        def image_bytes(self, width, height, depth):
+            """Get the approximate memory size of a bitmap in bytes.
+
+            width, height  bitmap size in pixels
+            depth          bitmap bits per pixel (at least 24 is counted)
+            """
+
+            depth = max(depth, 24)
+            return width * height * ((depth+7) // 8)
+
+        def pin_view(self, start_x, stop_x, start_y, stop_y):
+            """Pin the tiles of the current level in a view in the cache.
+
+            start_x, stop_x  range of X tile coordinates in the view
+            start_y, stop_y  range of Y tile coordinates in the view
+            """
+
+            self.cache.pin([(self.level, x, y)
+                            for x in range(start_x, stop_x)
+                            for y in range(start_y, stop_y)])
+
+        def cache_stats(self):
+            """Get a dictionary of tile cache hits, misses, evictions, etc."""
+
+            return self.cache.stats()
 
 ################################################################################
 
@@ -304,16 +393,25 @@ class pySlip(wx.Panel):
     BackgroundColour = wx.WHITE
 
 
+    # fraction of the tile cache budget prefetched tiles may use
+    PrefetchFraction = 0.5
+
     def __init__(self, parent, tile_dir=None, start_level=None,
-                 min_level=None, max_level=None, **kwargs):
+                 min_level=None, max_level=None, tile_cache_bytes=None,
+                 prefetch_workers=None, prefetch_ring=None, **kwargs):
         """Initialise a pySlip instance.
 
-        parent       reference to parent object
-        tile_dir     the root tile directory
-        start_level  initial tile level to start at
-        min_level    the minimum tile level to use
-        max_level    the maximum tile level to use
-        **kwargs     keyword args for Panel
+        parent            reference to parent object
+        tile_dir          the root tile directory
+        start_level       initial tile level to start at
+        min_level         the minimum tile level to use
+        max_level         the maximum tile level to use
+        tile_cache_bytes  tile cache byte budget (None for the default)
+        prefetch_workers  number of tile prefetch threads (0 for none, None
+                          for the default)
+        prefetch_ring     width in tiles of the ring prefetched around the
+                          view (None for the default)
+        **kwargs          keyword args for Panel
         """
 
         # create and initialise the base panel
@@ -321,7 +419,7 @@ class pySlip(wx.Panel):
         self.SetBackgroundColour(pySlip.BackgroundColour)
 
         # get tile info
-        self.tiles = pySlip.Tiles(tile_dir)
+        self.tiles = pySlip.Tiles(tile_dir, tile_cache_bytes)
         self.max_level = max_level
         if max_level is None:
             self.max_level = self.tiles.max_level
@@ -335,6 +433,20 @@ class pySlip(wx.Panel):
         self.tile_size_x = self.tiles.tile_size_x
         self.tile_size_y = self.tiles.tile_size_y
 
+        # start the tile prefetcher
+        if prefetch_workers is None:
+            prefetch_workers = tile_prefetch.DefaultWorkers
+        self.prefetch_ring = prefetch_ring
+        if prefetch_ring is None:
+            self.prefetch_ring = tile_prefetch.DefaultRing
+        self.prefetch_view = None       # the view last prefetched for
+        self.prefetcher = None
+        if prefetch_workers > 0:
+            self.prefetcher = tile_prefetch.Prefetcher(
+                                  self.tiles.load_image, self.onPrefetched,
+                                  is_cached=self.tiles.cache.__contains__,
+                                  workers=prefetch_workers)
+
         # set some internal state
         self.view_width = None          # view size in pixels
         self.view_height = None         # set on onResize()
@@ -386,6 +498,7 @@ class pySlip(wx.Panel):
         self.Bind(wx.EVT_MIDDLE_DOWN, self.onMiddleDown)
         self.Bind(wx.EVT_MIDDLE_UP, self.onMiddleUp)
         self.Bind(wx.EVT_MOUSEWHEEL, self.onMouseWheel)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self.onDestroy)
 
         # OK, use the tile level the user wants
         self.use_level(self.level)
@@ -996,7 +1109,7 @@ class pySlip(wx.Panel):
         Centre an area and zoom to view such that the area will fill
         approximately 50% of width or height, whichever is greater.
 
-        Use the ppd_x and ppd_y values in level 'tiles.info' files.
+        Use the ppd_x and ppd_y values in the preloaded level tile info.
         """
 
         # unpack area width.height (degrees)
@@ -1005,7 +1118,7 @@ class pySlip(wx.Panel):
         # step through levels (smallest first) and check view size (degrees)
         for l in self.tiles.levels:
             level = l
-            (_, _, ppd_x, ppd_y) = self.tiles.get_info(l)
+            (_, _, ppd_x, ppd_y) = self.tiles.info[l]
             view_deg_width = self.view_width / ppd_x
             view_deg_height = self.view_height / ppd_y
 
@@ -1153,6 +1266,7 @@ class pySlip(wx.Panel):
         dc = wx.PaintDC(self)
         self.drawTilesLayers(dc)
 
+    @log.timed()
     def drawTilesLayers(self, dc=None, clear=False):
         """Do actual map tile and layers drawing.
 
@@ -1193,6 +1307,10 @@ class pySlip(wx.Panel):
                               / self.tile_size_y)
             y_pix_start = start_y_tile*self.tile_size_y - y_offset
 
+        # keep the tiles in view in the cache
+        self.tiles.pin_view(start_x_tile, stop_x_tile,
+                            start_y_tile, stop_y_tile)
+
         # start pasting tiles onto view
         for x in range(start_x_tile, stop_x_tile):
             y_pix = y_pix_start
@@ -1201,6 +1319,10 @@ class pySlip(wx.Panel):
                 y_pix += self.tile_size_y
             x_pix += self.tile_size_x
 
+        # load the tiles we may need next
+        self.prefetchTiles(start_x_tile, stop_x_tile,
+                           start_y_tile, stop_y_tile)
+
         # draw layers
         for id in self.layer_z_order:
             l = self.layer_mapping[id]
@@ -1218,6 +1340,59 @@ class pySlip(wx.Panel):
             dc.DrawRectangle(self.sbox_1_x, self.sbox_1_y,
                              self.sbox_w, self.sbox_h)
 
+    def prefetchTiles(self, start_x, stop_x, start_y, stop_y):
+        """Start loading tiles around a view, and for the next zoom in/out.
+
+        start_x, stop_x  range of X tile coordinates in the view
+        start_y, stop_y  range of Y tile coordinates in the view
+
+        A new view cancels loading for the previous one.  Prefetched tiles
+        are limited to PrefetchFraction of the tile cache budget.
+        """
+
+        if self.prefetcher is None:
+            return
+
+        view = (self.level, start_x, stop_x, start_y, stop_y)
+        if view == self.prefetch_view:
+            return
+        self.prefetch_view = view
+
+        keys = tile_prefetch.prefetch_keys(self.level, start_x, stop_x,
+                                           start_y, stop_y,
+                                           self.tiles.num_tiles,
+                                           self.prefetch_ring)
+
+        # keep within the budget, tile bitmaps are at the display depth
+        tile_bytes = self.tiles.image_bytes(self.tile_size_x,
+                                            self.tile_size_y,
+                                            wx.GetDisplayDepth())
+        max_tiles = int(self.tiles.cache.max_bytes * self.PrefetchFraction
+                        / tile_bytes)
+        max_tiles -= (stop_x - start_x) * (stop_y - start_y)
+        self.prefetcher.request(keys[:max(max_tiles, 0)])
+
+    def onPrefetched(self, generation, key, decoded):
+        """Handle a tile decoded by the prefetcher (worker thread)."""
+
+        wx.CallAfter(self.addPrefetched, generation, key, decoded)
+
+    def addPrefetched(self, generation, key, decoded):
+        """Cache a prefetched tile as a bitmap (GUI thread)."""
+
+        # drop it if the window has gone or the view has moved on
+        if (self and self.prefetcher is not None
+                and self.prefetcher.is_current(generation)):
+            self.tiles.add_image(key, decoded)
+
+    def onDestroy(self, event):
+        """Stop the prefetcher when the widget is destroyed."""
+
+        if self.prefetcher is not None and event.GetEventObject() is self:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        event.Skip()
+
     def onResize(self, event=None):
         """Handle a window resize.
 
@@ -4,30 +4,368 @@
 
 Run this bit of the generate code as a separate process.
 
-Usage: python run_build.py <event1> <event2> ...
+Usage: python run_build.py [-j <jobs>] [-c <cache_dir> [-s <cache_mb>]]
+                           [-m <manifest>] [-t <history>] [-p] [-g]
+                           <logfile> <scenario> <gen_save_dir>
+                           <app_name> <mux_dir> <event_file>
+                           <event1> <event2> ...
+
+where <jobs>      is the number of events to build at once (default is the
+                  number of cores, 1 without the multiprocessing module)
+      <cache_dir> is the STS cache directory, events built before are
+                  taken from the cache
+      <cache_mb>  is the STS cache size limit in MB
+      <manifest>  is the scenario manifest file, events already built from
+                  the same inputs are skipped and built events are recorded
+      <history>   is the build time history file, the time of each built
+                  event is recorded and the build cost model refitted
+      -p          write progress messages to stdout (see progress.py), any
+                  other output goes to stderr
+      -g          also write a CSV file per gauge (sts_gauge_<index>.csv)
+
+All processes write to the one log file.
 """
 
 
 import os
+import sys
 import time
+import atexit
+import threading
+import traceback
+import Queue
+try:
+    import multiprocessing
+except ImportError:
+    # Python 2.5, events are built one at a time
+    multiprocessing = None
+
+import manifest as mf
+import cost_model
+import progress as pg
+from log import Timings
 
 
 LogFD = None
 LogFilename = None
 
+# log lines and progress messages not yet written
+LogBuffer = []
+ProgressBuffer = []
+LogLock = threading.Lock()
+
+# most seconds a log line is held before it's written
+LogLatency = 0.5
+
+# process the flusher thread runs in, the thread, and its stop event
+FlusherPid = None
+Flusher = None
+FlusherStop = None
+
+# file descriptor to write progress messages to, None for no messages
+ProgressFD = None
+
+# the build_urs_boundary module, imported once when first needed
+Builder = None
+
+# seconds between checks for a dead worker process
+WorkerPoll = 1.0
+
 
 def log(msg):
+    """Log a line, written at most LogLatency seconds later.
+
+    Lines (and their progress 'log' messages) are written in batches of
+    whole lines by a flusher thread, so processes appending to the one log
+    file don't split each other's lines.
+    """
+
+    start_flusher()
+
+    LogLock.acquire()
+    try:
+        LogBuffer.append(msg+'\n')
+        if ProgressFD is not None:
+            ProgressBuffer.append(pg.message(pg.Log, text=msg))
+    finally:
+        LogLock.release()
+
+
+def progress(stage, **kwargs):
+    """Send a progress message now, after any buffered log messages."""
+
+    if ProgressFD is None:
+        return
+
+    start_flusher()
+
+    LogLock.acquire()
+    try:
+        ProgressBuffer.append(pg.message(stage, **kwargs))
+    finally:
+        LogLock.release()
+    flush_log()
+
+
+def start_flusher():
+    """Start the thread writing buffered lines, once in each process.
+
+    A forked worker process starts its own, with a new lock (the parent's
+    may have been held by its flusher) and no inherited lines (they are
+    the parent's to write).
+    """
+
+    global FlusherPid, Flusher, FlusherStop, LogLock
+
+    if FlusherPid == os.getpid():
+        return
+
+    if FlusherPid is not None:
+        LogLock = threading.Lock()
+        del LogBuffer[:]
+        del ProgressBuffer[:]
+    FlusherPid = os.getpid()
+
+    FlusherStop = threading.Event()
+    Flusher = threading.Thread(target=flusher, args=(FlusherStop,))
+    Flusher.setDaemon(True)
+    Flusher.start()
+    atexit.register(stop_flusher)
+
+
+def flusher(stop):
+    """Thread body: write buffered lines every LogLatency seconds.
+
+    stop  event set to end the thread
+    """
+
+    # Event.wait() only returns the flag from Python 2.7
+    while not stop.isSet():
+        stop.wait(LogLatency)
+        try:
+            flush_log()
+        except (IOError, OSError):
+            pass
+
+
+def stop_flusher():
+    """Stop this process's flusher thread and write what is left."""
+
+    if FlusherPid == os.getpid():
+        FlusherStop.set()
+        Flusher.join()
+    flush_log()
+
+
+def flush_log():
+    """Write any buffered log lines and progress messages."""
+
     global LogFD
 
-    if not LogFD:
-        LogFD = open(LogFilename, 'w')
+    LogLock.acquire()
+    try:
+        if LogBuffer:
+            # append, so the log can be shared by worker processes
+            if not LogFD:
+                LogFD = os.open(LogFilename,
+                                os.O_WRONLY|os.O_APPEND|os.O_CREAT)
+            os.write(LogFD, ''.join(LogBuffer))
+            del LogBuffer[:]
+        if ProgressBuffer:
+            if ProgressFD is not None:
+                os.write(ProgressFD, ''.join(ProgressBuffer))
+            del ProgressBuffer[:]
+    finally:
+        LogLock.release()
+
+
+def default_jobs():
+    """Get the default number of worker processes, the number of cores.
+
+    Returns 1 if there is no multiprocessing module.
+    """
+
+    if multiprocessing is None:
+        return 1
+
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def builder():
+    """Get the build_urs_boundary module, importing it once.
+
+    The import pulls in ANUGA, Scientific and NumPy, which is slow, so a
+    process (or the build daemon) only pays for it once.
+    """
+
+    global Builder
+
+    if Builder is None:
+        import build_urs_boundary
+        Builder = build_urs_boundary
+
+    return Builder
+
+
+def build_event(args):
+    """Run build_urs_boundary.py for one event.
+
+    args  tuple (log_filename, progress_fd, ScenarioName, GenSaveDir,
+                 MuxDirectory, EventFile, cache_dir, cache_size, gauge_csv,
+                 event_id)
+
+    Returns a tuple (event_id, error, stats) where error is None on success,
+    else the traceback string, and stats is the build statistics dictionary
+    from build_urs_boundary() with the wall time added as 'seconds'.  Runs in
+    a worker process if building in parallel.
+    """
+
+    global LogFilename, ProgressFD
+
+    (log_filename, progress_fd, ScenarioName, GenSaveDir, MuxDirectory,
+     EventFile, cache_dir, cache_size, gauge_csv, event_id) = args
+    LogFilename = log_filename
+    ProgressFD = progress_fd
+
+    start = time.time()
+    progress(pg.Build, event=event_id)
+    try:
+        log('Handling event ID %d' % event_id)
+
+        # get paths
+        event_folder = os.path.join(GenSaveDir, ScenarioName,
+                                    'boundaries', str(event_id))
+
+        # now run the build
+        bub = builder()
+
+        log('Running build_urs_boundary() for event %d' % event_id)
+        bub.log = log
+        output_dir = os.path.join(event_folder, ScenarioName)
+        stats = bub.build_urs_boundary(EventFile, output_dir, True,
+                                       event_folder, MuxDirectory,
+                                       '../boundaries/urs_order.csv',
+                                       ScenarioName, gauge_csv=gauge_csv,
+                                       cache_dir=cache_dir,
+                                       cache_size=cache_size)
+    except Exception:
+        error = traceback.format_exc()
+        log('Event %d failed:\n%s' % (event_id, error))
+        flush_log()
+        return (event_id, error, None)
+
+    flush_log()
+
+    if stats is not None:
+        stats['seconds'] = time.time() - start
+
+    return (event_id, None, stats)
+
+
+def build_worker(args, results):
+    """Worker process body: build one event, put the result on a queue.
+
+    args     the build_event() arguments tuple
+    results  multiprocessing.Queue for the build_event() result
+    """
+
+    results.put(build_event(args))
+
+
+def build_parallel(args, jobs, finished):
+    """Build events in up to 'jobs' worker processes at once.
+
+    args      list of build_event() argument tuples
+    jobs      number of events to build at once
+    finished  function finished(event_id, error, stats) called in this
+              process with each event's result
 
-    LogFD.write(msg+'\n')
-    LogFD.flush()
+    Each event is built in its own worker process, so a worker that dies
+    (killed for memory, or crashed in C code) fails just its event, rather
+    than hanging the build as a lost multiprocessing.Pool task would.
+    """
+
+    # import the builder once here, so forked workers inherit it
+    if sys.platform != 'win32':
+        try:
+            builder()
+        except Exception:
+            pass            # each event reports the error
+    flush_log()             # else the workers inherit the buffered lines
+
+    results = multiprocessing.Queue()
+    pending = list(args)
+    running = {}            # event_id -> worker process
+    done = 0
+    try:
+        while pending or running:
+            while pending and len(running) < jobs:
+                a = pending.pop(0)
+                worker = multiprocessing.Process(target=build_worker,
+                                                 args=(a, results))
+                worker.start()
+                running[a[-1]] = worker
+
+            # a worker that exits puts its result first, so one that had
+            # exited before an empty get() died without a result
+            exited = [event_id for (event_id, p) in running.items()
+                      if p.exitcode is not None]
+            try:
+                result = results.get(True, WorkerPoll)
+            except Queue.Empty:
+                for event_id in exited:
+                    worker = running.pop(event_id)
+                    worker.join()
+                    error = ('Worker process died (exit code %d)'
+                             % worker.exitcode)
+                    log('Event %d failed: %s' % (event_id, error))
+                    done += 1
+                    finished(event_id, error, None)
+                continue
+
+            (event_id, error, stats) = result
+            running.pop(event_id).join()
+            done += 1
+            finished(event_id, error, stats)
+            log('Event %d done (%d of %d)' % (event_id, done, len(args)))
+    except:
+        for worker in running.values():
+            worker.terminate()
+        raise
+
+
+def build_fingerprint(ScenarioName, GenSaveDir, MuxDirectory, EventFile,
+                      event_id, gauge_csv=False):
+    """Get the manifest stage name and fingerprint for an event build.
+
+    The build depends on the event file and the urs_order.csv file, and on
+    whether gauge CSV files are written.
+    """
+
+    boundaries_dir = os.path.join(GenSaveDir, ScenarioName, 'boundaries')
+    event_file = os.path.join(boundaries_dir, str(event_id), EventFile)
+    urs_order = os.path.join(boundaries_dir, 'urs_order.csv')
+    try:
+        inputs = [mf.file_fingerprint(event_file),
+                  mf.file_fingerprint(urs_order),
+                  os.path.abspath(MuxDirectory)]
+        if gauge_csv:
+            # builds without CSV files keep their old fingerprint
+            inputs.append('gauge_csv')
+        fp = mf.fingerprint(*inputs)
+    except (IOError, OSError):
+        fp = None
+
+    return ('build:%d' % event_id, fp)
 
 
 def run_build(log_filename, ScenarioName, GenSaveDir, AppLongName,
-              MuxDirectory, EventFile, selected_events):
+              MuxDirectory, EventFile, selected_events, jobs=1,
+              cache_dir=None, cache_size=None, manifest_file=None,
+              history_file=None, progress_fd=None, gauge_csv=False):
     """Run build_urs_boundary.py for each selected event.
 
     log_filename     path to the log file to generate/monitor
@@ -37,50 +375,190 @@ def run_build(log_filename, ScenarioName, GenSaveDir, AppLongName,
     MuxDirectory     path to the MUX directory
     EventFile        path to the event file
     selected_events  a list of event IDs (strings)
+    jobs             number of events to build at once
+    cache_dir        path to the STS cache directory, None for no cache
+    cache_size       STS cache size limit in bytes
+    manifest_file    path to the scenario manifest, None for no manifest
+    history_file     path to the build time history, None for no history
+    progress_fd      file descriptor to write progress messages to, None
+                     for no messages
+    gauge_csv        if True also write a CSV file per gauge
+
+    Returns True if all events were built.  The 'Generation is finished'
+    marker is only logged if every event succeeded.  If there is a manifest,
+    events already built from the same inputs are skipped and each event is
+    recorded as it finishes, so a re-run resumes at the unbuilt events.
     """
 
-    global LogFilename
+    global LogFilename, ProgressFD
 
     LogFilename = log_filename
+    ProgressFD = progress_fd
 
-    # now run build_urs_boundary for each event ID
+    manifest = None
+    stages = {}
+    if manifest_file:
+        manifest = mf.Manifest(manifest_file)
+    args = []
     for event_id in selected_events:
-        log('Handling event ID %d' % event_id)
+        (stage, fp) = build_fingerprint(ScenarioName, GenSaveDir,
+                                        MuxDirectory, EventFile, event_id,
+                                        gauge_csv)
+        stages[event_id] = (stage, fp)
+        if manifest and fp and manifest.is_done(stage, fp):
+            log('Event %d already built, skipping' % event_id)
+            continue
+        args.append((log_filename, progress_fd, ScenarioName, GenSaveDir,
+                     MuxDirectory, EventFile, cache_dir, cache_size,
+                     gauge_csv, event_id))
+    jobs = max(1, min(jobs, len(args)))
+    if multiprocessing is None:
+        jobs = 1
 
-        # get paths
-        event_folder = os.path.join(GenSaveDir, ScenarioName,
-                                    'boundaries', str(event_id))
+    failed = []
+    timings = Timings()
+    build_progress = pg.Progress(progress_fd, len(args), send=progress)
+    build_progress.started()
 
-        # now run the build
-        import build_urs_boundary as bub
+    def finished(event_id, error, stats):
+        """Record an event result, in this process only."""
 
-        log('Running build_urs_boundary() for event %d' % event_id)
-        bub.log = log
-        bub.build_urs_boundary(EventFile,
-                               os.path.join(event_folder, ScenarioName),
-                               True, event_folder, MuxDirectory,
-                               '../boundaries/urs_order.csv', ScenarioName)
+        build_progress.event_done(event_id, error)
+        if error:
+            failed.append(event_id)
+            return
+
+        if stats:
+            timings.add('build_event', stats['seconds'], 0.0)
+            for (name, (wall, cpu)) in stats.get('spans', {}).items():
+                timings.add(name, wall, cpu)
+
+        if history_file and stats and not stats['cached']:
+            try:
+                cost_model.record(history_file, stats['sources'],
+                                  stats['gauges'], stats['mux_bytes'],
+                                  stats['seconds'])
+            except IOError, e:
+                log('Error recording build time: %s' % str(e))
+
+        if manifest and stages[event_id][1]:
+            sts_file = os.path.join(GenSaveDir, ScenarioName, 'boundaries',
+                                    str(event_id), ScenarioName+'.sts')
+            (stage, fp) = stages[event_id]
+            manifest.done(stage, fp, [sts_file])
 
-        del bub
+    # now run build_urs_boundary for each event ID
+    if jobs == 1:
+        for a in args:
+            finished(*build_event(a))
+    else:
+        log('Building %d events with %d processes' % (len(args), jobs))
+        build_parallel(args, jobs, finished)
+
+    # refit the build cost model with any new times
+    if history_file:
+        try:
+            cost_model.fit(history_file)
+        except (IOError, ValueError), e:
+            log('Error fitting build cost model: %s' % str(e))
+
+    # summarise where the time went
+    table = timings.table()
+    if len(table) > 1:
+        log('Timing summary:')
+        for line in table:
+            log(line)
+
+    failed.sort()
+    build_progress.all_done(failed)
+    if failed:
+        log('Generation FAILED for events: %s'
+            % ', '.join([str(x) for x in failed]))
+        log('*' * 80)
+        flush_log()
+        return False
 
     log('Generation is finished')
     log('*' * 80)
     log('*' * 80)
+    flush_log()
 
-if __name__ == '__main__':
-    import sys
+    return True
+
+def progress_stdout():
+    """Keep stdout for progress messages only.
+
+    Anything else written to stdout (prints from urs2sts() or the worker
+    processes, by Python or C code) would get mixed into the messages, so
+    file descriptor 1 is pointed at stderr and the messages are written
+    to a private copy of the original stdout.
+
+    Returns the file descriptor to write progress messages to.
+    """
+
+    sys.stdout.flush()
+    progress_fd = os.dup(1)
+    os.dup2(2, 1)
+
+    return progress_fd
+
+def main(argv):
+    """Run the build from command line arguments.
+
+    argv  the arguments after the program name (see the module docstring)
+
+    Returns the exit status.
+    """
+
+    global LogFilename
+
+    import getopt
+
+    try:
+        (opts, args) = getopt.getopt(argv, 'j:c:s:m:t:pg')
+        opts = dict(opts)
+        jobs = int(opts.get('-j', default_jobs()))
+        cache_dir = opts.get('-c', None)
+        manifest_file = opts.get('-m', None)
+        history_file = opts.get('-t', None)
+        gauge_csv = ('-g' in opts)
+        progress_fd = None
+        if '-p' in opts:
+            progress_fd = progress_stdout()
+        cache_size = None
+        if '-s' in opts:
+            cache_size = int(opts['-s']) * 1024 * 1024
+    except (getopt.GetoptError, ValueError), e:
+        print(str(e))
+        print(__doc__)
+        return 10
+
+    if len(args) < 6:
+        print(__doc__)
+        return 10
 
     # get all selected events from command line
-    LogFilename = sys.argv[1]
-    ScenarioName = sys.argv[2]
-    GenSaveDir =  sys.argv[3]
-    AppLongName = sys.argv[4]
-    MuxDirectory = sys.argv[5]
-    EventFile = sys.argv[6]
-    selected_events = sys.argv[7:]
+    log_filename = args[0]
+    ScenarioName = args[1]
+    GenSaveDir =  args[2]
+    AppLongName = args[3]
+    MuxDirectory = args[4]
+    EventFile = args[5]
+    selected_events = args[6:]
     selected_events = [int(x) for x in selected_events]
 
+    # start a new log, the processes all append to it
+    LogFilename = log_filename
+    open(LogFilename, 'w').close()
     log('Generation logfile is: %s' % LogFilename)
 
-    run_build(LogFilename, ScenarioName, GenSaveDir, AppLongName,
-              MuxDirectory, EventFile, selected_events)
+    if not run_build(LogFilename, ScenarioName, GenSaveDir, AppLongName,
+                     MuxDirectory, EventFile, selected_events, jobs,
+                     cache_dir, cache_size, manifest_file, history_file,
+                     progress_fd, gauge_csv):
+        return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
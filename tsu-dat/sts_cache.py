@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+"""A content-addressed cache of generated STS boundary data.
+
+An event's STS file and gauge outputs depend only on the MUX files used, the
+weights in the event file and the contents of the urs_order.csv file.  We
+hash those to a key and keep the outputs in <cache_dir>/<key>/.  A later build
+with the same key can copy the outputs instead of building.  Entries are
+always copied in and out, never linked, so a later write to an event's
+outputs can't change the cache.
+
+The cache size is limited by evicting the least recently used entries.  An
+entry's directory mtime is its last use time.
+
+This module is copied into the generate directory with build_urs_boundary.py,
+so it must not import config.
+"""
+
+
+import os
+import shutil
+try:
+    import hashlib
+    new_hash = hashlib.sha1
+except ImportError:
+    import sha
+    new_hash = sha.new
+
+
+# bump this if the cached outputs change in any way
+CacheVersion = 1
+
+# default cache size limit, in bytes
+DefaultMaxBytes = 2 * 1024 * 1024 * 1024
+
+
+def cache_key(mux_filenames, mux_weights, urs_order, *extra):
+    """Get the cache key for an STS build.
+
+    mux_filenames  list of paths to the MUX files
+    mux_weights    list of weights, one per MUX file
+    urs_order      path to the urs_order.csv file
+    extra          any other values that change the build outputs
+
+    The size and mtime of each MUX file are included, so changed MUX data
+    changes the key.  Returns a hex string.
+    """
+
+    h = new_hash()
+    h.update('v%d\n' % CacheVersion)
+    for (filename, weight) in zip(mux_filenames, mux_weights):
+        h.update('%s %r\n' % (os.path.basename(filename), float(weight)))
+        try:
+            st = os.stat(filename)
+            h.update('%d %r\n' % (st.st_size, st.st_mtime))
+        except OSError:
+            h.update('missing\n')
+
+    fd = open(urs_order, 'rb')
+    h.update(fd.read())
+    fd.close()
+
+    for value in extra:
+        h.update('\n%r' % (value,))
+
+    return h.hexdigest()
+
+
+def mux_sources(lines, mux_dir):
+    """Get the MUX files and weights from multi-mux event file lines.
+
+    lines    the event file lines after the count line, '<mux> <weight>'
+    mux_dir  path to the MUX directory
+
+    MUX names are chopped just after '.grd'.  Returns a tuple
+    (mux_filenames, mux_weights).
+    """
+
+    mux_filenames = []
+    mux_weights = []
+    for line in lines:
+        fields = line.strip().split()
+        muxname = fields[0]
+        split_index = muxname.index('.grd')
+        muxname = muxname[:split_index+len('.grd')]
+        mux_filenames.append(os.path.join(mux_dir, muxname))
+        mux_weights.append(float(fields[1]))
+
+    return (mux_filenames, mux_weights)
+
+
+def event_cache_key(event_file, mux_dir, urs_order, *extra):
+    """Get the cache key a build from a multi-mux event file would use.
+
+    event_file  path to the event file
+    mux_dir     path to the MUX directory
+    urs_order   path to the urs_order.csv file
+    extra       any other values that change the build outputs
+
+    Returns the key, or None if the files can't be read.
+    """
+
+    try:
+        fd = open(event_file, 'r')
+        lines = fd.readlines()
+        fd.close()
+        (mux_filenames, mux_weights) = mux_sources(lines[1:], mux_dir)
+        return cache_key(mux_filenames, mux_weights, urs_order, *extra)
+    except (IOError, ValueError, IndexError):
+        return None
+
+
+def contains(cache_dir, key):
+    """See if a key is in the cache."""
+
+    return os.path.isdir(os.path.join(cache_dir, key))
+
+
+def copy_out(src, dst):
+    """Copy a cached file to dst, replacing any file (or link) there."""
+
+    if os.path.exists(dst):
+        os.remove(dst)
+    shutil.copy2(src, dst)
+
+
+def fetch(cache_dir, key, dest_dir, renames=None):
+    """Get cached outputs for a key into a directory.
+
+    cache_dir  path to the cache directory
+    key        the cache key
+    dest_dir   directory to put the cached files in
+    renames    dictionary mapping cached names to destination names
+
+    Returns True if the key was in the cache and the files were fetched.
+    """
+
+    if renames is None:
+        renames = {}
+
+    entry = os.path.join(cache_dir, key)
+    try:
+        names = os.listdir(entry)
+    except OSError:
+        return False
+
+    try:
+        for name in names:
+            copy_out(os.path.join(entry, name),
+                     os.path.join(dest_dir, renames.get(name, name)))
+        os.utime(entry, None)
+    except (IOError, OSError):
+        # entry evicted while we were fetching it
+        return False
+
+    return True
+
+
+def store(cache_dir, key, files, max_bytes=None):
+    """Put outputs into the cache under a key, then enforce the size limit.
+
+    cache_dir  path to the cache directory
+    key        the cache key
+    files      list of (path, name) of files to cache under their names
+    max_bytes  cache size limit in bytes (DefaultMaxBytes if None)
+
+    The entry is built in a temporary directory and renamed into place, so a
+    partial entry is never seen.  Another process may store the same key at
+    the same time, the first one wins.
+    """
+
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # made by another process?
+            if not os.path.isdir(cache_dir):
+                raise
+
+    entry = os.path.join(cache_dir, key)
+    if os.path.isdir(entry):
+        os.utime(entry, None)
+        return
+
+    tmp_entry = '%s.tmp-%d' % (entry, os.getpid())
+    shutil.rmtree(tmp_entry, ignore_errors=True)
+    os.makedirs(tmp_entry)
+    for (path, name) in files:
+        # copy, so later writes to the build outputs can't change the cache
+        shutil.copy2(path, os.path.join(tmp_entry, name))
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    evict(cache_dir, max_bytes)
+
+
+def entry_size(entry):
+    """Get the total size of the files in a cache entry."""
+
+    size = 0
+    for name in os.listdir(entry):
+        size += os.path.getsize(os.path.join(entry, name))
+
+    return size
+
+
+def evict(cache_dir, max_bytes=None):
+    """Remove least recently used entries until the cache fits in max_bytes.
+
+    cache_dir  path to the cache directory
+    max_bytes  cache size limit in bytes (DefaultMaxBytes if None)
+
+    Returns a list of the evicted keys.
+    """
+
+    if max_bytes is None:
+        max_bytes = DefaultMaxBytes
+
+    entries = []
+    total = 0
+    for key in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, key)
+        if '.tmp-' in key or not os.path.isdir(entry):
+            continue
+        try:
+            size = entry_size(entry)
+            mtime = os.path.getmtime(entry)
+        except OSError:
+            continue
+        entries.append((mtime, key, size))
+        total += size
+
+    entries.sort()
+    evicted = []
+    for (_, key, size) in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        total -= size
+        evicted.append(key)
+
+    return evicted
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""Test functions in build_daemon.py."""
+
+
+import os
+import time
+import socket
+import unittest
+import tempfile
+import shutil
+
+import build_daemon as bd
+import progress as pg
+
+
+class Test_BuildDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.address = os.path.join(self.tmp_dir, 'daemon')
+        self.key_file = os.path.join(self.tmp_dir, 'daemon.key')
+
+    def tearDown(self):
+        bd.request(self.address, self.key_file, 'shutdown')
+        stop = time.time() + 10
+        while time.time() < stop and os.path.exists(self.address):
+            time.sleep(0.1)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_no_daemon(self):
+        self.failUnless(bd.request(self.address, self.key_file,
+                                   'ping') is None)
+
+    def test_unsupported(self):
+        # without fork() builds run as subprocesses, no daemon is started
+        supported = bd.Supported
+        bd.Supported = False
+        try:
+            self.failUnless(bd.submit(self.address, self.key_file,
+                                      self.tmp_dir, []) is None)
+        finally:
+            bd.Supported = supported
+        self.failIf(os.path.exists(self.address))
+
+    def test_endpoint_owner(self):
+        d = bd.Daemon(self.address, bd.read_key(self.key_file, make=True))
+        self.failUnless(d.endpoint is not None)
+        self.failUnless(bd.endpoint_id(self.address) == d.endpoint)
+
+        # a newer daemon takes over the address
+        os.remove(self.address)
+        s = socket.socket(socket.AF_UNIX)
+        s.bind(self.address)
+        self.failIf(bd.endpoint_id(self.address) == d.endpoint)
+        s.close()
+        d.listener.close()          # removes the address
+        self.failUnless(bd.endpoint_id(self.address) is None)
+
+    def test_key(self):
+        key = bd.read_key(self.key_file, make=True)
+        self.failUnless(key)
+        self.failUnless(bd.read_key(self.key_file) == key)
+        self.failUnless(os.stat(self.key_file).st_mode & 0077 == 0)
+
+    def test_forker(self):
+        forker = bd.Forker()
+        (read_fd, write_fd) = os.pipe()
+        forker.start(self.tmp_dir, [], write_fd)
+        os.close(write_fd)
+        f = os.fdopen(read_fd, 'r')
+        lines = f.readlines()
+        f.close()
+        forker.conn.close()         # the forker exits
+
+        # run_build printed its usage, then the child sent its status
+        self.failUnless(lines[-1] == bd.ExitMarker + '10\n', lines[-1:])
+        self.failUnless(len(lines) > 1)
+        self.failUnless(bd.exit_status('10\n') == 10)
+        self.failUnless(bd.exit_status('x') is None)
+
+    def test_build(self):
+        self.failUnless(bd.ensure(self.address, self.key_file))
+        self.failUnless(bd.request(self.address, self.key_file, 'ping')
+                        == ('pong', bd.DaemonVersion, bd.code_stamp()))
+
+        # there is no MUX data, so the event build fails
+        log_file = os.path.join(self.tmp_dir, 'build.log')
+        argv = ['-p', '-j', '1', log_file, 'test', self.tmp_dir, 'app',
+                self.tmp_dir, 'event.lst', '1']
+        p = bd.submit(self.address, self.key_file, self.tmp_dir, argv)
+        self.failIf(p is None)
+        msgs = [pg.parse(line) for line in iter(p.stdout.readline, '')]
+        self.failUnless(p.wait() == 1)
+
+        stages = [m['stage'] for m in msgs if m and m['stage'] != pg.Log]
+        self.failUnless(stages == [pg.Start, pg.Build, pg.Failed,
+                                   pg.Finished], stages)
+        self.failUnless(os.path.exists(log_file))
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
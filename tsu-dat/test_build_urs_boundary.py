@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""Test functions in build_urs_boundary.py.
+
+The tests write a small synthetic STS file, so they need Scientific (and
+ANUGA, which build_urs_boundary imports).
+"""
+
+
+import os
+import unittest
+import tempfile
+import shutil
+
+import numpy as num
+
+try:
+    from Scientific.IO.NetCDF import NetCDFFile
+    import build_urs_boundary as bub
+except ImportError:
+    bub = None
+
+
+# synthetic STS file size
+NumGauges = 5
+NumTimes = 11
+
+
+def write_sts(filename):
+    """Write a synthetic STS file, returns a dictionary of its data."""
+
+    data = {'permutation': num.array([7, 3, 12, 1, 9]),
+            'x': num.arange(NumGauges) * 10.0,
+            'y': num.arange(NumGauges) * 20.0,
+            'elevation': -num.arange(NumGauges) * 100.0,
+            'time': num.arange(NumTimes) * 60.0}
+    i = num.arange(NumTimes).reshape((NumTimes, 1))
+    j = num.arange(NumGauges).reshape((1, NumGauges))
+    data['stage'] = num.sin(i*0.7 + j) * (j+1)
+    data['xmomentum'] = num.cos(i*0.3 - j) * 2.0
+    data['ymomentum'] = i*0.01 - j*0.5
+
+    fid = NetCDFFile(filename, 'w')
+    fid.xllcorner = 150.0
+    fid.yllcorner = -35.0
+    fid.starttime = 1000.0
+    fid.createDimension('number_of_points', NumGauges)
+    fid.createDimension('number_of_timesteps', NumTimes)
+    points = ('number_of_points',)
+    steps = ('number_of_timesteps',)
+    for (name, dims, typecode) in (('permutation', points, 'i'),
+                                   ('x', points, 'd'),
+                                   ('y', points, 'd'),
+                                   ('elevation', points, 'd'),
+                                   ('time', steps, 'd'),
+                                   ('stage', steps+points, 'd'),
+                                   ('xmomentum', steps+points, 'd'),
+                                   ('ymomentum', steps+points, 'd')):
+        var = fid.createVariable(name, typecode, dims)
+        var[:] = data[name]
+    fid.close()
+
+    data['x'] = data['x'] + 150.0
+    data['y'] = data['y'] - 35.0
+    data['time'] = data['time'] + 1000.0
+
+    return data
+
+
+def old_gauge_csv(filename, data, j):
+    """Write gauge j's CSV file the way get_sts_gauge_data() used to."""
+
+    stage = data['stage'][:,j]
+    xmomentum = data['xmomentum'][:,j]
+    ymomentum = data['ymomentum'][:,j]
+    time = data['time']
+
+    fid_sts = open(filename, 'w')
+    fid_sts.write('time, stage, xmomentum, ymomentum \n')
+    for k in range(len(time)-1):
+        fid_sts.write('%.6f, %.6f, %.6f, %.6f\n'
+                      % (time[k], stage[k], xmomentum[k], ymomentum[k]))
+    fid_sts.close()
+
+
+@unittest.skipIf(bub is None, 'needs Scientific and ANUGA')
+class Test_BuildURSBoundary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.sts = os.path.join(self.tmp_dir, 'test')
+        self.data = write_sts(self.sts+'.sts')
+        bub.log = lambda msg: None
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, path):
+        fd = open(path)
+        result = fd.read()
+        fd.close()
+        return result
+
+    def gauge_data(self, time_block, gauge_csv=False):
+        """Run get_sts_gauge_data() into a new folder, returns the folder."""
+
+        folder = os.path.join(self.tmp_dir, 'block_%d' % time_block)
+        os.mkdir(folder)
+        bub.get_sts_gauge_data(self.sts, folder, gauge_csv=gauge_csv,
+                               time_block=time_block)
+        return folder
+
+    def test_block_max_min(self):
+        whole = self.gauge_data(NumTimes)
+        for time_block in (1, 3, 4):
+            folder = self.gauge_data(time_block)
+            for name in ('max_sts_stage.csv', 'min_sts_stage.csv'):
+                self.failUnless(self.read(os.path.join(folder, name))
+                                == self.read(os.path.join(whole, name)),
+                                (time_block, name))
+
+        # and equal the whole-array results
+        lines = self.read(os.path.join(whole, 'max_sts_stage.csv'))
+        lines = lines.splitlines()
+        self.failUnless(lines[0] == 'index, x, y, max_stage ')
+        stage_max = self.data['stage'].max(axis=0)
+        for j in range(NumGauges):
+            self.failUnless(lines[j+1] == '%d, %.6f, %.6f, %.6f'
+                            % (self.data['permutation'][j], self.data['x'][j],
+                               self.data['y'][j], stage_max[j]))
+        lines = self.read(os.path.join(whole, 'min_sts_stage.csv'))
+        lines = lines.splitlines()
+        stage_min = self.data['stage'].min(axis=0)
+        self.failUnless([float(l.split(',')[3]) for l in lines[1:]]
+                        == [float('%.6f' % v) for v in stage_min])
+
+    def test_gauge_files(self):
+        folder = self.gauge_data(3)
+        for name in bub.GaugeQuantities:
+            data = num.load(bub.gauge_path(folder, name))
+            self.failUnless(data.shape == (NumGauges, NumTimes))
+            self.failUnless(num.all(data == num.transpose(self.data[name])))
+
+        for (j, index) in enumerate(self.data['permutation']):
+            gauge = bub.load_gauge(folder, index)
+            self.failUnless(num.all(gauge['time'] == self.data['time']))
+            for name in bub.GaugeQuantities:
+                self.failUnless(gauge[name].shape == (NumTimes,))
+                self.failUnless(num.all(gauge[name] == self.data[name][:,j]))
+
+        self.failUnlessRaises(Exception, bub.load_gauge, folder, 99)
+
+    def test_load_gauge_memory_mapped(self):
+        folder = self.gauge_data(3)
+        loads = []
+        old_load = bub.num.load
+
+        def load(filename, mmap_mode=None):
+            loads.append((os.path.basename(filename), mmap_mode))
+            return old_load(filename, mmap_mode=mmap_mode)
+
+        bub.num.load = load
+        try:
+            bub.load_gauge(folder, self.data['permutation'][2])
+        finally:
+            bub.num.load = old_load
+
+        # each quantity file is memory-mapped, not read whole
+        for name in bub.GaugeQuantities:
+            self.failUnless((os.path.basename(bub.gauge_path(folder, name)),
+                             'r') in loads, loads)
+
+    def test_csv_export(self):
+        folder = self.gauge_data(4)
+        self.failIf([f for f in os.listdir(folder) if f.endswith('.csv')
+                     and f.startswith(bub.GaugeBasename)])
+
+        folder = self.gauge_data(3, gauge_csv=True)
+        for (j, index) in enumerate(self.data['permutation']):
+            name = '%s_%d.csv' % (bub.GaugeBasename, index)
+            expected = os.path.join(self.tmp_dir, name)
+            old_gauge_csv(expected, self.data, j)
+            self.failUnless(self.read(os.path.join(folder, name))
+                            == self.read(expected), name)
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
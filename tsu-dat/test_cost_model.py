@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""Test functions in cost_model.py."""
+
+
+import os
+import unittest
+import tempfile
+import shutil
+
+import cost_model as cm
+
+
+class Test_CostModel(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.history = os.path.join(self.tmp_dir, 'history')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_no_history(self):
+        self.failUnless(cm.fit(self.history) is None)
+        self.failUnless(cm.load_model(self.history) is None)
+
+    def test_fit(self):
+        # times are exactly 10 + 2*MB + 0.5*sources*gauges
+        mb = 1024 * 1024
+        for (s, g, b) in ((1, 10, 1), (2, 10, 5), (3, 20, 2),
+                          (4, 5, 8), (5, 30, 3), (6, 12, 9)):
+            cm.record(self.history, s, g, b*mb, 10 + 2*b + 0.5*s*g)
+
+        cm.fit(self.history)
+        coeffs = cm.load_model(self.history)
+        self.failUnless(abs(cm.predict(coeffs, 10, 10, 10*mb) - 80.0) < 1.0e-6)
+
+        events = [(10, 10, 10*mb), (1, 10, 1*mb), (1, 10, 1*mb)]
+        self.failUnless(abs(cm.estimate(coeffs, events, 1) - 114.0) < 1.0e-6)
+        self.failUnless(abs(cm.estimate(coeffs, events, 3) - 80.0) < 1.0e-6)
+
+    def test_event_features(self):
+        mux_dir = os.path.join(self.tmp_dir, 'mux')
+        os.makedirs(mux_dir)
+        for name in ('a.grd-z-mux2', 'a.grd-e-mux2', 'b.grd-z-mux2'):
+            fd = open(os.path.join(mux_dir, name), 'w')
+            fd.write('x' * 10)
+            fd.close()
+        event_file = os.path.join(self.tmp_dir, 'event.lst')
+        fd = open(event_file, 'w')
+        fd.write(' 2\n a.grd 1.5\n b.grd 0.5\n')
+        fd.close()
+
+        self.failUnless(cm.event_features(event_file, mux_dir, 7)
+                        == (2, 7, 30))
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""Test functions in generate.py and batch_generate.py."""
+
+
+import os
+import unittest
+import tempfile
+import shutil
+
+import testlog
+import generate as gen
+import batch_generate as bg
+import manifest as mf
+import run_build as rb
+import sts_cache
+
+
+class Test_Generate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp_dir, name)
+        fd = open(path, 'w')
+        fd.write(text)
+        fd.close()
+        return path
+
+    def test_wave_height_band(self):
+        self.failUnless(gen.wave_height_band(2.0, 0.5) == (1.5, 2.5))
+        self.failUnless(gen.wave_height_band(0.5, 1.0) == (0.0, 1.5))
+        self.failUnless(gen.wave_height_band(9.5, 1.0) == (8.5, 10.0))
+
+    def test_read_aoi_polygon(self):
+        path = self.write('aoi.csv',
+                          '# comment\n100.0,-10.0\n\n110.0  -10.0\n'
+                          '110.0,-20.0\n')
+        poly = gen.read_aoi_polygon(path)
+        self.failUnless(poly == [(100.0, -10.0), (110.0, -10.0),
+                                 (110.0, -20.0), (100.0, -10.0)])
+
+        path = self.write('bad.csv', '100.0,-10.0\nrubbish\n')
+        self.assertRaises(RuntimeError, gen.read_aoi_polygon, path)
+
+        path = self.write('utm.csv', '500000.0,6000000.0\n')
+        self.assertRaises(RuntimeError, gen.read_aoi_polygon, path)
+
+        self.assertRaises(RuntimeError, gen.read_aoi_polygon,
+                          os.path.join(self.tmp_dir, 'missing.csv'))
+
+    def test_hps_inside_aoi(self):
+        poly = [(0.0, 0.0), (10.0, 0.0), (10.0, 10.0), (0.0, 10.0),
+                (0.0, 0.0)]
+        hp_points = [(5.0, 5.0, 3), (15.0, 5.0, 1), (2.0, 8.0, 2)]
+        self.failUnless(gen.hps_inside_aoi(hp_points, poly)
+                        == [(3, 5.0, 5.0), (2, 2.0, 8.0)])
+
+    def test_split_fault_xy(self):
+        faultxy = self.write('fault.xy',
+                             'lon,lat,quake_id,subfault_id\n'
+                             '1.0,2.0,7,100\n1.5,2.5,8,101\n3.0,4.0,7,102\n')
+        for id in (7, 8):
+            os.mkdir(os.path.join(self.tmp_dir, str(id)))
+        gen.split_fault_xy(faultxy, self.tmp_dir, [7, 8])
+
+        fd = open(os.path.join(self.tmp_dir, '7', 'event_00007.xy'))
+        lines = fd.readlines()
+        fd.close()
+        self.failUnless(lines == ['lon,lat,quake_id,subfault_id\n',
+                                  '1.0,2.0,7,100\n', '3.0,4.0,7,102\n'])
+
+    def test_events_to_build(self):
+        (gen_save_dir, mux_dir) = (gen.cfg.GenSaveDir, gen.cfg.MuxDirectory)
+        gen.cfg.GenSaveDir = gen.cfg.MuxDirectory = self.tmp_dir
+        try:
+            paths = gen.scenario_paths('test', 1, 1.0, 2.0)
+            self.write('a.grd-z-mux2', 'mux data')
+            for (event_id, weight) in ((1, 1.0), (2, 1.0), (3, 0.5)):
+                event_dir = os.path.join(paths.boundaries_dir, str(event_id))
+                os.makedirs(event_dir)
+                fd = open(os.path.join(event_dir, gen.cfg.EventFile), 'w')
+                fd.write('1\na.grd-z-mux2 %f\n' % weight)
+                fd.close()
+            fd = open(paths.urs_order, 'w')
+            fd.write('index,longitude,latitude\n')
+            fd.close()
+
+            # event 1 built, event 2 in the STS cache
+            (stage, fp) = rb.build_fingerprint('test', self.tmp_dir,
+                                               self.tmp_dir,
+                                               gen.cfg.EventFile, 1)
+            mf.Manifest(paths.manifest).done(stage, fp, [])
+            event_file = os.path.join(paths.boundaries_dir, '2',
+                                      gen.cfg.EventFile)
+            key = sts_cache.event_cache_key(event_file, self.tmp_dir,
+                                            paths.urs_order, False)
+            os.makedirs(os.path.join(gen.sts_cache_dir(), key))
+
+            self.failUnless(gen.events_to_build(paths, [1, 3]) == [3])
+            # 1 and 2 have the same inputs, so 1 is in the cache too
+            self.failUnless(gen.events_to_build(paths, [2, 3]) == [3])
+        finally:
+            gen.cfg.GenSaveDir = gen_save_dir
+            gen.cfg.MuxDirectory = mux_dir
+
+    def test_build_command_gauge_csv(self):
+        (gen_save_dir, gauge_csv) = (gen.cfg.GenSaveDir, gen.cfg.GaugeCSV)
+        gen.cfg.GenSaveDir = self.tmp_dir
+        try:
+            paths = gen.scenario_paths('test', 1, 1.0, 2.0)
+            gen.cfg.GaugeCSV = False
+            self.failIf('-g' in gen.build_command(paths, [1]))
+            gen.cfg.GaugeCSV = True
+            cmd = gen.build_command(paths, [1], progress=True)
+            self.failUnless('-g' in cmd)
+            self.failUnless(cmd.index('-g') < cmd.index(paths.build_log))
+        finally:
+            gen.cfg.GenSaveDir = gen_save_dir
+            gen.cfg.GaugeCSV = gauge_csv
+
+    def test_read_jobs(self):
+        self.write('aoi.csv', '100.0,-10.0\n110.0,-10.0\n110.0,-20.0\n')
+        path = self.write('jobs.ini',
+                          '[one]\nhp_id = 12\nwave_height = 0.5\n'
+                          'aoi = aoi.csv\nzone = Sunda\nevents = all\n\n'
+                          '[two]\nscenario = other\nhp_id = 13\n'
+                          'wave_height = 1.0\nwave_height_delta = 0.2\n'
+                          'aoi = aoi.csv\nzone = Sunda\nevents = 4, 5 6\n')
+        jobs = bg.read_jobs(path)
+        self.failUnless([j.name for j in jobs] == ['one', 'two'])
+        self.failUnless(jobs[0].scenario == 'one')
+        self.failUnless(jobs[0].wave_height_delta == bg.DefaultWaveHeightDelta)
+        self.failUnless(jobs[0].events is None)
+        self.failUnless(jobs[0].aoi == os.path.join(self.tmp_dir, 'aoi.csv'))
+        self.failUnless(jobs[1].scenario == 'other')
+        self.failUnless(jobs[1].events == [4, 5, 6])
+
+        path = self.write('bad.ini', '[one]\nhp_id = twelve\n')
+        self.assertRaises(RuntimeError, bg.read_jobs, path)
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Test functions in get_hp_events.py."""
+
+
+import os
+import unittest
+import tempfile
+import shutil
+
+import testlog
+import config as cfg
+import get_hp_events as ghe
+
+
+TFileText = ('header line\n'
+             '2.50 1.0E-04 8.1 2.500 2 10 11\n'
+             '2.60 0.0E+00 7.9 1.250 1 12\n'
+             '3.10 2.5E-05 8.7 4.000 3 10 12 13\n'
+             '2.00 3.0E-05 8.0 1.000 1 14\n'
+             '2.90 4.0E-05 8.2 2.000 1 15\n')
+
+ZoneText = ('Alpha 0 2\n'
+            'Beta 3 4\n')
+
+
+class Test_GetHPEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.saved = (cfg.TFilesDirectory, cfg.TFileCacheDirectory,
+                      cfg.EventID2ZoneFile, cfg.EventTFile)
+        cfg.TFilesDirectory = self.tmp_dir
+        cfg.TFileCacheDirectory = os.path.join(self.tmp_dir, 'cache')
+        cfg.EventID2ZoneFile = os.path.join(self.tmp_dir, 'zones')
+        cfg.EventTFile = os.path.join(self.tmp_dir, 'T-00007')
+
+        fd = open(os.path.join(self.tmp_dir, 'T-00007'), 'w')
+        fd.write(TFileText)
+        fd.close()
+        fd = open(cfg.EventID2ZoneFile, 'w')
+        fd.write(ZoneText)
+        fd.close()
+
+    def tearDown(self):
+        (cfg.TFilesDirectory, cfg.TFileCacheDirectory,
+         cfg.EventID2ZoneFile, cfg.EventTFile) = self.saved
+        shutil.rmtree(self.tmp_dir)
+
+    def test_query(self):
+        events = ghe.query_hp_events(7, 2.0, 3.0, 'Alpha')
+        self.failUnless(events.event_id.tolist() == [0])
+
+        events = ghe.query_hp_events(7, 2.0, 3.2, 'Alpha')
+        self.failUnless(events.event_id.tolist() == [0, 2])
+
+        events = ghe.query_hp_events(7, 2.0, 3.0, 'Beta')
+        self.failUnless(events.event_id.tolist() == [3, 4])
+
+    def test_get_hp_events(self):
+        result = ghe.get_hp_events(7, 2.0, 3.2, 'Alpha')
+        expected = [('00000', '0.0001', '2.50', '8.1', '2.500'),
+                    ('00002', '2.5e-05', '3.10', '8.7', '4.000')]
+        self.failUnless(result == expected, 'result=%s' % str(result))
+
+    def test_bad_zone(self):
+        self.failUnlessRaises(RuntimeError, ghe.query_hp_events,
+                              7, 2.0, 3.0, 'Gamma')
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""Test functions in hazard_matrix.py."""
+
+
+import os
+import unittest
+import tempfile
+import shutil
+
+import testlog
+import config as cfg
+import hazard_matrix as hm
+
+
+# T-file text for each HP ID, events are (zquake, zprob, ...)
+TFiles = {3: ('header\n'
+              '1.0 1.0E-04 8.1 2.5 1 10\n'
+              '2.0 1.0E-04 8.2 2.5 1 11\n'),
+          5: ('header\n'
+              '3.0 1.0E-04 8.1 2.5 1 10\n'
+              '4.0 1.0E-04 8.2 2.5 1 11\n'),
+          9: ('header\n'
+              '5.0 1.0E-04 8.1 2.5 1 10\n'
+              '6.0 1.0E-04 8.2 2.5 1 11\n')}
+
+
+class Test_HazardMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.saved = cfg.TFilesDirectory
+        cfg.TFilesDirectory = self.tmp_dir
+        for (hp_id, text) in TFiles.items():
+            fd = open(os.path.join(self.tmp_dir, 'T-%05d' % hp_id), 'w')
+            fd.write(text)
+            fd.close()
+
+    def tearDown(self):
+        cfg.TFilesDirectory = self.saved
+        shutil.rmtree(self.tmp_dir)
+
+    def test_not_built(self):
+        self.failUnless(hm.load_matrix(self.cache_dir) is None)
+
+    def test_row_column(self):
+        hm.build_matrix(self.cache_dir)
+        matrix = hm.load_matrix(self.cache_dir)
+
+        self.failUnless(matrix.hp_ids.tolist() == [3, 5, 9])
+        self.failUnless(matrix.row(5).tolist() == [3.0, 4.0])
+        self.failUnless(matrix.column(1).tolist() == [2.0, 4.0, 6.0])
+        self.failUnless(matrix.hp_rows([9, 4, 3]).tolist() == [2, -1, 0])
+        self.failUnlessRaises(RuntimeError, matrix.row, 4)
+
+    def test_stale_rebuilt(self):
+        hm.build_matrix(self.cache_dir)
+
+        fd = open(os.path.join(self.tmp_dir, 'T-00004'), 'w')
+        fd.write('header\n'
+                 '7.0 1.0E-04 8.1 2.5 1 10\n'
+                 '8.0 1.0E-04 8.2 2.5 1 11\n')
+        fd.close()
+
+        matrix = hm.load_matrix(self.cache_dir)
+        self.failUnless(matrix.hp_ids.tolist() == [3, 4, 5, 9])
+        self.failUnless(matrix.column(0).tolist() == [1.0, 7.0, 3.0, 5.0])
+
+    def test_same_size_older_mtime(self):
+        hm.build_matrix(self.cache_dir)
+
+        # rewrite one T-file, same size, and back-date it
+        path = os.path.join(self.tmp_dir, 'T-00005')
+        st = os.stat(path)
+        fd = open(path, 'w')
+        fd.write(TFiles[5].replace('3.0', '9.0'))
+        fd.close()
+        self.failUnless(os.path.getsize(path) == st.st_size)
+        os.utime(path, (st.st_atime-3600, st.st_mtime-3600))
+
+        matrix = hm.load_matrix(self.cache_dir)
+        self.failUnless(matrix.row(5).tolist() == [9.0, 4.0])
+
+    def test_rebuild_leaves_old_matrix(self):
+        hm.build_matrix(self.cache_dir)
+        old = hm.load_matrix(self.cache_dir)
+
+        fd = open(os.path.join(self.tmp_dir, 'T-00003'), 'w')
+        fd.write(TFiles[3].replace('1.0 ', '7.0 '))
+        fd.close()
+        hm.build_matrix(self.cache_dir)
+        new = hm.load_matrix(self.cache_dir)
+
+        # the old mapping still reads the old matrix
+        self.failUnless(old.column(0).tolist() == [1.0, 3.0, 5.0])
+        self.failUnless(new.column(0).tolist() == [7.0, 3.0, 5.0])
+        self.failIf([f for f in os.listdir(self.cache_dir)
+                     if f.startswith('tmp-')])
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
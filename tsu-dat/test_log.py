@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""Test functions in log.py."""
+
+
+from __future__ import with_statement
+
+import os
+import sys
+import time
+import unittest
+import tempfile
+import threading
+import shutil
+
+import testlog
+import log
+from log import Timings
+log = log.Log()
+
+
+class Test_Log(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.log = log
+
+        # the log is shared, write to our own file
+        self.log.stop_writer()
+        self.old_logfd = self.log.logfd
+        self.old_caller = self.log.caller
+        self.filename = os.path.join(self.tmp_dir, 'lines.log')
+        self.log.logfd = open(self.filename, 'w')
+
+    def tearDown(self):
+        self.log.stop_writer()
+        self.log.logfd.close()
+        self.log.logfd = self.old_logfd
+        self.log.caller = self.old_caller
+        shutil.rmtree(self.tmp_dir)
+
+    def read_lines(self, flush=True):
+        if flush:
+            self.log.flush()
+        fd = open(self.filename)
+        lines = fd.readlines()
+        fd.close()
+        return lines
+
+    def test_caller(self):
+        lnum = sys._getframe().f_lineno + 1
+        self.log.critical('one')
+        lines = self.read_lines()
+        (_, level, caller, msg) = lines[-1].strip().split('|')
+        self.failUnless(level.strip() == 'CRITICAL')
+        self.failUnless(caller.strip() == 'test_log:%d' % lnum, caller)
+        self.failUnless(msg == 'one')
+
+    def test_no_caller(self):
+        self.log.set_caller(False)
+        self.log.critical('two')
+        (_, _, caller, msg) = self.read_lines()[-1].strip().split('|')
+        self.failUnless(caller.strip() == '')
+        self.failUnless(len(caller) == log.MaxNameLength+5)
+        self.failUnless(msg == 'two')
+
+    def test_background(self):
+        self.log.start_writer(latency=0.1)
+        for i in range(1000):
+            self.log.critical('line %d' % i)
+        lines = self.read_lines()
+        self.failUnless(len(lines) == 1000)
+        self.failUnless(lines[-1].strip().endswith('|line 999'))
+
+        # written within the latency, without a flush
+        self.log.critical('late')
+        time.sleep(0.5)
+        lines = self.read_lines(flush=False)
+        self.failUnless(lines[-1].strip().endswith('|late'))
+
+        # stopping drains the queue
+        self.log.critical('last')
+        self.log.stop_writer()
+        lines = self.read_lines(flush=False)
+        self.failUnless(lines[-1].strip().endswith('|last'))
+
+    def test_mixed_batch(self):
+        # a str and a unicode line with non-ASCII can't be joined
+        self.log.start_writer(latency=0.1)
+        self.log.critical('caf\xc3\xa9 one')
+        self.log.critical(u'caf\xe9 two')
+        self.log.critical('three')
+        lines = self.read_lines()
+        self.failUnless(self.log.writer_alive())
+        self.failUnless([l.strip().split('|')[-1] for l in lines[-3:]]
+                        == ['caf\xc3\xa9 one', 'caf\xc3\xa9 two', 'three'],
+                        lines)
+
+    def test_stop_with_threads_logging(self):
+        self.log.start_writer(latency=0.1)
+
+        def lines(n):
+            for i in range(200):
+                self.log.critical('thread %d line %d' % (n, i))
+
+        threads = [threading.Thread(target=lines, args=(n,))
+                   for n in range(4)]
+        for t in threads:
+            t.start()
+        self.log.stop_writer()
+        for t in threads:
+            t.join()
+
+        # no line is lost, whether queued or written directly
+        self.failUnless(len(self.read_lines()) == 800)
+
+    def test_dead_writer(self):
+        self.log.start_writer(latency=0.1)
+        self.log.queue.put(None)            # the writer thread ends
+        self.log.writer_thread.join()
+        self.log.critical('after')
+        lines = self.read_lines()
+        self.failUnless(lines[-1].strip().endswith('|after'))
+
+
+class Test_Timings(unittest.TestCase):
+
+    def test_summary(self):
+        timings = Timings()
+        for i in range(1, 101):
+            timings.add('op', i/1000.0, 0.0)
+        timings.add('other', 1.0, 0.5)
+
+        rows = timings.summary()
+        self.failUnless([r[0] for r in rows] == ['op', 'other'])
+        (name, count, wall, cpu, p50, p95, tmax) = rows[0]
+        self.failUnless(count == 100)
+        self.failUnless(abs(wall - 5.05) < 1.0e-9)
+        self.failUnless(p50 == 0.050)
+        self.failUnless(p95 == 0.095)
+        self.failUnless(tmax == 0.100)
+
+        table = timings.table()
+        self.failUnless(len(table) == 3)
+        self.failUnless(table[2].startswith('other '))
+
+    def test_samples_bounded(self):
+        timings = Timings()
+        for i in range(Timings.MaxSamples):
+            timings.add('op', 1.0, 0.0)
+        for i in range(Timings.MaxSamples):
+            timings.add('op', 0.001, 0.0)
+
+        # only the latest samples are kept, the maximum covers them all
+        (name, count, wall, cpu, p50, p95, tmax) = timings.summary()[0]
+        self.failUnless(count == 2*Timings.MaxSamples)
+        self.failUnless(len(timings.stats['op'][4]) == Timings.MaxSamples)
+        self.failUnless(p50 == 0.001 and p95 == 0.001)
+        self.failUnless(tmax == 1.0)
+
+    def test_span(self):
+        timings = Timings()
+        with timings.span('sleep'):
+            time.sleep(0.05)
+        (name, count, wall, cpu, _, _, _) = timings.summary()[0]
+        self.failUnless(name == 'sleep' and count == 1)
+        self.failUnless(wall >= 0.05)
+
+    def test_timed(self):
+        @log.timed()
+        def double(x):
+            """Double x."""
+            return 2*x
+
+        self.failUnless(double(3) == 6)
+        self.failUnless(double.__name__ == 'double')
+        names = [r[0] for r in log.timings.summary()]
+        self.failUnless('double' in names)
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
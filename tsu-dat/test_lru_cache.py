@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""Test functions in lru_cache.py."""
+
+
+import unittest
+
+import lru_cache
+
+
+class Test_LRUCache(unittest.TestCase):
+
+    def test_hit_miss(self):
+        cache = lru_cache.LRUCache(100)
+        self.failUnless(cache.get('a') is None)
+        cache.put('a', 'A', 10)
+        self.failUnless(cache.get('a') == 'A')
+        stats = cache.stats()
+        self.failUnless(stats['hits'] == 1)
+        self.failUnless(stats['misses'] == 1)
+        self.failUnless(stats['bytes'] == 10)
+        self.failUnless(stats['entries'] == 1)
+
+    def test_evict_lru(self):
+        cache = lru_cache.LRUCache(30)
+        for key in 'abc':
+            cache.put(key, key.upper(), 10)
+        cache.get('a')              # 'b' is now least recently used
+        cache.put('d', 'D', 10)
+        self.failIf('b' in cache)
+        for key in 'acd':
+            self.failUnless(key in cache)
+        self.failUnless(cache.stats()['evictions'] == 1)
+        self.failUnless(cache.stats()['bytes'] == 30)
+
+    def test_replace(self):
+        cache = lru_cache.LRUCache(100)
+        cache.put('a', 'A', 10)
+        cache.put('a', 'AA', 20)
+        self.failUnless(cache.get('a') == 'AA')
+        self.failUnless(cache.stats()['bytes'] == 20)
+        self.failUnless(len(cache) == 1)
+
+    def test_pinned_kept(self):
+        cache = lru_cache.LRUCache(20)
+        cache.put('a', 'A', 10)
+        cache.put('b', 'B', 10)
+        cache.pin(['a', 'b'])
+        cache.put('c', 'C', 10)
+        for key in 'ab':
+            self.failUnless(key in cache)
+        self.failIf('c' in cache)
+
+        # pinned values alone may go over budget
+        cache.pin(['a', 'b', 'c'])
+        cache.put('c', 'C', 10)
+        self.failUnless(len(cache) == 3)
+        self.failUnless(cache.stats()['bytes'] == 30)
+
+        # unpinning brings the cache back within budget
+        cache.pin(['c'])
+        self.failUnless(cache.stats()['bytes'] <= 20)
+        self.failUnless('c' in cache)
+
+    def test_set_budget(self):
+        cache = lru_cache.LRUCache(100)
+        for key in 'abcd':
+            cache.put(key, key, 10)
+        cache.set_budget(20)
+        self.failUnless(len(cache) == 2)
+        self.failUnless('c' in cache and 'd' in cache)
+        cache.clear()
+        self.failUnless(len(cache) == 0)
+        self.failUnless(cache.stats()['bytes'] == 0)
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
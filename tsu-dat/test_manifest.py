@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""Test functions in manifest.py."""
+
+
+import os
+import unittest
+import tempfile
+import shutil
+
+import manifest as mf
+
+
+class Test_Manifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.filename = os.path.join(self.tmp_dir, mf.ManifestFilename)
+        self.output = os.path.join(self.tmp_dir, 'output')
+        fd = open(self.output, 'w')
+        fd.write('output')
+        fd.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_fingerprint(self):
+        self.failUnless(mf.fingerprint(1, 'a') == mf.fingerprint(1, 'a'))
+        self.failIf(mf.fingerprint(1, 'a') == mf.fingerprint(1, 'b'))
+
+        before = mf.file_fingerprint(self.output)
+        fd = open(self.output, 'w')
+        fd.write('changed')
+        fd.close()
+        self.failIf(mf.file_fingerprint(self.output) == before)
+
+    def test_done(self):
+        m = mf.Manifest(self.filename)
+        self.failIf(m.is_done('stage', 'fp'))
+        m.done('stage', 'fp', [self.output])
+
+        m = mf.Manifest(self.filename)
+        self.failUnless(m.is_done('stage', 'fp'))
+        self.failIf(m.is_done('stage', 'other fp'))
+
+        # missing output means stage must be done again
+        os.remove(self.output)
+        self.failIf(m.is_done('stage', 'fp'))
+
+    def test_forget(self):
+        m = mf.Manifest(self.filename)
+        m.done('stage', 'fp')
+        m.forget('stage')
+        self.failIf(mf.Manifest(self.filename).is_done('stage', 'fp'))
+
+    def test_bad_file(self):
+        fd = open(self.filename, 'w')
+        fd.write('rubbish')
+        fd.close()
+        self.failIf(mf.Manifest(self.filename).stages)
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
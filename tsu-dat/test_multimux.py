@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""Test functions in multimux.py."""
+
+
+import os
+import time
+import unittest
+import tempfile
+import shutil
+
+import testlog
+import config as cfg
+import multimux as mmx
+
+
+MultimuxFiles = {'alpha': ('alpha\n'
+                           '2\n'
+                           'sf_1 1.5 1.0E-04 8.1 x\n'
+                           'sf_2 2.5 1.0E-04 8.1 x\n'
+                           '1\n'
+                           'sf_3 0.5 1.0E-04 7.9 x\n'),
+                 'beta': ('beta\n'
+                          '1\n'
+                          'sf_9 3.25 1.0E-04 8.4 x\n')}
+
+
+class Test_Multimux(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.mmx_dir = os.path.join(self.tmp_dir, 'multimux')
+        os.makedirs(self.mmx_dir)
+        self.saved = cfg.MultimuxDirectory
+        cfg.MultimuxDirectory = self.mmx_dir
+
+        fd = open(os.path.join(self.mmx_dir, cfg.FaultNameFilename), 'w')
+        fd.write('alpha\nbeta\n')
+        fd.close()
+        for (name, text) in MultimuxFiles.items():
+            self.write(name, text)
+
+    def tearDown(self):
+        cfg.MultimuxDirectory = self.saved
+        mmx.Index = None
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, text):
+        fd = open(os.path.join(self.mmx_dir, 'i_multimux-%s' % name), 'w')
+        fd.write(text)
+        fd.close()
+
+    def event_file(self, event_id):
+        mmx.multimux(event_id, self.tmp_dir)
+        fd = open(os.path.join(self.tmp_dir, 'boundaries', str(event_id),
+                               cfg.EventFile))
+        result = fd.read()
+        fd.close()
+        return result
+
+    def test_multimux(self):
+        self.failUnless(self.event_file(1) == ' 2\n sf_1 1.5\n sf_2 2.5\n')
+        self.failUnless(self.event_file(2) == ' 1\n sf_3 0.5\n')
+        self.failUnless(self.event_file(3) == ' 1\n sf_9 3.25\n')
+        self.failUnless(os.path.exists(os.path.join(self.mmx_dir,
+                                                    mmx.IndexFilename)))
+
+        # an unknown event gets an empty event file, as it always has
+        self.failUnless(self.event_file(4) == '')
+        self.failUnless(self.event_file(0) == '')
+
+    def test_multimux_events(self):
+        mmx.multimux_events([3, 1], self.tmp_dir)
+        for (event_id, expected) in ((1, ' 2\n sf_1 1.5\n sf_2 2.5\n'),
+                                     (3, ' 1\n sf_9 3.25\n')):
+            fd = open(os.path.join(self.tmp_dir, 'boundaries', str(event_id),
+                                   cfg.EventFile))
+            result = fd.read()
+            fd.close()
+            self.failUnless(result == expected, 'result=%s' % result)
+        self.failIf(os.path.exists(os.path.join(self.tmp_dir, 'boundaries',
+                                                '2')))
+
+        mmx.multimux_events([0, 2, 9], self.tmp_dir)
+        for (event_id, expected) in ((0, ''), (2, ' 1\n sf_3 0.5\n'),
+                                     (9, '')):
+            fd = open(os.path.join(self.tmp_dir, 'boundaries', str(event_id),
+                                   cfg.EventFile))
+            result = fd.read()
+            fd.close()
+            self.failUnless(result == expected, 'result=%s' % result)
+
+    def test_index_file_reused(self):
+        self.event_file(1)
+        mmx.Index = None
+        index = mmx.load_index()
+        self.failUnless(index.offset.tolist() == mmx.build_index(
+                                     ['alpha', 'beta']).offset.tolist())
+
+    def test_changed_file_reindexed(self):
+        self.event_file(3)
+        time.sleep(0.01)
+        self.write('alpha', 'alpha\n'
+                            '1\n'
+                            'sf_1 1.5 1.0E-04 8.1 x\n')
+        self.failUnless(self.event_file(2) == ' 1\n sf_9 3.25\n')
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
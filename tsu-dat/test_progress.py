@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""Test functions in progress.py."""
+
+
+import os
+import unittest
+import tempfile
+import shutil
+
+import progress as pg
+
+
+class Test_Progress(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_message(self):
+        line = pg.message(pg.Done, event=12, percent=50.0, eta=None)
+        self.failUnless(line.endswith('\n'))
+        self.failUnless('\n' not in line[:-1])
+        msg = pg.parse(line)
+        self.failUnless(msg == {'stage': pg.Done, 'event': 12,
+                                'percent': 50.0})
+
+        # log text with newlines is still one line
+        line = pg.message(pg.Log, text='one\ntwo')
+        self.failUnless(pg.parse(line)['text'] == 'one\ntwo')
+
+    def test_parse_other(self):
+        self.failUnless(pg.parse('Running build\n') is None)
+        self.failUnless(pg.parse('{not json\n') is None)
+        self.failUnless(pg.parse('{"event": 1}\n') is None)
+
+    def test_progress(self):
+        filename = os.path.join(self.tmp_dir, 'progress')
+        fd = os.open(filename, os.O_WRONLY|os.O_CREAT)
+        p = pg.Progress(fd, 4)
+        self.failUnless(p.eta() is None)
+        p.started()
+        p.event_done(1)
+        p.event_done(2, 'error')
+        p.all_done([2])
+        os.close(fd)
+
+        f = open(filename)
+        msgs = [pg.parse(line) for line in f.readlines()]
+        f.close()
+        self.failUnless([m['stage'] for m in msgs]
+                        == [pg.Start, pg.Done, pg.Failed, pg.Finished])
+        self.failUnless(msgs[2]['percent'] == 50.0)
+        self.failUnless(msgs[2]['eta'] >= 0.0)
+
+    def test_format_eta(self):
+        self.failUnless(pg.format_eta(10) == 'less than a minute')
+        self.failUnless(pg.format_eta(60) == '1 minute')
+        self.failUnless(pg.format_eta(125*60) == '2 hours 5 minutes')
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
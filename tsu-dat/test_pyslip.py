@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""Test the tile info handling of pyslip.pySlip.Tiles.
+
+pyslip imports wx and PIL, so the tests are skipped without them.
+"""
+
+
+import os
+import unittest
+import tempfile
+import shutil
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import testlog
+
+try:
+    import pyslip
+except ImportError:
+    pyslip = None
+
+
+# (num_tiles_x, num_tiles_y, ppd_x, ppd_y) for each level with tile info
+LevelInfo = {1: (2, 1, 1.5, 1.5),
+             3: (8, 4, 6.0, 6.0),
+             5: (32, 16, 24.0, 24.0)}
+
+
+def write_info(path, info):
+    """Pickle tile info to a file."""
+
+    fd = open(path, 'wb')
+    pickle.dump(info, fd)
+    fd.close()
+
+
+@unittest.skipIf(pyslip is None, 'needs wx and PIL')
+class Test_Tiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        info_name = pyslip.pySlip.Tiles.TileInfoFilename
+        write_info(os.path.join(self.tmp_dir, info_name),
+                   ((100.0, 160.0, -45.0, -5.0), (256, 256),
+                    (0, 0, 255), (0, 255, 0)))
+        for (level, info) in LevelInfo.items():
+            level_dir = os.path.join(self.tmp_dir, '%02d' % level)
+            os.mkdir(level_dir)
+            write_info(os.path.join(level_dir, info_name), info)
+
+        # a level directory without tile info, and a non-level directory
+        os.mkdir(os.path.join(self.tmp_dir, '02'))
+        os.mkdir(os.path.join(self.tmp_dir, 'xx'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_levels(self):
+        tiles = pyslip.pySlip.Tiles(self.tmp_dir)
+        self.failUnless(tiles.levels == [1, 3, 5], tiles.levels)
+        self.failUnless(tiles.min_level == 1)
+        self.failUnless(tiles.max_level == 5)
+        self.failUnless(tiles.tile_size == (256, 256))
+
+    def test_info(self):
+        tiles = pyslip.pySlip.Tiles(self.tmp_dir)
+        for (level, info) in LevelInfo.items():
+            self.failUnless(tiles.get_info(level) == info, level)
+            self.failUnless(tiles.num_tiles(level) == info[:2], level)
+        for level in (0, 2, 4, 6):
+            self.failUnless(tiles.get_info(level) is None, level)
+            self.failUnless(tiles.num_tiles(level) is None, level)
+
+        # the preloaded info is used, not the level's tile.info file
+        os.remove(os.path.join(self.tmp_dir, '03',
+                               pyslip.pySlip.Tiles.TileInfoFilename))
+        self.failUnless(tiles.get_info(3) == LevelInfo[3])
+        self.failUnless(tiles.use_level(3) == (256*8, 256*4, 6.0, 6.0))
+        self.failUnless(tiles.use_level(2) is None)
+        self.failUnless(tiles.level == 3)
+
+    def test_not_tile_dir(self):
+        self.failUnlessRaises(RuntimeError, pyslip.pySlip.Tiles,
+                              os.path.join(self.tmp_dir, 'xx'))
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""Test functions in run_build.py."""
+
+
+import os
+import time
+import unittest
+import tempfile
+import shutil
+
+import run_build as rb
+import manifest as mf
+import progress as pg
+
+
+class Test_RunBuild(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.log_file = os.path.join(self.tmp_dir, 'build.log')
+
+    def tearDown(self):
+        if rb.LogFD:
+            os.close(rb.LogFD)
+            rb.LogFD = None
+        rb.ProgressFD = None
+        shutil.rmtree(self.tmp_dir)
+
+    def read_log(self):
+        fd = open(self.log_file)
+        result = fd.read()
+        fd.close()
+        return result
+
+    def test_failed_events_not_finished(self):
+        # there is no MUX data, so every event build fails
+        for jobs in (1, 2):
+            result = rb.run_build(self.log_file, 'test', self.tmp_dir,
+                                  'app', self.tmp_dir, 'event.lst',
+                                  [1, 2, 3], jobs)
+            self.failIf(result)
+            text = self.read_log()
+            self.failUnless('Generation FAILED for events: 1, 2, 3' in text,
+                            text)
+            self.failIf('Generation is finished' in text)
+
+            os.close(rb.LogFD)
+            rb.LogFD = None
+            os.remove(self.log_file)
+
+    def test_built_events_skipped(self):
+        boundaries = os.path.join(self.tmp_dir, 'test', 'boundaries')
+        for event_id in (1, 2):
+            event_dir = os.path.join(boundaries, str(event_id))
+            os.makedirs(event_dir)
+            for name in ('event.lst', 'test.sts'):
+                fd = open(os.path.join(event_dir, name), 'w')
+                fd.write('%d\n' % event_id)
+                fd.close()
+        fd = open(os.path.join(boundaries, 'urs_order.csv'), 'w')
+        fd.write('index,longitude,latitude\n')
+        fd.close()
+
+        # record event 1 as built, event 2 can't be built
+        manifest_file = os.path.join(self.tmp_dir, 'manifest.pkl')
+        manifest = mf.Manifest(manifest_file)
+        (stage, fp) = rb.build_fingerprint('test', self.tmp_dir, self.tmp_dir,
+                                           'event.lst', 1)
+        manifest.done(stage, fp, [os.path.join(boundaries, '1', 'test.sts')])
+
+        result = rb.run_build(self.log_file, 'test', self.tmp_dir, 'app',
+                              self.tmp_dir, 'event.lst', [1, 2], 1,
+                              manifest_file=manifest_file)
+        self.failIf(result)
+        text = self.read_log()
+        self.failUnless('Event 1 already built, skipping' in text, text)
+        self.failUnless('Generation FAILED for events: 2' in text, text)
+
+    def test_progress_messages(self):
+        progress_file = os.path.join(self.tmp_dir, 'progress')
+        progress_fd = os.open(progress_file, os.O_WRONLY|os.O_CREAT)
+        rb.run_build(self.log_file, 'test', self.tmp_dir, 'app',
+                     self.tmp_dir, 'event.lst', [1, 2], 1,
+                     progress_fd=progress_fd)
+        os.close(progress_fd)
+
+        fd = open(progress_file)
+        msgs = [pg.parse(line) for line in fd.readlines()]
+        fd.close()
+        self.failIf(None in msgs)
+        msgs = [m for m in msgs if m['stage'] != pg.Log]
+        stages = [m['stage'] for m in msgs]
+        self.failUnless(stages == [pg.Start, pg.Build, pg.Failed, pg.Build,
+                                   pg.Failed, pg.Finished], stages)
+        self.failUnless(msgs[-1]['failed'] == [1, 2])
+        self.failUnless(msgs[-1]['percent'] == 100.0)
+
+    def test_log_flushed_by_timer(self):
+        rb.LogFilename = self.log_file
+        rb.log('first')
+        time.sleep(rb.LogLatency * 3)
+        self.failUnless(self.read_log() == 'first\n')
+
+    def test_gauge_csv_fingerprint(self):
+        boundaries = os.path.join(self.tmp_dir, 'test', 'boundaries')
+        os.makedirs(os.path.join(boundaries, '1'))
+        for name in ('1/event.lst', 'urs_order.csv'):
+            fd = open(os.path.join(boundaries, name), 'w')
+            fd.write('data\n')
+            fd.close()
+
+        args = ('test', self.tmp_dir, self.tmp_dir, 'event.lst', 1)
+        (_, fp) = rb.build_fingerprint(*args)
+        self.failUnless(fp)
+        self.failUnless(rb.build_fingerprint(*args, gauge_csv=False)[1] == fp)
+        self.failIf(rb.build_fingerprint(*args, gauge_csv=True)[1] == fp)
+
+    def test_dead_worker(self):
+        def build_event(args):
+            event_id = args[-1]
+            if event_id == 2:
+                os._exit(9)         # as if killed, no result
+            return (event_id, None, None)
+
+        old_build_event = rb.build_event
+        rb.build_event = build_event
+        try:
+            result = rb.run_build(self.log_file, 'test', self.tmp_dir,
+                                  'app', self.tmp_dir, 'event.lst',
+                                  [1, 2, 3], 2)
+        finally:
+            rb.build_event = old_build_event
+
+        self.failIf(result)
+        text = self.read_log()
+        self.failUnless('Event 2 failed: Worker process died (exit code 9)'
+                        in text, text)
+        self.failUnless('Generation FAILED for events: 2\n' in text, text)
+
+    def test_no_multiprocessing(self):
+        old_multiprocessing = rb.multiprocessing
+        rb.multiprocessing = None
+        try:
+            self.failUnless(rb.default_jobs() == 1)
+            result = rb.run_build(self.log_file, 'test', self.tmp_dir,
+                                  'app', self.tmp_dir, 'event.lst',
+                                  [1, 2], 4)
+        finally:
+            rb.multiprocessing = old_multiprocessing
+
+        self.failIf(result)
+        text = self.read_log()
+        self.failIf('processes' in text, text)
+        self.failUnless('Generation FAILED for events: 1, 2' in text, text)
+
+    def test_default_jobs(self):
+        self.failUnless(rb.default_jobs() >= 1)
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""Test functions in sts_cache.py."""
+
+
+import os
+import unittest
+import tempfile
+import shutil
+
+import sts_cache as sc
+
+
+class Test_STSCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.mux = self.write('a.grd-z-mux2', 'mux data')
+        self.order = self.write('urs_order.csv', 'index,longitude,latitude\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp_dir, name)
+        fd = open(path, 'w')
+        fd.write(text)
+        fd.close()
+        return path
+
+    def read(self, path):
+        fd = open(path)
+        result = fd.read()
+        fd.close()
+        return result
+
+    def test_event_cache_key(self):
+        event_file = self.write('event.lst',
+                                '1\na.grd-z-mux2-something 0.5\n')
+        (names, weights) = sc.mux_sources(['x/a.grd-z-mux2 0.5\n'],
+                                          self.tmp_dir)
+        self.failUnless(names == [os.path.join(self.tmp_dir, 'x/a.grd')])
+        self.failUnless(weights == [0.5])
+
+        key = sc.event_cache_key(event_file, self.tmp_dir, self.order, False)
+        self.failUnless(key == sc.cache_key([os.path.join(self.tmp_dir,
+                                                          'a.grd')],
+                                            [0.5], self.order, False))
+        self.failIf(sc.contains(self.cache_dir, key))
+        os.makedirs(os.path.join(self.cache_dir, key))
+        self.failUnless(sc.contains(self.cache_dir, key))
+
+        self.failUnless(sc.event_cache_key('missing', self.tmp_dir,
+                                           self.order) is None)
+
+    def test_key(self):
+        key = sc.cache_key([self.mux], [1.0], self.order)
+        self.failUnless(key == sc.cache_key([self.mux], [1.0], self.order))
+        self.failIf(key == sc.cache_key([self.mux], [0.5], self.order))
+        self.failIf(key == sc.cache_key([self.mux], [1.0], self.order, True))
+
+        self.write('urs_order.csv', 'index,longitude,latitude\n1,2,3\n')
+        self.failIf(key == sc.cache_key([self.mux], [1.0], self.order))
+
+    def test_store_fetch(self):
+        key = sc.cache_key([self.mux], [1.0], self.order)
+        dest = os.path.join(self.tmp_dir, 'event')
+        os.makedirs(dest)
+        self.failIf(sc.fetch(self.cache_dir, key, dest))
+
+        sts = self.write('scenario.sts', 'sts data')
+        sc.store(self.cache_dir, key, [(sts, 'boundary.sts')])
+        self.failUnless(sc.fetch(self.cache_dir, key, dest,
+                                 {'boundary.sts': 'other.sts'}))
+        self.failUnless(self.read(os.path.join(dest, 'other.sts'))
+                        == 'sts data')
+
+        # writing the fetched file leaves the cache entry alone
+        fd = open(os.path.join(dest, 'other.sts'), 'w')
+        fd.write('changed')
+        fd.close()
+        self.failUnless(self.read(os.path.join(self.cache_dir, key,
+                                               'boundary.sts'))
+                        == 'sts data')
+
+    def test_lru_eviction(self):
+        sts = self.write('scenario.sts', 'x' * 100)
+        for (i, key) in enumerate(('k1', 'k2', 'k3')):
+            sc.store(self.cache_dir, key, [(sts, 'boundary.sts')], 1000)
+            os.utime(os.path.join(self.cache_dir, key), (1000+i, 1000+i))
+
+        # use k1, so k2 is now least recently used
+        self.failUnless(sc.fetch(self.cache_dir, 'k1', self.tmp_dir))
+        self.failUnless(sc.evict(self.cache_dir, 250) == ['k2'])
+        self.failUnless(sorted(os.listdir(self.cache_dir)) == ['k1', 'k3'])
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
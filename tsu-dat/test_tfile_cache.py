@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+"""Test functions in tfile_cache.py."""
+
+
+import os
+import time
+import unittest
+import tempfile
+import shutil
+
+import numpy as num
+
+import testlog
+import config as cfg
+import tfile_cache as tfc
+
+
+TFileText = ('header line\n'
+             '2.50 1.0E-04 8.1 2.500 2 10 11\n'
+             '0.75 0.0E+00 7.9 1.250 1 12\n'
+             '3.10 2.5E-05 8.7 4.000 3 10 12 13\n')
+
+
+class Test_TFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.tfile = os.path.join(self.tmp_dir, 'T-00001')
+        fd = open(self.tfile, 'w')
+        fd.write(TFileText)
+        fd.close()
+
+        # the T-file is also the source of the event catalogue
+        self.saved_event_tfile = cfg.EventTFile
+        cfg.EventTFile = self.tfile
+
+    def tearDown(self):
+        cfg.EventTFile = self.saved_event_tfile
+        shutil.rmtree(self.tmp_dir)
+
+    def check_data(self, data):
+        self.failUnless(num.allclose(data.zquake, [2.50, 0.75, 3.10]))
+        self.failUnless(num.allclose(data.zprob, [1.0E-04, 0.0, 2.5E-05]))
+        self.failUnless(num.allclose(data.mag, [8.1, 7.9, 8.7]))
+        self.failUnless(num.allclose(data.slip, [2.5, 1.25, 4.0]))
+        self.failUnless(tfc.event_subfaults(data, 0).tolist() == [10, 11])
+        self.failUnless(tfc.event_subfaults(data, 1).tolist() == [12])
+        self.failUnless(tfc.event_subfaults(data, 2).tolist() == [10, 12, 13])
+
+    def test_parse(self):
+        data = tfc.parse_tfile(self.tfile)
+        self.check_data(data)
+
+    def test_no_cache(self):
+        self.failUnless(tfc.cache_is_fresh(self.tfile, self.cache_dir) is None)
+        data = tfc.load_tfile(self.tfile, self.cache_dir)
+        self.failIf(isinstance(data.zquake, num.memmap))
+        self.check_data(data)
+
+    def test_compile_and_load(self):
+        tfc.compile_catalogue(self.cache_dir)
+        tfc.compile_tfile(self.tfile, self.cache_dir)
+        self.failUnless(tfc.cache_is_fresh(self.tfile, self.cache_dir))
+        data = tfc.load_tfile(self.tfile, self.cache_dir)
+        self.failUnless(isinstance(data.zquake, num.memmap))
+        self.failUnless(isinstance(data.sf_values, num.memmap))
+        self.check_data(data)
+
+    def test_catalogue_shared(self):
+        tfc.compile_catalogue(self.cache_dir)
+        tfc.compile_tfile(self.tfile, self.cache_dir)
+
+        # per-HP cache holds only the heights
+        hp_files = os.listdir(tfc.cache_path(self.tfile, self.cache_dir))
+        self.failIf('mag.npy' in hp_files)
+        self.failIf('sf_values.npy' in hp_files)
+
+        # the catalogue is loaded once and shared by all HPs
+        catalogue = tfc.load_catalogue(self.cache_dir)
+        data = tfc.load_tfile(self.tfile, self.cache_dir)
+        self.failUnless(data.sf_values is catalogue.sf_values)
+        self.failUnless(tfc.load_catalogue(self.cache_dir) is catalogue)
+
+    def test_stale_cache_rebuilt(self):
+        tfc.compile_tfile(self.tfile, self.cache_dir)
+
+        # change the source file, size and mtime both change
+        fd = open(self.tfile, 'a')
+        fd.write('1.00 1.0E-03 7.5 0.500 1 14\n')
+        fd.close()
+        future = time.time() + 10
+        os.utime(self.tfile, (future, future))
+        self.failIf(tfc.cache_is_fresh(self.tfile, self.cache_dir))
+
+        data = tfc.load_tfile(self.tfile, self.cache_dir)
+        self.failUnless(tfc.cache_is_fresh(self.tfile, self.cache_dir))
+        self.failUnless(len(data.zquake) == 4)
+        self.failUnless(tfc.event_subfaults(data, 3).tolist() == [14])
+
+    def test_band_events(self):
+        tfc.compile_catalogue(self.cache_dir)
+        tfc.compile_tfile(self.tfile, self.cache_dir)
+        data = tfc.load_tfile(self.tfile, self.cache_dir)
+        self.failUnless(isinstance(data.zq_order, num.memmap))
+        self.failUnless(data.zq_order.tolist() == [1, 0, 2])
+
+        # event 1 is in band but has zprob == 0.0
+        ids = tfc.band_events(data, 0.5, 5.0)
+        self.failUnless(ids.tolist() == [0, 2])
+        ids = tfc.band_events(data, 2.5, 3.0)
+        self.failUnless(ids.tolist() == [0])
+        ids = tfc.band_events(data, 0.5, 5.0, first=1, last=2)
+        self.failUnless(ids.tolist() == [2])
+        ids = tfc.band_events(data, 5.0, 6.0)
+        self.failUnless(ids.tolist() == [])
+
+    def test_values_exact(self):
+        # neither value survives a round trip through float32
+        fd = open(self.tfile, 'w')
+        fd.write('header line\n1234.56789 2.05822E-05 8.1 2.500 1 10\n')
+        fd.close()
+        tfc.compile_catalogue(self.cache_dir)
+        tfc.compile_tfile(self.tfile, self.cache_dir)
+        data = tfc.load_tfile(self.tfile, self.cache_dir)
+        self.failUnless(data.zquake[0] == 1234.56789)
+        self.failUnless('%.5f' % data.zquake[0] == '1234.56789')
+        self.failUnless(data.zprob[0] == 2.05822E-05)
+
+    def test_rebuild_leaves_old_cache(self):
+        tfc.compile_tfile(self.tfile, self.cache_dir)
+        old = tfc.load_heights(self.tfile, self.cache_dir)
+
+        fd = open(self.tfile, 'w')
+        fd.write(TFileText.replace('2.50', '9.50'))
+        fd.close()
+        tfc.compile_tfile(self.tfile, self.cache_dir)
+        new = tfc.load_heights(self.tfile, self.cache_dir)
+
+        # the old mapping still reads the old cache
+        self.failUnless(old.zquake.tolist() == [2.50, 0.75, 3.10])
+        self.failUnless(new.zquake.tolist() == [9.50, 0.75, 3.10])
+        self.failUnless(os.listdir(self.cache_dir) == ['T-00001'])
+
+    def test_catalogue_rebuild_failed(self):
+        tfc.compile_catalogue(self.cache_dir)
+        fd = open(self.tfile, 'a')
+        fd.write('1.00 1.0E-03 7.5 0.500 1 14\n')
+        fd.close()
+
+        old_compile = tfc.compile_catalogue
+        def compile_catalogue(cache_dir=None):
+            raise OSError('cache in use')
+        tfc.compile_catalogue = compile_catalogue
+        try:
+            data = tfc.load_catalogue(self.cache_dir)
+        finally:
+            tfc.compile_catalogue = old_compile
+
+        # parsed from the T-file instead
+        self.failUnless(len(data.mag) == 4)
+        self.failIf(isinstance(data.mag, num.memmap))
+
+    def test_bad_subfault_count(self):
+        fd = open(self.tfile, 'w')
+        fd.write('header line\n2.50 1.0E-04 8.1 2.500 3 10 11\n')
+        fd.close()
+        self.failUnlessRaises(RuntimeError, tfc.parse_tfile, self.tfile)
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""Test functions in tile_prefetch.py."""
+
+
+import time
+import threading
+import unittest
+
+import tile_prefetch as tp
+
+
+def num_tiles(level):
+    """Levels 1 to 3, level n has 4*2**n tiles square."""
+
+    if 1 <= level <= 3:
+        return (4 * 2**level, 4 * 2**level)
+    return None
+
+
+class Test_PrefetchKeys(unittest.TestCase):
+
+    def test_ring(self):
+        keys = tp.ring_keys(1, 2, 4, 2, 4, 8, 8, 1)
+        self.failUnless(len(keys) == 12, keys)
+        self.failIf((1, 2, 2) in keys)
+        self.failUnless((1, 1, 1) in keys and (1, 4, 4) in keys)
+
+        # clipped at the map edge
+        keys = tp.ring_keys(1, 0, 2, 0, 2, 8, 8, 1)
+        self.failUnless(sorted(keys) == [(1, 0, 2), (1, 1, 2), (1, 2, 0),
+                                         (1, 2, 1), (1, 2, 2)], keys)
+
+        # nearest ring first
+        keys = tp.ring_keys(1, 3, 4, 3, 4, 8, 8, 2)
+        self.failUnless(len(keys) == 8 + 16)
+        self.failUnless(max([abs(x-3) for (_, x, _) in keys[:8]]) == 1)
+
+    def test_prefetch_keys(self):
+        keys = tp.prefetch_keys(2, 4, 6, 4, 6, num_tiles)
+        levels = [k[0] for k in keys]
+        self.failUnless(levels == sorted(levels, key=lambda l: (l != 2, -l)))
+
+        # zoom in keeps the centre (5, 5) -> (10, 10) and the view size
+        self.failUnless([k[1:] for k in keys if k[0] == 3]
+                        == [(9, 9), (9, 10), (10, 9), (10, 10)])
+
+        # zoom out centre (2.5, 2.5)
+        self.failUnless([k[1:] for k in keys if k[0] == 1]
+                        == [(1, 1), (1, 2), (1, 3), (2, 1), (2, 2), (2, 3),
+                            (3, 1), (3, 2), (3, 3)])
+
+        # no level beyond the top
+        keys = tp.prefetch_keys(3, 4, 6, 4, 6, num_tiles)
+        self.failIf(4 in [k[0] for k in keys])
+
+
+class Test_Prefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.delivered = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def load(self, key):
+        self.gate.wait()
+        if key == 'bad':
+            raise IOError('bad tile')
+        return key.upper()
+
+    def deliver(self, generation, key, tile):
+        self.delivered.append((generation, key, tile))
+
+    def wait_idle(self, prefetcher):
+        stop = time.time() + 10
+        while time.time() < stop:
+            stats = prefetcher.stats()
+            if (not stats['pending'] and stats['loaded'] + stats['errors']
+                    + stats['cancelled'] >= self.expected):
+                return
+            time.sleep(0.01)
+
+    def test_load(self):
+        p = tp.Prefetcher(self.load, self.deliver,
+                          is_cached=lambda key: key == 'c', workers=2)
+        gen = p.request(['a', 'b', 'c', 'bad'])
+        self.expected = 3
+        self.wait_idle(p)
+        p.stop()
+
+        self.failUnless(sorted(self.delivered) == [(gen, 'a', 'A'),
+                                                   (gen, 'b', 'B')])
+        self.failUnless(p.stats()['errors'] == 1)
+
+    def test_stale_cancelled(self):
+        self.gate.clear()
+        p = tp.Prefetcher(self.load, self.deliver, workers=1)
+        old = p.request(['a', 'b', 'c'])
+        time.sleep(0.1)             # worker is now loading 'a'
+        new = p.request(['d'])
+        self.failIf(p.is_current(old))
+        self.gate.set()
+        self.expected = 4
+        self.wait_idle(p)
+        p.stop()
+
+        # 'a' finished for the old request, 'b' and 'c' never started
+        self.failUnless(self.delivered == [(new, 'd', 'D')], self.delivered)
+        self.failUnless(p.stats()['cancelled'] == 3)
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
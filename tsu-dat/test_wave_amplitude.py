@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""Test functions in wave_amplitude.py."""
+
+
+import os
+import time
+import unittest
+import tempfile
+import shutil
+
+import testlog
+import config as cfg
+import wave_amplitude as wa
+
+
+WaveText = ('100 500 1000 2500\n'
+            '110.0 -10.0 1 0.10 0.40 0.90 2.00\n'
+            '111.5 -11.0 2 0.20 0.50 1.00 3.00\n')
+
+
+class Test_WaveAmplitude(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+        self.saved = cfg.WaveAmplitudeFile
+        cfg.WaveAmplitudeFile = os.path.join(self.tmp_dir, 'o_amp_green')
+        self.write(WaveText)
+
+    def tearDown(self):
+        cfg.WaveAmplitudeFile = self.saved
+        wa.Table = None
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, text):
+        fd = open(cfg.WaveAmplitudeFile, 'w')
+        fd.write(text)
+        fd.close()
+
+    def test_nearest_interpolate_index(self):
+        values = [0.1, 0.4, 0.9, 2.0]
+        expected = [(0.0, 0), (0.1, 0), (0.4, 0), (0.5, 1),
+                    (1.5, 2), (2.0, 3), (5.0, 3)]
+        for (value, index) in expected:
+            result = wa.nearest_interpolate_index(values, value)
+            self.failUnless(result == index,
+                            'value=%s, result=%s' % (value, result))
+
+    def test_wh_from_rp(self):
+        table = wa.get_table()
+        self.failUnless(table.periods.tolist() == [100, 500, 1000, 2500])
+        self.failUnless(table.wh_from_rp(1000, (111.5, -11.0)) == 1.0)
+        self.failUnlessRaises(RuntimeError, table.wh_from_rp,
+                              200, (111.5, -11.0))
+        self.failUnlessRaises(RuntimeError, table.wh_from_rp,
+                              1000, (112.0, -11.0))
+
+    def test_rp_index_range(self):
+        table = wa.get_table()
+        self.failUnless(table.rp_index_range(0.7, 0.3,
+                                             (110.0, -10.0)) == (0, 2))
+        self.failUnless(table.rp_index_range(9.0, 0.5,
+                                             (110.0, -10.0)) == (3, 3))
+        self.failUnless(table.hp_rows([(111.5, -11.0, 2),
+                                       (0.0, 0.0)]).tolist() == [1, -1])
+
+    def test_reload(self):
+        table = wa.get_table()
+        self.failUnless(wa.get_table() is table)
+
+        time.sleep(0.01)
+        self.write(WaveText + '112.0 -12.0 3 0.30 0.60 1.10 4.00\n')
+        self.failUnless(wa.get_table().wh_from_rp(2500, (112.0, -12.0)) == 4.0)
+
+#-------------------------------------------------------------
+
+if __name__ == "__main__":
+    unittest.main()
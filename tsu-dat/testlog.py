@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+"""Send the log of a test run to a temporary directory.
+
+The log state is shared by all Log objects and the first one made picks the
+file.  Importing config would start it in ~/tsu-dat.log (emptying the
+user's log) and a plain Log() in ./log.log.  Test modules that log import
+this module before any module that logs, so the log goes to a temporary
+directory instead, removed when the tests finish.
+"""
+
+
+import os
+import atexit
+import shutil
+import tempfile
+
+import log
+
+
+LogDir = tempfile.mkdtemp(prefix='Tsu-DAT_', dir='/var/tmp/')
+LogPath = os.path.join(LogDir, 'test.log')
+log = log.Log(LogPath)
+
+
+def cleanup():
+    """Remove the temporary log directory."""
+
+    shutil.rmtree(LogDir, ignore_errors=True)
+
+atexit.register(cleanup)
@@ -0,0 +1,558 @@
+#!/usr/bin/env python
+
+"""A compiled, memory-mapped cache for the T-XXXXX hazard files.
+
+Each T-file is a text file with one header line followed by one line per event:
+
+    zquake zprob mag slip ng subfault_1 subfault_2 ... subfault_ng
+
+Only zquake and zprob vary between hazard points, the other columns are the
+same in every T-file.  Parsing a large T-file takes seconds, so we compile
+the T-files into directories of columnar numpy arrays under
+cfg.TFileCacheDirectory.
+
+The event-invariant columns are held once, in an event catalogue built from
+cfg.EventTFile:
+
+    catalogue/mag.npy         float64 magnitude, one per event
+    catalogue/slip.npy        float64 slip, one per event
+    catalogue/sf_offsets.npy  int64 CSR offsets into sf_values, one per event
+                              plus one (so ng is the difference of offsets)
+    catalogue/sf_values.npy   int32 subfault IDs for all events
+    catalogue/stamp           cache version, mtime and size of the source
+
+Each hazard point T-file gets a compact directory of just its heights:
+
+    T-XXXXX/zquake.npy        float64 wave height at the HP, one per event
+    T-XXXXX/zprob.npy         float64 annual probability, one per event
+    T-XXXXX/zq_order.npy      int32 event IDs sorted by zquake (a permutation)
+    T-XXXXX/zq_sorted.npy     float64 zquake values in zq_order order
+    T-XXXXX/stamp             cache version, mtime and size of the source
+
+The subfaults for event N are sf_values[sf_offsets[N]:sf_offsets[N+1]].
+
+The float columns hold exactly the values the text parser gives, so results
+from the cache are the same as from the T-files.  A cache directory is
+written beside its final path and renamed into place, so processes sharing
+the cache (or still mapping an old copy) never see a half-written one.
+
+The zq_order/zq_sorted pair is an index that lets a [min, max] wave height
+band be found with two binary searches rather than a scan of all events.
+
+Usage: tfile_cache [<hp_id> ...]
+
+where <hp_id>  is the ID number of a hazard point to compile
+
+The event catalogue is always compiled.  If no <hp_id> is given, compile
+every T-file in the T-files directory.
+"""
+
+
+import os
+import re
+import glob
+import shutil
+import tempfile
+
+import numpy as num
+
+import config as cfg
+import dataobj
+import log
+log = log.Log()
+
+
+# pattern that will split fields in a string delimited by one or more spaces
+DelimPattern = re.compile(' +')
+
+# type of all float columns, the type float() gives
+ColumnType = num.float64
+
+# names of the per-HP arrays in the cache, and their types
+HeightColumns = ['zquake', 'zprob']
+OrderName = 'zq_order'
+OrderType = num.int32
+SortedName = 'zq_sorted'
+HeightArrays = HeightColumns + [OrderName, SortedName]
+
+# names of the event catalogue arrays in the cache, and their types
+EventColumns = ['mag', 'slip']
+OffsetsName = 'sf_offsets'
+OffsetsType = num.int64
+ValuesName = 'sf_values'
+ValuesType = num.int32
+CatalogueArrays = EventColumns + [OffsetsName, ValuesName]
+
+# name of the event catalogue directory in the cache
+CatalogueDirname = 'catalogue'
+
+# name of the file holding the cache version and source T-file mtime+size
+StampFilename = 'stamp'
+
+# bump this when the cache layout changes, older caches are then rebuilt
+CacheVersion = 4
+
+# the event catalogue loaded in this process, and its source stamp
+Catalogue = None
+CatalogueStamp = None
+
+
+def tfile_path(hp_id):
+    """Get the path to the T-file for a hazard point.
+
+    hp_id  hazard point index number
+    """
+
+    return os.path.join(cfg.TFilesDirectory, 'T-%05d' % hp_id)
+
+
+def cache_path(tfilename, cache_dir=None):
+    """Get the path to the cache directory for a T-file.
+
+    tfilename  path to the T-file
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+    """
+
+    if cache_dir is None:
+        cache_dir = cfg.TFileCacheDirectory
+
+    return os.path.join(cache_dir, os.path.basename(tfilename))
+
+
+def catalogue_path(cache_dir=None):
+    """Get the path to the event catalogue cache directory.
+
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+    """
+
+    if cache_dir is None:
+        cache_dir = cfg.TFileCacheDirectory
+
+    return os.path.join(cache_dir, CatalogueDirname)
+
+
+def source_stamp(filename):
+    """Get the (mtime, size) stamp string for a source file."""
+
+    st = os.stat(filename)
+    return '%r %d' % (st.st_mtime, st.st_size)
+
+
+def cache_stamp(tfilename):
+    """Get the stamp string written to the cache for a T-file."""
+
+    return 'v%d %s' % (CacheVersion, source_stamp(tfilename))
+
+
+def add_zquake_index(data):
+    """Add the sorted-by-zquake index arrays to T-file data.
+
+    data  a DataObj with a .zquake attribute
+
+    Adds .zq_order and .zq_sorted attributes.  The sort is stable so events
+    with equal zquake stay in event ID order.
+    """
+
+    data.zq_order = num.argsort(data.zquake, kind='mergesort').astype(OrderType)
+    data.zq_sorted = data.zquake[data.zq_order]
+
+
+def read_tfile_lines(tfilename):
+    """Read the event lines of a T-file.
+
+    tfilename  path to the T-file
+
+    Returns a list of lines, the header line is dropped.
+    """
+
+    try:
+        fd = open(tfilename, 'r')
+        lines = fd.readlines()
+        fd.close()
+    except IOError, e:
+        msg = 'Error reading file: %s' % str(e)
+        raise RuntimeError(msg)
+
+    # trash the first line of T-**** data
+    return lines[1:]
+
+
+def parse_heights(tfilename):
+    """Parse just the per-HP columns of a text T-file.
+
+    tfilename  path to the T-file
+
+    Returns a DataObj with attributes .zquake, .zprob, .zq_order and
+    .zq_sorted.
+    """
+
+    lines = read_tfile_lines(tfilename)
+
+    num_events = len(lines)
+    zquake = num.zeros(num_events, ColumnType)
+    zprob = num.zeros(num_events, ColumnType)
+
+    for (i, line) in enumerate(lines):
+        (zq, zp, _) = DelimPattern.split(line.strip(), maxsplit=2)
+        zquake[i] = float(zq)
+        zprob[i] = float(zp)
+
+    data = dataobj.DataObj(zquake=zquake, zprob=zprob)
+    add_zquake_index(data)
+
+    return data
+
+
+def parse_tfile(tfilename):
+    """Parse a text T-file into in-memory arrays.
+
+    tfilename  path to the T-file
+
+    Returns a DataObj with attributes .zquake, .zprob, .mag, .slip,
+    .sf_offsets, .sf_values, .zq_order and .zq_sorted (see module docstring).
+    """
+
+    lines = read_tfile_lines(tfilename)
+
+    num_events = len(lines)
+    zquake = num.zeros(num_events, ColumnType)
+    zprob = num.zeros(num_events, ColumnType)
+    mag = num.zeros(num_events, ColumnType)
+    slip = num.zeros(num_events, ColumnType)
+    offsets = num.zeros(num_events+1, OffsetsType)
+    values = []
+
+    for (i, line) in enumerate(lines):
+        l = line.strip()
+        (zq, zp, m, s, ng, ng_data) = DelimPattern.split(l, maxsplit=5)
+        zquake[i] = float(zq)
+        zprob[i] = float(zp)
+        mag[i] = float(m)
+        slip[i] = float(s)
+        subfaults = [int(x) for x in DelimPattern.split(ng_data.strip())]
+        if len(subfaults) != int(ng):
+            msg = ('Error parsing %s line %d: expected %s subfaults, got %d'
+                   % (tfilename, i+2, ng, len(subfaults)))
+            raise RuntimeError(msg)
+        values.extend(subfaults)
+        offsets[i+1] = len(values)
+
+    data = dataobj.DataObj(zquake=zquake, zprob=zprob, mag=mag, slip=slip,
+                           sf_offsets=offsets,
+                           sf_values=num.array(values, ValuesType))
+    add_zquake_index(data)
+
+    return data
+
+
+def write_cache(cdir, data, names, stamp):
+    """Write arrays to a cache directory.
+
+    cdir   path to the cache directory, replaced if it exists
+    data   a DataObj holding the arrays
+    names  names of the array attributes to write
+    stamp  the stamp string for the cache
+
+    The arrays are written to a new sibling directory which is then renamed
+    to cdir, so an interrupted compile is never mistaken for a good cache
+    and readers of the old cache are left alone.  Raises OSError if the new
+    cache can't be put in place (the old one is in use on Windows, say).
+    """
+
+    parent = os.path.dirname(cdir)
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            if not os.path.isdir(parent):
+                raise
+
+    base = os.path.basename(cdir)
+    new_dir = tempfile.mkdtemp(prefix=base+'.new.', dir=parent)
+    old_dir = None
+    try:
+        for name in names:
+            num.save(os.path.join(new_dir, name + '.npy'),
+                     getattr(data, name))
+
+        fd = open(os.path.join(new_dir, StampFilename), 'w')
+        fd.write(stamp)
+        fd.close()
+
+        # move any old cache aside, then the new one into place
+        if os.path.isdir(cdir):
+            old_dir = tempfile.mktemp(prefix=base+'.old.', dir=parent)
+            try:
+                os.rename(cdir, old_dir)
+            except OSError:
+                old_dir = None
+        try:
+            os.rename(new_dir, cdir)
+        except OSError:
+            # fine if another process just put the same cache in place
+            if read_stamp(cdir) != stamp:
+                raise
+    finally:
+        for path in (new_dir, old_dir):
+            if path and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def read_stamp(cdir):
+    """Get the stamp string of a cache directory, None if there is none."""
+
+    try:
+        fd = open(os.path.join(cdir, StampFilename), 'r')
+        stamp = fd.read().strip()
+        fd.close()
+    except IOError:
+        return None
+
+    return stamp
+
+
+def read_cache(cdir, names):
+    """Memory-map arrays from a cache directory.
+
+    cdir   path to the cache directory
+    names  names of the arrays to map
+
+    Returns a DataObj with one attribute per name.
+    """
+
+    kwargs = {}
+    for name in names:
+        kwargs[name] = num.load(os.path.join(cdir, name + '.npy'),
+                                mmap_mode='r')
+
+    return dataobj.DataObj(**kwargs)
+
+
+def is_fresh(cdir, source):
+    """Decide if a cache directory exists and matches its source file.
+
+    cdir    path to the cache directory
+    source  path to the source T-file
+
+    Returns True if the cache is usable, False if stale, None if no cache.
+    """
+
+    stamp = read_stamp(cdir)
+    if stamp is None:
+        return None
+
+    return stamp == cache_stamp(source)
+
+
+def compile_catalogue(cache_dir=None):
+    """Compile the event catalogue from cfg.EventTFile.
+
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+    """
+
+    cdir = catalogue_path(cache_dir)
+    stamp = cache_stamp(cfg.EventTFile)
+    data = parse_tfile(cfg.EventTFile)
+    write_cache(cdir, data, CatalogueArrays, stamp)
+
+    log('compile_catalogue: %s -> %s' % (cfg.EventTFile, cdir))
+
+
+def load_catalogue(cache_dir=None):
+    """Get the event catalogue, loading it only once per process.
+
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+
+    Returns a DataObj with attributes .mag, .slip, .sf_offsets and
+    .sf_values.  A stale catalogue cache is rebuilt.  If there is no
+    catalogue cache we fall back to parsing cfg.EventTFile.
+    """
+
+    global Catalogue, CatalogueStamp
+
+    cdir = catalogue_path(cache_dir)
+    stamp = (cdir, cfg.EventTFile, cache_stamp(cfg.EventTFile))
+    if Catalogue is not None and stamp == CatalogueStamp:
+        return Catalogue
+
+    fresh = is_fresh(cdir, cfg.EventTFile)
+    data = None
+    if fresh is None:
+        data = parse_tfile(cfg.EventTFile)
+    elif not fresh:
+        log('load_catalogue: cache is stale, rebuilding')
+        try:
+            compile_catalogue(cache_dir)
+        except (IOError, OSError), e:
+            log('load_catalogue: rebuild failed: %s' % str(e))
+            data = parse_tfile(cfg.EventTFile)
+    if data is None:
+        data = read_cache(cdir, CatalogueArrays)
+
+    Catalogue = dataobj.DataObj(mag=data.mag, slip=data.slip,
+                                sf_offsets=data.sf_offsets,
+                                sf_values=data.sf_values)
+    CatalogueStamp = stamp
+
+    return Catalogue
+
+
+def compile_tfile(tfilename, cache_dir=None):
+    """Compile the per-HP columns of a text T-file into its cache directory.
+
+    tfilename  path to the T-file
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+    """
+
+    cdir = cache_path(tfilename, cache_dir)
+    stamp = cache_stamp(tfilename)
+    data = parse_heights(tfilename)
+    write_cache(cdir, data, HeightArrays, stamp)
+
+    log('compile_tfile: %s -> %s' % (tfilename, cdir))
+
+
+def cache_is_fresh(tfilename, cache_dir=None):
+    """Decide if the cache for a T-file exists and matches the source.
+
+    tfilename  path to the T-file
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+
+    Returns True if the cache is usable, False if stale, None if no cache.
+    """
+
+    return is_fresh(cache_path(tfilename, cache_dir), tfilename)
+
+
+def load_heights(tfilename, cache_dir=None):
+    """Load the per-HP columns of a T-file, from the cache if possible.
+
+    tfilename  path to the T-file
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+
+    Returns a DataObj with attributes .zquake, .zprob, .zq_order and
+    .zq_sorted.  If the cache is stale it is rebuilt first.  If there is no
+    cache we fall back to the text parser.
+    """
+
+    fresh = cache_is_fresh(tfilename, cache_dir)
+    if fresh is None:
+        return parse_heights(tfilename)
+
+    if not fresh:
+        log('load_heights: cache for %s is stale, rebuilding' % tfilename)
+        try:
+            compile_tfile(tfilename, cache_dir)
+        except (IOError, OSError), e:
+            log('load_heights: rebuild failed: %s' % str(e))
+            return parse_heights(tfilename)
+
+    return read_cache(cache_path(tfilename, cache_dir), HeightArrays)
+
+
+def load_tfile(tfilename, cache_dir=None):
+    """Load T-file data, joining the per-HP heights with the catalogue.
+
+    tfilename  path to the T-file
+    cache_dir  cache base directory (cfg.TFileCacheDirectory if None)
+
+    Returns a DataObj with attributes .zquake, .zprob, .zq_order,
+    .zq_sorted, .mag, .slip, .sf_offsets and .sf_values (see module
+    docstring).
+    """
+
+    heights = load_heights(tfilename, cache_dir)
+    catalogue = load_catalogue(cache_dir)
+
+    if len(heights.zquake) != len(catalogue.mag):
+        msg = ('T-file %s has %d events, the event catalogue has %d'
+               % (tfilename, len(heights.zquake), len(catalogue.mag)))
+        raise RuntimeError(msg)
+
+    return dataobj.DataObj(zquake=heights.zquake, zprob=heights.zprob,
+                           zq_order=heights.zq_order,
+                           zq_sorted=heights.zq_sorted,
+                           mag=catalogue.mag, slip=catalogue.slip,
+                           sf_offsets=catalogue.sf_offsets,
+                           sf_values=catalogue.sf_values)
+
+
+def event_subfaults(data, event_id):
+    """Get the subfault IDs for an event.
+
+    data      a DataObj from load_tfile() or load_catalogue()
+    event_id  the event ID (0-based line number after the header)
+
+    Returns a numpy int array of subfault IDs.
+    """
+
+    return data.sf_values[data.sf_offsets[event_id]:data.sf_offsets[event_id+1]]
+
+
+def band_events(data, min_wave, max_wave, first=None, last=None):
+    """Get IDs of events with zquake in a band, using the zquake index.
+
+    data      a DataObj from load_tfile() or load_heights()
+    min_wave  minimum zquake value (inclusive)
+    max_wave  maximum zquake value (inclusive)
+    first     if not None, the first event ID of interest (inclusive)
+    last      if not None, the last event ID of interest (inclusive)
+
+    Returns a sorted numpy array of event IDs with zprob > 0.0 and
+    min_wave <= zquake <= max_wave.
+    """
+
+    lo = num.searchsorted(data.zq_sorted, min_wave, side='left')
+    hi = num.searchsorted(data.zq_sorted, max_wave, side='right')
+    ids = num.sort(data.zq_order[lo:hi])
+
+    mask = num.asarray(data.zprob[ids]) > 0.0
+    if first is not None:
+        mask &= (ids >= first)
+    if last is not None:
+        mask &= (ids <= last)
+
+    return ids[mask]
+
+################################################################################
+
+if __name__ == '__main__':
+    import sys
+    import getopt
+
+    def usage(msg=None):
+        if msg:
+            print(msg+'\n')
+        print(__doc__)        # module docstring used
+
+
+    def main():
+        try:
+            opts, args = getopt.getopt(sys.argv[1:], 'h', ['help'])
+        except getopt.error:
+            usage()
+            return 1
+
+        for (opt, param) in opts:
+            if opt in ['-h', '--help']:
+                usage()
+                return 0
+
+        try:
+            tfiles = [tfile_path(int(x)) for x in args]
+        except ValueError:
+            usage()
+            return 1
+
+        if not tfiles:
+            tfiles = sorted(glob.glob(os.path.join(cfg.TFilesDirectory,
+                                                   'T-[0-9]*')))
+
+        print('Compiling event catalogue from %s' % cfg.EventTFile)
+        compile_catalogue()
+
+        for tfilename in tfiles:
+            print('Compiling %s' % tfilename)
+            compile_tfile(tfilename)
+
+    sys.exit(main())
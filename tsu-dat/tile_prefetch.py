@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+"""Background loading of map tiles the view is likely to need next.
+
+pySlip decodes tile PNGs when it draws them, so the first pan into new
+territory or the first zoom to a level stutters.  A Prefetcher decodes the
+tiles around the view, and those a zoom in or out would show, on worker
+threads and hands each decoded image to a deliver function (which pySlip
+passes on to the GUI thread to make the bitmap and cache it).
+
+Each request replaces the previous one.  Tiles not yet started from an old
+request are dropped, and tiles finished for an old request aren't delivered.
+
+This module doesn't import wx, the caller supplies the load and deliver
+functions.
+"""
+
+
+import threading
+import collections
+
+
+# default number of worker threads
+DefaultWorkers = 2
+
+# default width in tiles of the ring prefetched around the view
+DefaultRing = 1
+
+
+def ring_keys(level, start_x, stop_x, start_y, stop_y, num_x, num_y, ring):
+    """Get tile keys in a ring around a view, nearest first.
+
+    level            the tile level
+    start_x, stop_x  range of X tile coordinates in the view
+    start_y, stop_y  range of Y tile coordinates in the view
+    num_x, num_y     number of tiles on the level in X and Y
+    ring             width of the ring in tiles
+
+    Returns a list of (level, x, y) keys, clipped to the level.
+    """
+
+    result = []
+    for r in range(1, ring+1):
+        for x in range(start_x-r, stop_x+r):
+            for y in range(start_y-r, stop_y+r):
+                # only the tiles on this ring
+                if (start_x-r < x < stop_x+r-1 and
+                        start_y-r < y < stop_y+r-1):
+                    continue
+                if 0 <= x < num_x and 0 <= y < num_y:
+                    result.append((level, x, y))
+
+    return result
+
+
+def zoom_keys(level, start_x, stop_x, start_y, stop_y, num_x, num_y):
+    """Get tile keys a zoom to another level centred on a view would show.
+
+    level            the new tile level
+    start_x, stop_x  range of X tile coordinates in the view, on the new level
+                     (may be fractional)
+    start_y, stop_y  range of Y tile coordinates in the view, on the new level
+    num_x, num_y     number of tiles on the new level in X and Y
+
+    Returns a list of (level, x, y) keys, clipped to the level.
+    """
+
+    start_x = max(int(start_x), 0)
+    stop_x = min(int(stop_x+0.999999), num_x)
+    start_y = max(int(start_y), 0)
+    stop_y = min(int(stop_y+0.999999), num_y)
+
+    return [(level, x, y) for x in range(start_x, stop_x)
+                          for y in range(start_y, stop_y)]
+
+
+def prefetch_keys(level, start_x, stop_x, start_y, stop_y, num_tiles,
+                  ring=DefaultRing):
+    """Get the keys of tiles worth loading for a view, most wanted first.
+
+    level            the current tile level
+    start_x, stop_x  range of X tile coordinates in the view
+    start_y, stop_y  range of Y tile coordinates in the view
+    num_tiles        function num_tiles(level) returning (num_x, num_y), or
+                     None if there is no such level
+    ring             width of the ring around the view in tiles
+
+    Returns a list of (level, x, y) keys: the ring around the view, then the
+    view after a zoom in, then the view after a zoom out.  The view tiles
+    themselves aren't included.
+    """
+
+    result = []
+
+    size = num_tiles(level)
+    if size is not None:
+        result.extend(ring_keys(level, start_x, stop_x, start_y, stop_y,
+                                size[0], size[1], ring))
+
+    # a zoom keeps the view centre and the view size in tiles
+    centre_x = (start_x + stop_x) / 2.0
+    centre_y = (start_y + stop_y) / 2.0
+    half_x = (stop_x - start_x) / 2.0
+    half_y = (stop_y - start_y) / 2.0
+    for (new_level, scale) in ((level+1, 2.0), (level-1, 0.5)):
+        size = num_tiles(new_level)
+        if size is not None:
+            result.extend(zoom_keys(new_level,
+                                    centre_x*scale - half_x,
+                                    centre_x*scale + half_x,
+                                    centre_y*scale - half_y,
+                                    centre_y*scale + half_y,
+                                    size[0], size[1]))
+
+    return result
+
+
+class Prefetcher(object):
+    """Worker threads loading tiles for the latest request."""
+
+    def __init__(self, load, deliver, is_cached=None, workers=DefaultWorkers):
+        """Start the worker threads.
+
+        load       function load(key) returning the decoded tile, called on a
+                   worker thread
+        deliver    function deliver(generation, key, tile) called on a worker
+                   thread with each loaded tile of the current request
+        is_cached  function is_cached(key) returning True if a tile needn't
+                   be loaded
+        workers    number of worker threads
+        """
+
+        self.load = load
+        self.deliver = deliver
+        self.is_cached = is_cached
+        self.condition = threading.Condition()
+        self.pending = collections.deque()
+        self.generation = 0
+        self.stopping = False
+
+        self.loaded = 0
+        self.cancelled = 0
+        self.errors = 0
+
+        self.threads = []
+        for _ in range(workers):
+            t = threading.Thread(target=self.worker)
+            t.setDaemon(True)
+            t.start()
+            self.threads.append(t)
+
+    def request(self, keys):
+        """Replace any outstanding request with a new one.
+
+        keys  the tile keys to load, most wanted first
+
+        Returns the generation number of the new request.
+        """
+
+        self.condition.acquire()
+        try:
+            self.generation += 1
+            self.cancelled += len(self.pending)
+            self.pending = collections.deque(keys)
+            self.condition.notifyAll()
+            return self.generation
+        finally:
+            self.condition.release()
+
+    def cancel(self):
+        """Drop any outstanding request."""
+
+        self.request([])
+
+    def is_current(self, generation):
+        """See if a generation number is that of the latest request."""
+
+        return generation == self.generation
+
+    def worker(self):
+        """Thread body: load tiles for the latest request."""
+
+        while True:
+            self.condition.acquire()
+            try:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                key = self.pending.popleft()
+                generation = self.generation
+            finally:
+                self.condition.release()
+
+            if self.is_cached and self.is_cached(key):
+                continue
+
+            try:
+                tile = self.load(key)
+            except Exception:
+                tile = None
+
+            self.condition.acquire()
+            try:
+                if tile is None:
+                    self.errors += 1
+                    continue
+                if not self.is_current(generation):
+                    self.cancelled += 1
+                    continue
+                self.loaded += 1
+            finally:
+                self.condition.release()
+
+            self.deliver(generation, key, tile)
+
+    def stop(self):
+        """Drop any outstanding request and end the worker threads."""
+
+        self.condition.acquire()
+        try:
+            self.stopping = True
+            self.pending.clear()
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+        for t in self.threads:
+            t.join()
+
+    def stats(self):
+        """Get a dictionary of the prefetch counters."""
+
+        return {'loaded': self.loaded,
+                'cancelled': self.cancelled,
+                'errors': self.errors,
+                'pending': len(self.pending)}
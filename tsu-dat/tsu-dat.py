@@ -18,10 +18,9 @@ log = log.Log(cfg.LogFilename, cfg.DefaultLogLevel, append=False)
 
 import sys
 import os
-import re
 import math
-import shutil
 import time
+import threading
 import subprocess
 import ConfigParser
 import wx
@@ -29,6 +28,7 @@ import wx.html
 import webbrowser
 import tempfile
 import Image
+import numpy as num
 # get pickler, try for 'C' pickler
 try:
     import cPickle as pickle
@@ -45,8 +45,13 @@ import pyslip
 import util
 import select_zone
 import get_hp_events as ghe
-import list_quakes as lq
-import multimux as mmx
+import tfile_cache as tfc
+import hazard_matrix as hm
+import wave_amplitude as wa
+import generate as gen
+import cost_model
+import run_build as rb
+import build_daemon as bd
 import polygon
 import dataobj
 import execute_tail_log as etl
@@ -140,6 +145,24 @@ ZoneSelectSize = 7
 SubfaultPointColour = '#0000ff'
 SubfaultPointSize = 9
 
+# event footprint point size, and minimum wave height shown
+FootprintPointSize = 4
+FootprintMinHeight = 0.01
+
+# wave height bins (m) and colours used to colour hazard points,
+# there is one more colour than bins: values below bin 0 get colour 0
+WaveHeightBins = [0.1, 0.25, 0.5, 1.0, 2.0, 5.0]
+WaveHeightColours = ['#ffffcc', '#c7e9b4', '#7fcdbb', '#41b6c4',
+                     '#1d91c0', '#225ea8', '#0c2c84']
+
+# return period bins (years) and colours used to colour hazard points by RP,
+# short return periods are the most hazardous so get the darkest colours
+ReturnPeriodBins = [100, 250, 500, 1000, 2500, 5000]
+ReturnPeriodColours = WaveHeightColours[::-1]
+
+# colour of hazard points with no wave amplitude data, when colouring
+NoDataColour = '#bdbdbd'
+
 # Polygon point colour (rgba) and size
 AOIPolygonColour = '#0000ff'
 AOIPolygonSize = 4
@@ -161,8 +184,11 @@ ID_EDIT_PREFS = 201
 
 ID_HELP_CONTENTS = 301
 ID_HELP_COPYRIGHT = 302
+ID_HELP_TIMINGS = 303
 ID_HELP_ABOUT = 309
 
+ID_VIEW_HAZARD = 401
+
 ######
 # Various GUI layout constants
 ######
@@ -215,6 +241,9 @@ WaveHeightFractionWidth = 2
 # the minimum allowed tile level to display
 MinTileLevel = 1
 
+# tile cache byte budget
+TileCacheBytes = cfg.TileCacheSize * 1024 * 1024
+
 # size of 'directed' arrowhead
 DirectedArrowheadAngle = 0.45       # radians
 DirectedArrowheadSize = 0.02
@@ -942,7 +971,8 @@ class AppFrame(wx.Frame):
         # convert to set of subfaults
         subfaults = []
         for e_id in event_ids:
-            subfaults.extend(self.eventid_2_subfaults[e_id])
+            subfaults.extend(tfc.event_subfaults(self.event_catalogue,
+                                                 e_id).tolist())
 
         subfaults = set(subfaults)
 
@@ -960,6 +990,9 @@ class AppFrame(wx.Frame):
         self.pyslip.placeLayerAfterLayer(self.selected_subfaults_layer,
                                          self.selected_zone_layer)
 
+        # show the footprint of the selected events over the HP layer
+        self.loadFootprintLayer(event_ids)
+
     def sortEventColumn(self, event):
         """Sort the event data by clicked column.
 
@@ -995,7 +1028,7 @@ class AppFrame(wx.Frame):
             self.events_last_sort_col = col
 
         # sort the events data by that column
-        self.events.sort(key=lambda x: float(x[col]),
+        self.events.sort(key=lambda x: x[col],
                          reverse=self.events_last_sort_order)
         self.fillEventsListCtrl(self.events)
 
@@ -1032,7 +1065,10 @@ class AppFrame(wx.Frame):
         # create gui objects
         sb = AppStaticBox(parent, '')
         self.pyslip = pyslip.pySlip(parent, tile_dir=cfg.TilesDirectory,
-                                    min_level=MinTileLevel)
+                                    min_level=MinTileLevel,
+                                    tile_cache_bytes=TileCacheBytes,
+                                    prefetch_workers=cfg.TilePrefetchWorkers,
+                                    prefetch_ring=cfg.TilePrefetchRing)
 
         # lay out objects
         box = wx.StaticBoxSizer(sb, orient=wx.HORIZONTAL)
@@ -1158,12 +1194,25 @@ class AppFrame(wx.Frame):
         # bind Edit items to code
         self.Bind(wx.EVT_MENU, self.onEditPrefs, id=ID_EDIT_PREFS)
 
+        # put View menu on master
+        viewmenu= wx.Menu()
+        viewmenu.AppendCheckItem(ID_VIEW_HAZARD, '&Colour Hazard Points',
+                                 ' Colour hazard points by the wave height at '
+                                 'the return period, or the return period of '
+                                 'the wave height')
+        menuBar.Append(viewmenu,'&View')
+
+        # bind View items to code
+        self.Bind(wx.EVT_MENU, self.onViewHazard, id=ID_VIEW_HAZARD)
+
         # put Help menu on master
         helpmenu= wx.Menu()
         helpmenu.Append(ID_HELP_CONTENTS, '&User Guide ...\tF1',
                         ' View the user guide for %s' % cfg.AppName)
         helpmenu.Append(ID_HELP_COPYRIGHT, '&Copyright ...',
                         ' Show %s copyright' % cfg.AppName)
+        helpmenu.Append(ID_HELP_TIMINGS, '&Timing Summary',
+                        ' Write a summary of operation times to the log')
         helpmenu.AppendSeparator()
         helpmenu.Append(ID_HELP_ABOUT, '&About %s ...' % cfg.AppName,
                         ' Information about %s' % cfg.AppName)
@@ -1172,6 +1221,7 @@ class AppFrame(wx.Frame):
         # bind Help items to code
         self.Bind(wx.EVT_MENU, self.onHelpContents, id=ID_HELP_CONTENTS)
         self.Bind(wx.EVT_MENU, self.onHelpCopyright, id=ID_HELP_COPYRIGHT)
+        self.Bind(wx.EVT_MENU, self.onHelpTimings, id=ID_HELP_TIMINGS)
         self.Bind(wx.EVT_MENU, self.onHelpAbout, id=ID_HELP_ABOUT)
 
         # finally attach menubar to frame
@@ -1198,18 +1248,10 @@ class AppFrame(wx.Frame):
         self.hp_points = util.readPointsFile(cfg.HazardPointsFile)
         self.hp_points_data = [[x[0], x[1]] for x in self.hp_points]
         self.hp_points = [(x[0], x[1], int(x[2])) for x in self.hp_points]
-        self.hp_layer_id = self.pyslip.addMonoPointLayer(self.hp_points_data,
-                                                         colour=PointsColour,
-                                                         size=PointsSize,
-                                                         name='hazard points')
+        self.hp_ids = num.array([x[2] for x in self.hp_points])
 
-        # set callback for selecting a point (left or right click)
-        self.pyslip.setLayerPointSelectCallback(self.hp_layer_id,
-                                                PointSelectDelta,
-                                                self.HazardPointSelected)
-        self.pyslip.setLayerPointRightSelectCallback(self.hp_layer_id,
-                                                     PointSelectDelta,
-                                                     self.HazardPointRightSelected)
+        # get the HP x event wave height matrix, if it has been built
+        self.loadHazardMatrix()
 
         # set handlers for all CHANGE events from controls
         self.rp_cbox.Bind(wx.EVT_COMBOBOX, self.changeRP)
@@ -1240,6 +1282,7 @@ class AppFrame(wx.Frame):
         self.aoi_layer = None                   # layer to show AOI
         self.deag_layer = None                  # the deag layer
         self.deag_label_layer = None            # the deag legend layer
+        self.footprint_layer = None             # selected events footprint
 
         self.events = None                  # event data
         self.events_last_sort_col = None
@@ -1250,6 +1293,16 @@ class AppFrame(wx.Frame):
         self.edit_state = False             # BP edit flag
         self.text_layer = None
 
+        self.hp_layer_id = None             # layer showing the HPs
+        self.hazard_colouring = False       # True if HPs coloured by hazard
+        self.hazard_colour_key = None       # RP or WH the HP colours show
+        self.hazard_colour_cache = {}       # RP -> coloured HP layer data
+        self.hazard_colour_stamp = None     # amplitude table the cache is for
+        self.hp_amp_rows = None             # amplitude table row for each HP
+
+        # show the hazard points
+        self.loadHazardPointsLayer()
+
         # force pyslip initialisation
         self.pyslip.onResize()
 
@@ -1350,6 +1403,9 @@ class AppFrame(wx.Frame):
                                               '%.2f m'
                                               % (min_ht, max_ht)))
 
+        if self.hazard_colouring:
+            self.loadHazardPointsLayer()
+
         self.clearZoneEvents()
 
     def btn_AOI_import(self, event):
@@ -1377,51 +1433,11 @@ class AppFrame(wx.Frame):
 
             # load AOI polygon from 'self.AOI_filename'
             try:
-                fd = open(self.AOI_filename, 'r')
-                lines = fd.readlines()
-                fd.close()
-            except IOError, e:
-                try:
-                    (err, _) = str(e).split(':', 1)
-                except:
-                    err = str(e)
-                msg = "Can't open file '%s': %s" % (self.AOI_filename, err)
-                self.error(msg)
-
-            # create AOI layer - check we have lon+lat, not easting+northing
-            self.aoi_polygon = []
-            repat = re.compile(',| +')      # split on one ',' or multiple space
-            for (i, oline) in enumerate(lines):
-                line = oline.strip()
-                if not line or line[0] == '#':
-                    continue
-                fields = repat.split(line)
-                if len(fields) < 2:
-                    msg = ("File '%s' has a bad format on line %d: %s"
-                           % (basename, i+1, oline))
-                    self.error(msg)
-                    dlg.Destroy()
-                    return
-                try:
-                    lon = float(fields[0])
-                    lat = float(fields[1])
-                except ValueError:
-                    msg = ("File '%s' has a bad format on line %d: %s"
-                           % (basename, i+1, oline))
-                    self.error(msg)
-                    dlg.Destroy()
-                    return
-                if lon > 360.0 or lat > 90.0:
-                    msg = ('Looks like that file has eastings and northings. '
-                           'You can only import files containing '
-                           'longitude and latitude.')
-                    self.error(msg)
-                    return
-                self.aoi_polygon.append((float(fields[0]), float(fields[1])))
-
-            # ensure polygon is closed
-            if  self.aoi_polygon[0] != self.aoi_polygon[-1]:
-                self.aoi_polygon.append(self.aoi_polygon[0])
+                self.aoi_polygon = gen.read_aoi_polygon(self.AOI_filename)
+            except RuntimeError, msg:
+                self.error(str(msg))
+                dlg.Destroy()
+                return
 
             # add arrow to each vector to make directed polygon
             self.aoi_polygon = self.makeDirectedPolygon(self.aoi_polygon)
@@ -1500,11 +1516,8 @@ class AppFrame(wx.Frame):
         dlg.Destroy()
 
         # get HPs inside the bounding polygon
-        self.hp_inside_bb = []
-        for hp in self.hp_points:
-            (x, y, id) = hp
-            if polygon.point_in_poly(x, y, self.aoi_polygon):
-                self.hp_inside_bb.append((id, x, y))
+        self.hp_inside_bb = gen.hps_inside_aoi(self.hp_points,
+                                               self.aoi_polygon)
 
         # now look for Bounded HP selections - change selection callback
         self.pyslip.setLayerPointSelectCallback(self.hp_layer_id,
@@ -1701,6 +1714,7 @@ class AppFrame(wx.Frame):
         if self.selected_zone_layer:
             self.pyslip.deleteLayer(self.selected_zone_layer)
             self.selected_zone_layer = None
+        self.deleteFootprintLayer()
 
         self.events_last_sort_col = None
         self.events_last_sort_order = None
@@ -1766,15 +1780,7 @@ class AppFrame(wx.Frame):
         self.txt_wh_delta.SetValue(p.load())
         self.rp_cbox.SetValue(p.load())
         self.hp_points_data = p.load()
-        self.pyslip.deleteLayer(self.hp_layer_id)
-        self.hp_layer_id = \
-                self.pyslip.addMonoPointLayer(self.hp_points_data,
-                                              colour=PointsColour,
-                                              size=PointsSize,
-                                              name='hazard points')
-        self.pyslip.setLayerPointSelectCallback(self.hp_layer_id,
-                                                PointSelectDelta,
-                                                self.HazardPointSelected)
+        self.loadHazardPointsLayer(force=True)
 
         self.hp_lon = p.load()
         self.hp_lat = p.load()
@@ -1985,6 +1991,237 @@ class AppFrame(wx.Frame):
             self.pyslip.deleteLayer(self.deag_label_layer)
             self.deag_label_layer = None
 
+    def loadHazardMatrix(self):
+        """Map the HP x event wave height matrix in a worker thread.
+
+        Checking the matrix stamp stats every T-file, and a stale matrix is
+        rebuilt from all of them, so that is done off the GUI thread.  Event
+        footprints are disabled until setHazardMatrix() is called with the
+        result.
+        """
+
+        self.hazard_matrix = None
+        self.hp_matrix_rows = None
+
+        t = threading.Thread(target=self.hazardMatrixWorker)
+        t.setDaemon(True)
+        t.start()
+
+    def hazardMatrixWorker(self):
+        """Thread body: load (rebuilding if stale) the hazard matrix."""
+
+        log('loadHazardMatrix: checking hazard matrix in the background')
+        matrix = None
+        try:
+            matrix = hm.load_matrix()
+        except (RuntimeError, IOError, OSError, ValueError), e:
+            log('loadHazardMatrix: no hazard matrix: %s' % str(e))
+
+        wx.CallAfter(self.setHazardMatrix, matrix)
+
+    def setHazardMatrix(self, matrix):
+        """Install a loaded hazard matrix, on the GUI thread.
+
+        matrix  a hm.HazardMatrix, or None
+
+        Creates: hazard_matrix    a hm.HazardMatrix, or None
+                 hp_matrix_rows   matrix row for each HP in self.hp_points
+        """
+
+        if matrix is None:
+            log('loadHazardMatrix: event footprints disabled')
+            return
+
+        self.hazard_matrix = matrix
+        self.hp_matrix_rows = matrix.hp_rows(self.hp_ids)
+        log('loadHazardMatrix: event footprints enabled')
+
+    def colourPointData(self, index, values, bins=WaveHeightBins,
+                        colours=WaveHeightColours):
+        """Make coloured point layer data for a subset of hazard points.
+
+        index    array of indices into self.hp_points
+        values   wave heights (or RPs) for the indexed points
+        bins     bin edges for values
+        colours  colour for each bin, one more than bins
+
+        Returns a list of (lon, lat, colour, id) for addPointLayer().
+        """
+
+        colour_index = num.digitize(values, bins)
+        result = []
+        for (i, c) in zip(index.tolist(), colour_index.tolist()):
+            (lon, lat, id) = self.hp_points[i]
+            result.append((lon, lat, colours[c], id))
+
+        return result
+
+    def hazardColourKey(self):
+        """Get the RP or WH the hazard points should be coloured by.
+
+        Returns ('RP', rp) or ('WH', wh) depending on which of RP/WH was
+        changed last, or None if there is no usable value.
+        """
+
+        if self.RP_WH_last_changed == 'WH':
+            try:
+                wh = float(self.txt_wh.GetValue())
+            except ValueError:
+                return None
+            if wh <= 0.0:
+                return None
+            return ('WH', wh)
+
+        rp_value = self.rp_cbox.GetValue()
+        if not rp_value:
+            return None
+        return ('RP', int(rp_value.split(' ')[0]))
+
+    def hazardColourData(self, key):
+        """Get coloured hazard point layer data.
+
+        key  ('RP', rp) to colour each HP by its wave height at the return
+             period, or ('WH', wh) to colour each HP by the return period of
+             the wave height
+
+        The data is computed for all HPs in one pass over the amplitude
+        table, and cached per RP.  HPs missing from the table are drawn in
+        NoDataColour.  Returns None if there is no amplitude data.
+        """
+
+        try:
+            table = wa.get_table()
+        except (RuntimeError, IOError, OSError), e:
+            log('hazardColourData: no wave amplitude data: %s' % str(e))
+            return None
+
+        # the cache is only good for the table it was built from
+        if table.stamp != self.hazard_colour_stamp:
+            self.hazard_colour_cache = {}
+            self.hazard_colour_stamp = table.stamp
+            self.hp_amp_rows = table.hp_rows(self.hp_points)
+
+        data = self.hazard_colour_cache.get(key, None)
+        if data is not None:
+            return data
+
+        index = num.flatnonzero(self.hp_amp_rows >= 0)
+        heights = table.heights[self.hp_amp_rows[index]]
+
+        # HPs with no data first, so coloured HPs are drawn over them
+        data = []
+        for i in num.flatnonzero(self.hp_amp_rows < 0).tolist():
+            (lon, lat, id) = self.hp_points[i]
+            data.append((lon, lat, NoDataColour, id))
+
+        (kind, value) = key
+        if kind == 'RP':
+            try:
+                column = table.rp_index(value)
+            except RuntimeError, e:
+                log('hazardColourData: %s' % str(e))
+                return None
+            data.extend(self.colourPointData(index, heights[:,column]))
+            self.hazard_colour_cache[key] = data
+        else:
+            # first RP at which each HP reaches the WH, infinite if never
+            reached = (num.sort(heights, axis=1) < value).sum(axis=1)
+            last = len(table.periods) - 1
+            periods = table.periods[num.minimum(reached, last)]
+            periods = num.where(reached > last, num.inf, periods)
+            data.extend(self.colourPointData(index, periods,
+                                             ReturnPeriodBins,
+                                             ReturnPeriodColours))
+
+        return data
+
+    def loadHazardPointsLayer(self, force=False):
+        """(Re)load the hazard points layer.
+
+        force  if True, reload even if the colouring hasn't changed
+
+        If hazard colouring is on the HPs are coloured by the current RP or
+        WH, else they are all drawn in PointsColour.  The new layer takes the
+        Z position and select callbacks of the old one.
+        """
+
+        key = None
+        data = None
+        if self.hazard_colouring:
+            key = self.hazardColourKey()
+            if key is not None:
+                data = self.hazardColourData(key)
+                if data is None:
+                    key = None
+
+        if (not force and self.hp_layer_id is not None
+                and key == self.hazard_colour_key):
+            return
+        self.hazard_colour_key = key
+
+        old_layer_id = self.hp_layer_id
+        if data is None:
+            self.hp_layer_id = \
+                self.pyslip.addMonoPointLayer(self.hp_points_data,
+                                              colour=PointsColour,
+                                              size=PointsSize,
+                                              name='hazard points')
+        else:
+            self.hp_layer_id = \
+                self.pyslip.addPointLayer(data, colour=None,
+                                          size=PointsSize,
+                                          name='hazard points')
+        if old_layer_id is not None:
+            self.pyslip.placeLayerAfterLayer(self.hp_layer_id, old_layer_id)
+            self.pyslip.deleteLayer(old_layer_id)
+
+        # set callback for selecting a point (left or right click)
+        if self.edit_state:
+            select_callback = self.BoundaryPointSelected
+        else:
+            select_callback = self.HazardPointSelected
+        self.pyslip.setLayerPointSelectCallback(self.hp_layer_id,
+                                                PointSelectDelta,
+                                                select_callback)
+        self.pyslip.setLayerPointRightSelectCallback(self.hp_layer_id,
+                                                     PointSelectDelta,
+                                                     self.HazardPointRightSelected)
+
+    def loadFootprintLayer(self, event_ids):
+        """Load the layer showing the footprint of selected events.
+
+        event_ids  list of selected event IDs
+
+        Each HP is coloured by the maximum wave height of the selected events
+        at that HP.  Does nothing if there is no hazard matrix.
+        """
+
+        self.deleteFootprintLayer()
+        if self.hazard_matrix is None or not event_ids:
+            return
+
+        # one contiguous matrix row per event, max over the events
+        heights = self.hazard_matrix.by_event[sorted(event_ids)].max(axis=0)
+
+        # map matrix columns back onto the displayed HPs
+        rows = self.hp_matrix_rows
+        index = num.flatnonzero(rows >= 0)
+        values = heights[rows[index]]
+        keep = values >= FootprintMinHeight
+        data = self.colourPointData(index[keep], values[keep])
+
+        self.footprint_layer = \
+            self.pyslip.addPointLayer(data, colour=None,
+                                      size=FootprintPointSize,
+                                      name='event footprint')
+
+    def deleteFootprintLayer(self):
+        """Delete the event footprint layer."""
+
+        if self.footprint_layer:
+            self.pyslip.deleteLayer(self.footprint_layer)
+            self.footprint_layer = None
+
     def onZoneSelect(self, id, points):
         """Zone select callback function.
 
@@ -2031,8 +2268,9 @@ class AppFrame(wx.Frame):
         wh_delta = float(self.txt_wh_delta.GetValue())
         min_height = wh - wh_delta
         max_height = wh + wh_delta
-        self.events = ghe.get_hp_events(self.hp_selected_id,
-                                        min_height, max_height, zone_name)
+        events = ghe.query_hp_events(self.hp_selected_id,
+                                     min_height, max_height, zone_name)
+        self.events = ghe.event_rows(events)
         self.txt_num_subfaults.ChangeValue('%d' % len(self.events))
 
         self.fillEventsListCtrl(self.events)
@@ -2044,6 +2282,7 @@ class AppFrame(wx.Frame):
         if self.selected_subfaults_layer:
             self.pyslip.deleteLayer(self.selected_subfaults_layer)
             self.selected_subfaults_layer = None
+        self.deleteFootprintLayer()
 
         # create selected zone layer
         if self.selected_zone_layer:
@@ -2065,7 +2304,9 @@ class AppFrame(wx.Frame):
     def fillEventsListCtrl(self, events):
         """Populate the event list control.
 
-        events  list of tuples [(...), ...]
+        events  list of numeric tuples [(...), ...] from ghe.event_rows()
+
+        Event values are only formatted to strings here.
         """
 
         # populate the event listctrl
@@ -2073,6 +2314,7 @@ class AppFrame(wx.Frame):
         for (i, h) in enumerate(EventListHeaders):
             self.lst_subfaults.InsertColumn(i, h)
         for (i, e) in enumerate(events):
+            e = ghe.format_event(e)
             index = self.lst_subfaults.InsertStringItem(sys.maxint, e[0])
             for (ii, ee) in enumerate(e[1:]):
                 self.lst_subfaults.SetStringItem(index, ii+1, ee)
@@ -2161,6 +2403,12 @@ class AppFrame(wx.Frame):
         cfg.GenSaveDir = PreferencesDlg.SavePath
         PreferencesDlg.Destroy()
 
+    def onViewHazard(self, event):
+        """Turn colouring of hazard points by hazard on or off."""
+
+        self.hazard_colouring = event.IsChecked()
+        self.loadHazardPointsLayer()
+
     def onHelpContents(self, event):
         try:
             if sys.platform == 'win32':
@@ -2177,6 +2425,14 @@ class AppFrame(wx.Frame):
                                     size=CopyrightSize)
         CopyrightDlg.Show()
 
+    def onHelpTimings(self, event):
+        """Write the timing summary to the log and tell the user."""
+
+        log.log_timings()
+        log.flush()
+        self.info('The timing summary is at the end of the log file:\n%s'
+                  % cfg.LogPath)
+
     def onHelpAbout(self, event):
         aboutDlg = CopyAboutDlg(self, cfg.AboutTitle, AboutHTMLText,
                                 size=AboutSize)
@@ -2284,88 +2540,30 @@ class AppFrame(wx.Frame):
         wh_delta = float(self.txt_wh_delta.GetValue())
 
         # start the generation process
-        max_wh = wh + wh_delta
-        min_wh = wh - wh_delta
-
-        min_wh = max(min_wh, 0.0)       # limit wave height to [0.0, 10.0]
-        max_wh = min(max_wh, 10.0)
+        (min_wh, max_wh) = gen.wave_height_band(wh, wh_delta)
 
         # prepare various file pathnames
-        results_dir = cfg.ResultsDirMask % (hp_id, min_wh, max_wh)
-        base_dir = os.path.join(cfg.GenSaveDir, scenario_name)
-        gen_dir = os.path.join(base_dir, results_dir)
-        boundaries_dir = os.path.join(base_dir, 'boundaries')
-
-        shutil.rmtree(gen_dir, ignore_errors=True)
-        try:
-            os.makedirs(gen_dir)
-        except OSError, e:
-            self.error('Error making directory:\n%s\n%s'
-                       % (gen_dir, str(e)))
-            wx.EndBusyCursor()
-            self.Enable()
-            self.btn_generate.SetLabel('Generate')
-            return
-
-        faultxy_filename = os.path.join(gen_dir, cfg.FaultXYFilename)
-        quakeprob_filename = os.path.join(gen_dir, cfg.QuakeProbFilename)
-
-        # get path to and check existence of data files
-        msg = ''
-        hazard_file = os.path.join(cfg.TFilesDirectory,
-                                   'T-%05d' % self.hp_selected_id)
-        if not os.path.isfile(hazard_file):
-            msg += "Hazard file %s doesn't exist!?" % hazard_file
-        invall_file = os.path.join(cfg.MultimuxDirectory, cfg.InvallFilename)
-        if not os.path.isfile(invall_file):
-                        msg += "Invall file %s doesn't exist!?" % invall_file
-
-        if msg:
-            self.error(msg)
-            wx.EndBusyCursor()
-            self.Enable()
-            self.btn_generate.SetLabel('Generate')
-            return
-
-        # now actually get quake data
-        try:
-            lq.list_quakes(hp_id, min_wh, max_wh, invall_file,
-                           hazard_file, faultxy_filename, quakeprob_filename)
-        except RuntimeError, msg:
-            wx.EndBusyCursor()
-            self.Enable()
-            self.btn_generate.SetLabel('Generate')
-            self.error('Error in list_quakes(): %s' % msg)
-            return
+        paths = gen.scenario_paths(scenario_name, hp_id, min_wh, max_wh)
 
+        # list_quakes(), multimux() and urs_order.csv, skipping stages the
+        # manifest says are already done
         try:
-            for event_id in selected_events:
-                mmx.multimux(event_id, base_dir)
+            gen.prepare(paths, hp_id, min_wh, max_wh, selected_events,
+                        self.hp_inside_bb)
         except RuntimeError, msg:
             wx.EndBusyCursor()
             self.Enable()
             self.btn_generate.SetLabel('Generate')
-            self.error('Error in multimux(): %s' % msg)
+            self.error(str(msg))
             return
 
-        # create urs_order.csv containing HPs inside bounding box
-        urs_order_file = os.path.join(boundaries_dir, 'urs_order.csv')
-        fd = open(urs_order_file, 'w')
-        fd.write('index,longitude,latitude\n')
-        for bbhp in self.hp_inside_bb:
-            fd.write('%d,%f,%f\n' % bbhp)
-        fd.close()
-
-        # copy required files to 'gen_dir'
-        shutil.copy('run_build.py', gen_dir)
-        shutil.copy('config.py', gen_dir)
-        shutil.copy('build_urs_boundary.py', gen_dir)
-
         self.warn('Files created in directory: %s' % cfg.GenSaveDir)
 
-        # estimate completion time
+        # estimate completion time, events already built or in the STS
+        # cache take next to no time
+        build_events = gen.events_to_build(paths, selected_events)
         estimated_time = \
-                self.estimate_generate_time(num_q_selected, selected_events,
+                self.estimate_generate_time(num_q_selected, build_events,
                                             scenario_name)
 
         ######
@@ -2380,6 +2578,7 @@ class AppFrame(wx.Frame):
                'Boundary file: %s' % self.txt_area_of_interest.GetValue(),
                'Zone: %s' % self.txt_zone_name.GetValue(),
                'Number of selected events: %d' % num_q_selected,
+               'Number of events to build: %d' % len(build_events),
                '',
                'This might take %s to finish, but could take '
                'longer on slower hardware.' % estimated_time,
@@ -2399,35 +2598,38 @@ class AppFrame(wx.Frame):
             return
         log('Generate continuing ...')
 
-        # run the generate process as a subprocess
+        # run the generate process in the build daemon, which has the build
+        # code loaded, else as a subprocess
         here = os.getcwd()
-        log_filename = os.path.join(gen_dir, 'build_urs_boundary.log')
-        try:
-            os.remove(log_filename)
-        except OSError:
-            pass
-
-        # figure out full mux directory path (required for Windows)
-        mux_dir = os.path.abspath(cfg.MuxDirectory)
-
-        # now move to generating output directory        
-        os.chdir(gen_dir)
+        cmd = gen.build_command(paths, selected_events, progress=True)
+        start = None
+        if cfg.UseBuildDaemon:
+            def start():
+                """Submit to the daemon (may start it, so not GUI thread)."""
+
+                process = bd.submit(cfg.BuildDaemonAddress,
+                                    cfg.BuildDaemonKeyFile,
+                                    paths.gen_dir, cmd[2:])
+                if process is None:
+                    log('Build daemon not available, running a subprocess')
+                return process
+
+        # now move to generating output directory
+        os.chdir(paths.gen_dir)
 
-        cmd = ['python', 'run_build.py', log_filename, scenario_name,
-               cfg.GenSaveDir, cfg.AppName, mux_dir, cfg.EventFile]
-        str_selected_events = [str(x) for x in selected_events]
-        cmd.extend(str_selected_events)
         dlg = etl.ExecuteAndTailLogfile(self, cmd,
-                                        log_filename, 'Generating data ...')
+                                        paths.build_log, 'Generating data ...',
+                                        start=start)
         dlg.ShowModal()
         returncode = dlg.returncode
         dlg.Destroy()
 
         os.chdir(here)
 
-        # now split the fault.xy file that was generated
+        # now split the fault.xy file that was generated, for events not
+        # already split from the same file
         wx.Yield()
-        self.splitFaultXY(faultxy_filename, boundaries_dir, selected_events)
+        gen.finish(paths, selected_events)
 
         # cursor back to normal
         wx.EndBusyCursor()
@@ -2445,26 +2647,36 @@ class AppFrame(wx.Frame):
         """Estimate generation time.
 
         num_subfaults    numer of subfaults
-        selected_events  list of selected event IDs
+        selected_events  list of IDs of the selected events to be built
         scenario_name    name of scenario
 
-        Return estimated time string.
+        Return estimated time string.  The estimate uses the build cost
+        model measured on this machine, or EstimateFudgeFactor if there
+        isn't enough build history yet.
         """
 
         max_sources = 0
+        events = []
 
         for ev_id in selected_events:
             # form pathname of multimux file - get # of sources
             mux_filename = os.path.join(cfg.GenSaveDir, scenario_name,
                                         'boundaries', str(ev_id), cfg.EventFile)
-            f = open(mux_filename, 'r')
-            line = f.readline()
-            f.close()
-            num_sources = int(line.strip())
-            max_sources = max(max_sources, num_sources)
+            event = cost_model.event_features(mux_filename, cfg.MuxDirectory,
+                                              len(self.hp_inside_bb))
+            max_sources = max(max_sources, event[0])
+            events.append(event)
 
         # get estimated completion time in seconds
-        result = int((num_subfaults+max_sources)**EstimateFudgeFactor)
+        coeffs = cost_model.load_model(cfg.BuildHistoryFile)
+        if coeffs:
+            result = int(cost_model.estimate(coeffs, events,
+                                             rb.default_jobs()))
+            log('estimate_generate_time: model estimate %ds' % result)
+        elif events:
+            result = int((num_subfaults+max_sources)**EstimateFudgeFactor)
+        else:
+            result = 0
         if result < 120:
             result = 120
 
@@ -2487,87 +2699,17 @@ class AppFrame(wx.Frame):
         return result
 
 
-    def splitFaultXY(self, fault_xy_file, boundaries_dir, event_list):
-        """Split generated fault.xy file into boundaries/<ID>/event_<ID>.xy.
-
-        fault_xy_file   path to generated fault.xy file
-        boundaries_dir  path to 'boundaries' directory
-        event_list      list of event IDs used to generate fault.xy
-        """
-
-        # read the fault.xy file into memory
-        f = open(fault_xy_file, 'r')
-        fxy_lines = f.readlines()
-        f.close()
-
-        fxy_header = fxy_lines[0]
-        split_lines = []
-        for l in fxy_lines[1:]:
-            l = l.strip()
-            split_lines.append(l.split(','))
-
-        # for each eventID, get subfaults and strip lines into split file
-        for id in event_list:
-            # make the split file
-            split_file = os.path.join(boundaries_dir, str(id),
-                                      'event_%05d.xy' % id)
-            sf = open(split_file, 'w')
-            sf.write(fxy_header)
-
-            subfaults = self.eventid_2_subfaults[id]
-            for sl in split_lines:
-                (lon, lat, quake_id, subfault_id) = sl
-                quake_id = int(quake_id)
-                if quake_id == id:
-                    sf.write('%s,%s,%d,%s\n'
-                             % (lon, lat, quake_id, subfault_id))
-            sf.close()
-
     def get_WH_from_RP_HP(self, rp, hp):
         """Get waveheight given return period and hazard point.
 
         rp   is the return period
         hp   is a hazard point position tuple (lon, lat)
 
-        Return the appropriate waveheight for rp and hp by grovelling
-        in the 'WaveAmplitudeFile' file.
+        Return the appropriate waveheight for rp and hp from the in-memory
+        'WaveAmplitudeFile' table.
         """
 
-        # get contents of file
-        fd = open(cfg.WaveAmplitudeFile, 'r')
-        lines = fd.readlines()
-        fd.close()
-
-        repat = re.compile(' +')
-
-        # get possible return periods from first line
-        hdr = lines[0].strip()
-        periods = repat.split(hdr)
-        periods = [int(float(x)) for x in periods]
-
-        # figure out index into 'periods' for given RP
-        try:
-            rp_index = periods.index(rp)
-        except ValueError:
-            msg = ("RP '%d' not found in line 1 of file '%s'"
-                   % (rp, cfg.WaveAmplitudeFile))
-            raise RuntimeError(msg)
-
-        # unpack the hp position tuple
-        (hp_lon, hp_lat) = hp
-
-        # look through lines after header for line matching hp tuple
-        for l in lines[1:]:
-            l = l.strip()
-            fields = repat.split(l)
-            lon = float(fields[0])
-            lat = float(fields[1])
-            if lon == hp_lon and lat == hp_lat:
-                return float(fields[rp_index+3])
-
-        msg = ("HP (%.3f,%.3f) not found in file '%s'"
-               % (hp_lon, hp_lat, cfg.WaveAmplitudeFile))
-        raise RuntimeError(msg)
+        return wa.get_table().wh_from_rp(rp, hp)
 
     def get_RP_from_WH_HP(self, wh, wh_delta, hp):
         """Get return period given wave height and hazard point.
@@ -2576,48 +2718,17 @@ class AppFrame(wx.Frame):
         wh_delta  is the WH delat from the textbox
         hp        is a hazard point position tuple (lon, lat)
 
-        Return an 'appropriate' return period for wh and hp by grovelling
-        in 'WaveAmplitudeFile' file.  The return period appropriateness
+        Return an 'appropriate' return period for wh and hp from the in-memory
+        'WaveAmplitudeFile' table.  The return period appropriateness
         is up for discussion!
         """
 
-        # get contents of file
-        fd = open(cfg.WaveAmplitudeFile, 'r')
-        lines = fd.readlines()
-        fd.close()
-
-        repat = re.compile(' +')
-
-        # get possible return periods from first line
-        hdr = lines[0].strip()
-        periods = repat.split(hdr)
-        periods = [int(float(x)) for x in periods]
-
-        # unpack the hp position tuple
-        (hp_lon, hp_lat) = hp
-
-        # look through lines after header for line matching hp tuple
-        lon = None
-        for l in lines[1:]:
-            l = l.strip()
-            fields = repat.split(l)
-            lon = float(fields[0])
-            lat = float(fields[1])
-            if lon == hp_lon and lat == hp_lat:
-                break
-
-        if lon is None:
-            msg = ("HP (%.3f,%.3f) not found in file '%s'"
-                   % (hp_lon, hp_lat, cfg.WaveAmplitudeFile))
-            raise RuntimeError(msg)
-
-        # we have line matching HP - get list of waveheights
-        wh_list = [float(x) for x in fields[3:]]
+        table = wa.get_table()
+        periods = table.periods.tolist()
 
         # now get max and min RP given wh+delta and wh-delta
         # NOTE: these min/max are indices into periods (and wh)
-        min_rp = self.nearest_interpolate_index(wh_list, wh-wh_delta)
-        max_rp = self.nearest_interpolate_index(wh_list, wh+wh_delta)
+        (min_rp, max_rp) = table.rp_index_range(wh, wh_delta, hp)
 
         # now decide which RP in range [min_rp, max_rp] we will use
         if min_rp == max_rp:
@@ -2635,57 +2746,18 @@ class AppFrame(wx.Frame):
 
         return result
 
-    def nearest_interpolate_index(self, values, value):
-        """Get index of closest value in list matching value.
-
-        values  list of monotonically increasing values
-        value   value of interest
-
-        Return index of value in values matching value of interest.
-        """
-
-        # ensure list is monotonically increasing
-        values.sort()
-
-        # handle values outside range in values
-        if value <= values[0]:
-            return 0
-        if value >= values[-1]:
-            return len(values) - 1
-
-        for i in range(len(values)-1):
-            if values[i] <= value <= values[i+1]:
-                return i
-
-        msg = ("Problem in nearest_interpolate_index():\n"
-               "Value %d, list=%s\n"
-               "Didn't get interpolation termination!?"
-               % (value, str(values)))
-        raise RuntimeError(msg)
-
     def loadEvent2SubfaultData(self):
-        """Load dictionary that maps eventID -> subfaultID iterable.
+        """Load data that maps eventID -> subfaultID iterable.
 
-        Creates: eventid_2_subfaults    {<eventID>: (subfaultID, ...), ...}
+        Creates: event_catalogue    event catalogue (see tfile_cache.py)
+        Use tfc.event_subfaults(self.event_catalogue, <eventID>) to get
+        the subfault IDs for an event.
         """
 
-        # get data from file
-        fd = open(cfg.EventTFile, 'r')
-        lines = fd.readlines()
-        fd.close()
-
-        # trash the first line
-        lines = lines[1:]
-
-        # load into dictionary
-        self.eventid_2_subfaults = {}
-        repat = re.compile(' +')        # split on one or more spaces
-        for (i, l) in enumerate(lines):
-            l = l.strip()
-            (_, _, _, _, _, subfaults) = repat.split(l, maxsplit=5)
-            subfaults = repat.split(subfaults)
-            self.eventid_2_subfaults[i] = map(int, subfaults)
+        # get data from the memory-mapped catalogue, or the text file
+        self.event_catalogue = tfc.load_catalogue()
 
+    @log.timed()
     def loadSubfaultData(self):
         """Load dictionaries that maps subfault ID to zone name, etc.
 
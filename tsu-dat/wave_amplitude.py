@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""An in-memory table of the wave amplitude (o_amp_green) file.
+
+The file has a header line of return periods, then one line per hazard point:
+
+    lon lat <unused> wh_1 wh_2 ... wh_n
+
+where wh_i is the wave height at the HP for return period i.  We read the
+file once into numpy arrays with a (lon, lat) -> row index, and read it again
+only if it changes on disk.
+
+Used:
+    table = wave_amplitude.get_table()
+    wh = table.wh_from_rp(100, (lon, lat))
+"""
+
+
+import os
+import re
+
+import numpy as num
+
+import config as cfg
+import log
+log = log.Log()
+
+
+# pattern that will split fields in a string delimited by one or more spaces
+DelimPattern = re.compile(' +')
+
+# the table for cfg.WaveAmplitudeFile, loaded on first use
+Table = None
+
+
+def nearest_interpolate_index(values, value):
+    """Get index of closest value in sorted array matching value(s).
+
+    values  array of monotonically increasing values
+    value   value (or array of values) of interest
+
+    Returns the index i such that values[i] <= value <= values[i+1], or the
+    first/last index if value is outside the range of values.  If value is an
+    array, returns an array of indices.
+    """
+
+    last = len(values) - 1
+    index = num.searchsorted(values, value, side='left') - 1
+    index = num.clip(index, 0, last)
+
+    return num.where(value >= values[-1], last, index)
+
+
+class WaveAmplitudeTable(object):
+    """The wave amplitude file held as numpy arrays.
+
+    .periods     int array of return periods (columns)
+    .lon, .lat   float arrays of HP positions (rows)
+    .heights     float array (num_hp, num_periods) of wave heights
+    """
+
+    def __init__(self, filename):
+        """Load the wave amplitude file.
+
+        filename  path to the wave amplitude file
+        """
+
+        self.filename = filename
+        self.stamp = None
+        self.refresh()
+
+    def refresh(self):
+        """Reload the table if the file has changed on disk.
+
+        Returns True if the table was (re)loaded.
+        """
+
+        st = os.stat(self.filename)
+        stamp = (st.st_mtime, st.st_size)
+        if stamp == self.stamp:
+            return False
+
+        self.load()
+        self.stamp = stamp
+
+        return True
+
+    def load(self):
+        """Read the wave amplitude file into arrays and build the HP index."""
+
+        try:
+            fd = open(self.filename, 'r')
+            hdr = fd.readline().strip()
+            data = num.loadtxt(fd)
+            fd.close()
+        except (IOError, ValueError), e:
+            msg = "Error reading file '%s': %s" % (self.filename, str(e))
+            raise RuntimeError(msg)
+        if data.ndim == 1:
+            data = data.reshape((1, -1))
+
+        # get possible return periods from first line
+        self.periods = num.array([int(float(x))
+                                  for x in DelimPattern.split(hdr)])
+        self.period_index = dict([(p, i)
+                                  for (i, p) in enumerate(self.periods)])
+
+        self.lon = data[:,0]
+        self.lat = data[:,1]
+        self.heights = data[:,3:]
+
+        # map (lon, lat) -> row, the first row wins if duplicated
+        self.hp_index = {}
+        positions = zip(self.lon.tolist(), self.lat.tolist())
+        for (row, posn) in reversed(list(enumerate(positions))):
+            self.hp_index[posn] = row
+
+        log("WaveAmplitudeTable: loaded %d HPs x %d periods from '%s'"
+            % (self.heights.shape[0], self.heights.shape[1], self.filename))
+
+    def rp_index(self, rp):
+        """Get the column index for a return period.
+
+        rp  the return period
+        """
+
+        try:
+            return self.period_index[rp]
+        except KeyError:
+            msg = ("RP '%d' not found in line 1 of file '%s'"
+                   % (rp, self.filename))
+            raise RuntimeError(msg)
+
+    def hp_row(self, hp):
+        """Get the wave heights for one hazard point.
+
+        hp  a hazard point position tuple (lon, lat)
+
+        Returns an array of wave heights, one per return period.
+        """
+
+        try:
+            return self.heights[self.hp_index[hp]]
+        except KeyError:
+            (hp_lon, hp_lat) = hp
+            msg = ("HP (%.3f,%.3f) not found in file '%s'"
+                   % (hp_lon, hp_lat, self.filename))
+            raise RuntimeError(msg)
+
+    def hp_rows(self, positions):
+        """Get table rows for a sequence of HP positions.
+
+        positions  sequence of (lon, lat) tuples
+
+        Returns an int array of row indices, -1 where a position is unknown.
+        """
+
+        get = self.hp_index.get
+        return num.array([get(tuple(p[:2]), -1) for p in positions], num.int)
+
+    def wh_from_rp(self, rp, hp):
+        """Get the wave height for a return period at a hazard point.
+
+        rp  the return period
+        hp  a hazard point position tuple (lon, lat)
+        """
+
+        return float(self.hp_row(hp)[self.rp_index(rp)])
+
+    def rp_index_range(self, wh, wh_delta, hp):
+        """Get the range of return period indices for a wave height band.
+
+        wh        the wave height
+        wh_delta  the wave height delta
+        hp        a hazard point position tuple (lon, lat)
+
+        Returns a tuple (min_index, max_index) of indices into self.periods.
+        """
+
+        wh_list = num.sort(self.hp_row(hp))
+        (min_rp, max_rp) = nearest_interpolate_index(wh_list,
+                                                     num.array([wh-wh_delta,
+                                                                wh+wh_delta]))
+        return (int(min_rp), int(max_rp))
+
+
+def get_table():
+    """Get the table for cfg.WaveAmplitudeFile, reloaded if it has changed."""
+
+    global Table
+
+    if Table is None or Table.filename != cfg.WaveAmplitudeFile:
+        Table = WaveAmplitudeTable(cfg.WaveAmplitudeFile)
+    else:
+        Table.refresh()
+
+    return Table